@@ -3,7 +3,8 @@ import json
 import argparse
 import sqlite3
 import multiprocessing as mp
-from func_timeout import func_timeout, FunctionTimedOut
+from sqlite_pool import QueryTimeout, group_by_db
+from gold_cache import GoldCache, DEFAULT_CACHE_PATH, DEFAULT_MAX_RESULT_MB, execute_against_gold
 
 def load_json(dir):
     with open(dir, 'r') as j:
@@ -14,36 +15,28 @@ def result_callback(result):
     exec_result.append(result)
 
 
-def execute_sql(predicted_sql,ground_truth, db_path):
-    conn = sqlite3.connect(db_path)
-    # Connect to the database
-    cursor = conn.cursor()
-    cursor.execute(predicted_sql)
-    predicted_res = cursor.fetchall()
-    cursor.execute(ground_truth)
-    ground_truth_res = cursor.fetchall()
-    res = 0
-    if set(predicted_res) == set(ground_truth_res):
-        res = 1
-    return res
+def execute_sql(predicted_sql,ground_truth, db_path, gold=None, timeout=None, compare_options=None):
+    # Compares the predicted result with the cached gold result (the gold SQL only runs on a cache miss);
+    # SQLite aborts the statements with QueryTimeout after `timeout` seconds.
+    # The predicted rows are streamed and compared chunk by chunk (see compare_options in __main__)
+    return execute_against_gold(predicted_sql, ground_truth, db_path, gold, timeout, **(compare_options or {}))
 
 
 
-def execute_model(predicted_sql,ground_truth, db_place, idx, meta_time_out):
+def execute_model(predicted_sql,ground_truth, db_place, idx, meta_time_out, gold=None, compare_options=None):
+    new_gold = None
+    status = 'ok'
     try:
-        res = func_timeout(meta_time_out, execute_sql,
-                                  args=(predicted_sql, ground_truth, db_place))
+        res, new_gold = execute_sql(predicted_sql, ground_truth, db_place, gold, meta_time_out, compare_options)
     except KeyboardInterrupt:
         sys.exit(0)
-    except FunctionTimedOut:
-        result = [(f'timeout',)]
+    except QueryTimeout:
+        status = 'timeout'
         res = 0
     except Exception as e:
-        result = [(f'error',)]  # possibly len(query) > 512 or not executable
+        status = 'error'  # possibly len(query) > 512 or not executable
         res = 0
-    # print(result)
-    # result = str(set([ret[0] for ret in result]))
-    result = {'sql_idx': idx, 'res': res}
+    result = {'sql_idx': idx, 'res': res, 'gold': new_gold, 'status': status}
     # print(result)
     return result
 
@@ -72,12 +65,14 @@ def package_sqls(sql_path, db_root_path, mode='gpt', data_mode='dev'):
 
     return clean_sqls, db_path_list
 
-def run_sqls_parallel(sqls, db_places, num_cpus=1, meta_time_out=30.0):
+def run_sqls_parallel(sqls, db_places, num_cpus=1, meta_time_out=30.0, golds=None, compare_options=None):
     pool = mp.Pool(processes=num_cpus)
-    for i,sql_pair in enumerate(sqls):
+    # submit the tasks grouped by database so the workers reuse their pooled connections
+    for i in group_by_db(db_places):
 
-        predicted_sql, ground_truth = sql_pair
-        pool.apply_async(execute_model, args=(predicted_sql, ground_truth, db_places[i], i, meta_time_out), callback=result_callback)
+        predicted_sql, ground_truth = sqls[i]
+        gold = golds[i] if golds is not None else None
+        pool.apply_async(execute_model, args=(predicted_sql, ground_truth, db_places[i], i, meta_time_out, gold, compare_options), callback=result_callback)
     pool.close()
     pool.join()
 
@@ -128,6 +123,13 @@ if __name__ == '__main__':
     args_parser.add_argument('--meta_time_out', type=float, default=30.0)
     args_parser.add_argument('--mode_gt', type=str, default='gt')
     args_parser.add_argument('--mode_predict', type=str, default='gpt')
+    args_parser.add_argument('--gold_cache_path', type=str, default=DEFAULT_CACHE_PATH)
+    args_parser.add_argument('--no_gold_cache', action='store_true', help='execute the ground truth SQL on every run')
+    args_parser.add_argument('--multiset', action='store_true', help='compare results as multisets instead of sets')
+    args_parser.add_argument('--max_extra_rows', type=int, default=None,
+                             help='count a prediction as wrong once it returns this many rows more than the gold SQL')
+    args_parser.add_argument('--max_result_mb', type=int, default=DEFAULT_MAX_RESULT_MB,
+                             help='memory cap for the distinct rows of one gold result')
     args_parser.add_argument('--difficulty',type=str,default='simple')
     args_parser.add_argument('--diff_json_path',type=str,default='')
     args = args_parser.parse_args()
@@ -140,8 +142,24 @@ if __name__ == '__main__':
                                            data_mode=args.data_mode)
 
     query_pairs = list(zip(pred_queries,gt_queries))
-    run_sqls_parallel(query_pairs, db_places=db_paths, num_cpus=args.num_cpus, meta_time_out=args.meta_time_out)
+    # look up the gold results by (database file hash, gold SQL); only the misses execute the gold SQL
+    gold_cache = None if args.no_gold_cache else GoldCache(args.gold_cache_path)
+    gold_keys = gold_cache.keys(db_paths, gt_queries) if gold_cache else None
+    golds = gold_cache.get_many(gold_keys) if gold_cache else None
+    if gold_cache:
+        print(f"Gold result cache: {sum(gold is not None for gold in golds)}/{len(golds)} cached")
+    compare_options = {'multiset': args.multiset, 'max_extra_rows': args.max_extra_rows, 'max_result_mb': args.max_result_mb}
+    run_sqls_parallel(query_pairs, db_places=db_paths, num_cpus=args.num_cpus, meta_time_out=args.meta_time_out,
+                      golds=golds, compare_options=compare_options)
     exec_result = sort_results(exec_result)
+    # store the gold results computed in this run (cache misses)
+    new_golds = [(result['sql_idx'], result.pop('gold')) for result in exec_result]
+    if gold_cache:
+        gold_cache.put_many((gold_keys[idx], gold) for idx, gold in new_golds)
+    # timeouts (aborted by SQLite at meta_time_out) are reported separately from errors; both score 0
+    timeouts = sum(result['status'] == 'timeout' for result in exec_result)
+    errors = sum(result['status'] == 'error' for result in exec_result)
+    print(f"Timeouts: {timeouts}, errors: {errors}")
     
     print('start calculate')
     simple_acc, moderate_acc, challenging_acc, acc, count_lists = \
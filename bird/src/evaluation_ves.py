@@ -6,9 +6,10 @@ import numpy as np
 import argparse
 import sqlite3
 import multiprocessing as mp
-from func_timeout import func_timeout, FunctionTimedOut
 import time
 import math
+from sqlite_pool import TIMING_PROGRESS_STEPS, QueryTimeout, get_connection, time_limit, group_by_db
+from gold_cache import DEFAULT_MAX_RESULT_MB, FETCH_ROWS, iter_chunks, summarize_chunks, compare_chunks
 
 def result_callback(result):
     exec_result.append(result)
@@ -23,53 +24,121 @@ def clean_abnormal(input):
             processed_list.append(x)
     return processed_list
 
-def execute_sql(sql, db_path):
-    # Connect to the database
+def remaining_time(deadline):
+    return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+def execute_sql(sql, db_path, deadline=None):
+    # Legacy timing: a fresh connection for every run, as in the original VES (not the pooled, warmed connection)
     conn = sqlite3.connect(db_path)
-    # Create a cursor object
-    cursor = conn.cursor()
-    start_time = time.time()
-    cursor.execute(sql)
-    exec_time = time.time() - start_time
+    try:
+        # the deadline is only checked every TIMING_PROGRESS_STEPS instructions
+        with time_limit(conn, remaining_time(deadline), steps=TIMING_PROGRESS_STEPS):
+            cursor = conn.cursor()
+            start_time = time.time()
+            cursor.execute(sql)
+            exec_time = time.time() - start_time
+    finally:
+        conn.close()
     return exec_time
 
-def iterated_execute_sql(predicted_sql,ground_truth,db_path,iterate_num):
-    conn = sqlite3.connect(db_path)
+def timed_execute_ns(cursor, sql):
+    # execute + fetch of every row (in chunks, not kept) with a nanosecond clock
+    start_time = time.perf_counter_ns()
+    cursor.execute(sql)
+    while cursor.fetchmany(FETCH_ROWS):
+        pass
+    return time.perf_counter_ns() - start_time
+
+def mean_ratio(diff_list):
+    processed_diff_list = clean_abnormal(diff_list)
+    # clean_abnormal drops every value when they are all identical (std = 0)
+    if not processed_diff_list:
+        processed_diff_list = diff_list
+    return sum(processed_diff_list) / len(processed_diff_list), processed_diff_list
+
+def adaptive_time_ratio(predicted_sql, ground_truth, db_path, max_runs=100, min_runs=5, warmup_runs=1, ci_rel_width=0.05):
+    """
+    Time ratio (gold / predicted) measured on this worker's warmed, persistent connection.
+    Predicted and gold runs alternate in order (pred-gold, gold-pred, ...) so drift affects both;
+    runs stop once the 95% confidence interval of the mean ratio is within ci_rel_width of the mean
+    (after at least min_runs, at most max_runs). Returns (time_ratio, number of timed runs).
+    """
+    cursor = get_connection(db_path).cursor()
+    for _ in range(warmup_runs):
+        timed_execute_ns(cursor, predicted_sql)
+        timed_execute_ns(cursor, ground_truth)
+    diff_list = []
+    for i in range(max_runs):
+        if i % 2 == 0:
+            predicted_time = timed_execute_ns(cursor, predicted_sql)
+            ground_truth_time = timed_execute_ns(cursor, ground_truth)
+        else:
+            ground_truth_time = timed_execute_ns(cursor, ground_truth)
+            predicted_time = timed_execute_ns(cursor, predicted_sql)
+        diff_list.append(ground_truth_time / max(predicted_time, 1))
+        if len(diff_list) >= min_runs:
+            mean, processed_diff_list = mean_ratio(diff_list)
+            half_width = 1.96 * np.std(processed_diff_list, ddof=1) / math.sqrt(len(processed_diff_list)) \
+                if len(processed_diff_list) > 1 else 0.0
+            if half_width <= ci_rel_width * mean:
+                break
+    cursor.close()
+    return mean_ratio(diff_list)[0], len(diff_list)
+
+def iterated_execute_sql(predicted_sql,ground_truth,db_path,iterate_num,timing_options=None,time_out=None):
+    timing_options = timing_options or {'timing': 'legacy'}
     diff_list = []
-    cursor = conn.cursor()
-    cursor.execute(predicted_sql)
-    predicted_res = cursor.fetchall()
-    cursor.execute(ground_truth)
-    ground_truth_res = cursor.fetchall()
+    conn = get_connection(db_path)
+    deadline = None if time_out is None else time.monotonic() + time_out
+    # SQLite aborts the running statement once time_out (shared by the check and the timed runs) has passed
+    with time_limit(conn, time_out):
+        cursor = conn.cursor()
+        # stream both results in chunks: the gold rows are hashed, then the predicted rows are checked against them
+        cursor.execute(ground_truth)
+        gold = summarize_chunks(iter_chunks(cursor), DEFAULT_MAX_RESULT_MB)
+        cursor.execute(predicted_sql)
+        same_result = compare_chunks(iter_chunks(cursor), gold)
+        cursor.close()
     time_ratio = 0
-    if set(predicted_res) == set(ground_truth_res):
+    runs = 0
+    if not same_result:
+        return time_ratio, runs
+    if timing_options['timing'] == 'adaptive':
+        # the pooled connection; the deadline is only checked every TIMING_PROGRESS_STEPS instructions
+        options = {key: value for key, value in timing_options.items() if key != 'timing'}
+        with time_limit(conn, remaining_time(deadline), steps=TIMING_PROGRESS_STEPS):
+            time_ratio, runs = adaptive_time_ratio(predicted_sql, ground_truth, db_path, max_runs=iterate_num, **options)
+    else:
         for i in range(iterate_num):
-            predicted_time = execute_sql(predicted_sql, db_path)
-            ground_truth_time = execute_sql(ground_truth, db_path)
+            predicted_time = execute_sql(predicted_sql, db_path, deadline)
+            ground_truth_time = execute_sql(ground_truth, db_path, deadline)
             diff_list.append(ground_truth_time / predicted_time)
         processed_diff_list = clean_abnormal(diff_list)
         time_ratio = sum(processed_diff_list) / len(processed_diff_list)
-    return time_ratio
+        runs = iterate_num
+    return time_ratio, runs
 
 
 
-def execute_model(predicted_sql,ground_truth, db_place, idx, iterate_num, meta_time_out):
+def execute_model(predicted_sql,ground_truth, db_place, idx, iterate_num, meta_time_out, timing_options=None):
+    status = 'ok'
+    runs = 0
     try:
         # you can personalize the total timeout number
         # larger timeout leads to more stable ves
         # while it needs more your patience....
-        time_ratio = func_timeout(meta_time_out * iterate_num, iterated_execute_sql,
-                                  args=(predicted_sql, ground_truth, db_place, iterate_num))
+        time_ratio, runs = iterated_execute_sql(predicted_sql, ground_truth, db_place, iterate_num, timing_options,
+                                                time_out=meta_time_out * iterate_num)
         # print([idx, math.sqrt(time_ratio)])
     except KeyboardInterrupt:
         sys.exit(0)
-    except FunctionTimedOut:
-        result = [(f'timeout',)]
+    except QueryTimeout:
+        status = 'timeout'
         time_ratio = 0
     except Exception as e:
-        result = [(f'error',)]  # possibly len(query) > 512 or not executable
+        status = 'error'  # possibly len(query) > 512 or not executable
         time_ratio = 0
-    result = {'sql_idx': idx, 'time_ratio': time_ratio}
+    result = {'sql_idx': idx, 'time_ratio': time_ratio, 'status': status, 'runs': runs}
     return result
 
 
@@ -96,11 +165,12 @@ def package_sqls(sql_path, db_root_path, mode='gpt', data_mode='dev'):
 
     return clean_sqls, db_path_list
 
-def run_sqls_parallel(sqls, db_places, num_cpus=1, iterate_num=100, meta_time_out=30.0):
+def run_sqls_parallel(sqls, db_places, num_cpus=1, iterate_num=100, meta_time_out=30.0, timing_options=None):
     pool = mp.Pool(processes=num_cpus)
-    for i,sql_pair in enumerate(sqls):
-        predicted_sql, ground_truth = sql_pair
-        pool.apply_async(execute_model, args=(predicted_sql, ground_truth, db_places[i], i, iterate_num, meta_time_out), callback=result_callback)
+    # submit the tasks grouped by database so the workers reuse their pooled connections
+    for i in group_by_db(db_places):
+        predicted_sql, ground_truth = sqls[i]
+        pool.apply_async(execute_model, args=(predicted_sql, ground_truth, db_places[i], i, iterate_num, meta_time_out, timing_options), callback=result_callback)
     pool.close()
     pool.join()
 
@@ -161,6 +231,15 @@ if __name__ == '__main__':
     args_parser.add_argument('--mode_gt', type=str, default='gt')
     args_parser.add_argument('--mode_predict', type=str, default='gpt')
     args_parser.add_argument('--diff_json_path',type=str,default='')
+    # legacy (default, as in the original VES): a new connection per run, time.time() around execute only, always iterate_num runs
+    # adaptive: the worker's pooled connection, perf_counter_ns around execute + fetch, interleaved runs,
+    # stop when the ratio's CI is tight enough
+    args_parser.add_argument('--timing', type=str, choices=['adaptive', 'legacy'], default='legacy')
+    args_parser.add_argument('--iterate_num', type=int, default=100, help='(maximum) timed runs per query pair')
+    args_parser.add_argument('--min_runs', type=int, default=5)
+    args_parser.add_argument('--warmup_runs', type=int, default=1)
+    args_parser.add_argument('--ci_rel_width', type=float, default=0.05,
+                             help='stop once the 95%% CI half-width of the mean ratio is below this fraction of the mean')
     args = args_parser.parse_args()
     exec_result = []
     
@@ -171,8 +250,19 @@ if __name__ == '__main__':
                                            data_mode=args.data_mode)
 
     query_pairs = list(zip(pred_queries, gt_queries))
-    run_sqls_parallel(query_pairs, db_places=db_paths, num_cpus=args.num_cpus, meta_time_out=args.meta_time_out)
+    timing_options = {'timing': args.timing}
+    if args.timing == 'adaptive':
+        timing_options.update(min_runs=args.min_runs, warmup_runs=args.warmup_runs, ci_rel_width=args.ci_rel_width)
+    run_sqls_parallel(query_pairs, db_places=db_paths, num_cpus=args.num_cpus, iterate_num=args.iterate_num,
+                      meta_time_out=args.meta_time_out, timing_options=timing_options)
     exec_result = sort_results(exec_result)
+    # timeouts (aborted by SQLite) are reported separately from errors; both give a time ratio of 0
+    timeouts = sum(result['status'] == 'timeout' for result in exec_result)
+    errors = sum(result['status'] == 'error' for result in exec_result)
+    print(f"Timeouts: {timeouts}, errors: {errors}")
+    timed_results = [result['runs'] for result in exec_result if result['runs'] > 0]
+    if timed_results:
+        print(f"Timing ({args.timing}): {sum(timed_results) / len(timed_results):.1f} runs per correct query on average")
     print('start calculate')
     simple_ves, moderate_ves, challenging_ves, ves, count_lists = \
         compute_ves_by_diff(exec_result, args.diff_json_path)
@@ -0,0 +1,355 @@
+import argparse
+import hashlib
+import multiprocessing as mp
+import os
+import sqlite3
+import time
+from sqlite_pool import QueryTimeout, get_connection, time_limit
+
+"""
+This module implements a persistent cache of ground-truth (gold) SQL results for the evaluation scripts.
+Gold results never change for a given database file, so they are keyed by (SHA-1 of the .sqlite file, gold SQL)
+and stored once in a small SQLite file; an evaluation run then only executes the predicted SQL.
+A result set is stored compactly as its distinct rows hashed to 16-byte digests, sorted, with a count per digest
+(the row multiset), plus a short text preview for the CSV log. Comparing a prediction against the gold result
+only needs the digests of the predicted rows, which are streamed with fetchmany and checked as they arrive:
+the first row that is not in the gold result ends the comparison, so a huge (e.g. cross-joined) prediction
+is never materialized and memory stays bounded by the size of the gold result.
+Database file hashes are remembered by (path, size, mtime), so large databases are hashed once.
+
+Warm-up (fills the cache in parallel before evaluating):
+    python3 -u ./src/gold_cache.py --gold_sql_file ./data/dev/dev_gold.sql --db_root_path ./data/dev/dev_databases/ --num_cpus 16
+"""
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gold_results", "gold_results.sqlite")
+DIGEST_SIZE = 16
+PREVIEW_ROWS = 4
+FETCH_ROWS = 10000
+# Approximate memory of one distinct row while counting (16-byte key, count and dict slot)
+DIGEST_ENTRY_BYTES = 128
+DEFAULT_MAX_RESULT_MB = 512
+
+
+class ResultTooLarge(Exception):
+    """
+    Raised when the distinct rows of a result would need more than the per-query memory cap.
+    """
+
+
+def row_digest(row):
+    """
+    16-byte digest of a result row. Values that compare equal in Python get the same digest
+    (an integral float and the equal int, as in set(predicted_res) == set(ground_truth_res)).
+    """
+    parts = []
+    for value in row:
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        if value is None:
+            parts.append(b"n")
+        elif isinstance(value, int):
+            parts.append(b"i" + str(value).encode())
+        elif isinstance(value, float):
+            parts.append(b"f" + repr(value).encode())
+        elif isinstance(value, bytes):
+            parts.append(b"b" + value.hex().encode())
+        else:
+            parts.append(b"s" + str(value).encode("utf-8", "surrogatepass"))
+    # Length prefixes keep the encoding unambiguous
+    encoded = b"".join(len(part).to_bytes(4, "little") + part for part in parts)
+    return hashlib.blake2b(encoded, digest_size=DIGEST_SIZE).digest()
+
+
+def preview(rows):
+    """
+    Text shown in the CSV log for a result: the first PREVIEW_ROWS rows, as truncate_result prints them.
+    """
+    if len(rows) > PREVIEW_ROWS:
+        rows = rows[:PREVIEW_ROWS] + [('... truncated',)]
+    return str(rows)
+
+
+def iter_chunks(cursor, size=FETCH_ROWS):
+    while True:
+        chunk = cursor.fetchmany(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def summarize_chunks(chunks, max_result_mb=None):
+    """
+    Cache entry of a result set given as chunks of rows:
+    {"status": "ok", "n_rows", "digests" (sorted, concatenated), "counts", "preview"}.
+    Raises ResultTooLarge once the distinct rows would need more than max_result_mb.
+    """
+    max_distinct = max_result_mb * 1024 * 1024 // DIGEST_ENTRY_BYTES if max_result_mb is not None else None
+    counts = {}
+    n_rows = 0
+    first_rows = []
+    for chunk in chunks:
+        if len(first_rows) <= PREVIEW_ROWS:
+            first_rows += chunk[:PREVIEW_ROWS + 1 - len(first_rows)]
+        n_rows += len(chunk)
+        for row in chunk:
+            digest = row_digest(row)
+            counts[digest] = counts.get(digest, 0) + 1
+        if max_distinct is not None and len(counts) > max_distinct:
+            raise ResultTooLarge(f"more than {max_distinct} distinct rows")
+    digests = sorted(counts)
+    return {
+        "status": "ok",
+        "n_rows": n_rows,
+        "digests": b"".join(digests),
+        "counts": b"".join(counts[digest].to_bytes(4, "little") for digest in digests),
+        "preview": preview(first_rows)
+    }
+
+
+def summarize_rows(rows):
+    return summarize_chunks([rows])
+
+
+def error_entry(e):
+    """
+    Cache entry of a gold SQL that fails to execute (never equal to a prediction).
+    """
+    return {"status": "error", "n_rows": 0, "digests": b"", "counts": b"", "preview": str([(f'error: {e}',)])}
+
+
+def digest_counts(entry):
+    digests, counts = entry["digests"], entry["counts"]
+    return {
+        digests[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE]: int.from_bytes(counts[i * 4:(i + 1) * 4], "little")
+        for i in range(len(digests) // DIGEST_SIZE)
+    }
+
+
+def compare_chunks(chunks, gold, multiset=False, max_extra_rows=None):
+    """
+    Order-insensitive comparison of streamed predicted rows with a gold entry: as sets, like
+    set(predicted_res) == set(ground_truth_res), or as multisets (every row the same number of times).
+    Stops at the first row that is not in the gold result, at a row that occurs more often than in the
+    gold result (multiset), or once there are more than max_extra_rows rows beyond the gold row count.
+    Only digests of gold rows are kept, so memory is bounded by the gold result. Returns 1 or 0.
+    """
+    if gold["status"] != "ok":
+        return 0
+    gold_counts = digest_counts(gold)
+    seen = {}
+    n_rows = 0
+    for chunk in chunks:
+        n_rows += len(chunk)
+        if max_extra_rows is not None and n_rows > gold["n_rows"] + max_extra_rows:
+            return 0
+        for row in chunk:
+            digest = row_digest(row)
+            if digest not in gold_counts:
+                return 0
+            seen[digest] = seen.get(digest, 0) + 1
+            if multiset and seen[digest] > gold_counts[digest]:
+                return 0
+    if multiset:
+        return 1 if n_rows == gold["n_rows"] else 0
+    return 1 if len(seen) == len(gold_counts) else 0
+
+
+def execute_against_gold(predicted_sql, ground_truth, db_path, gold=None, timeout=None,
+                         multiset=False, max_extra_rows=None, max_result_mb=DEFAULT_MAX_RESULT_MB):
+    """
+    Executes predicted_sql and compares its rows, streamed in chunks, with the gold result.
+    The gold SQL is only executed (first) when gold is None, and raises ResultTooLarge beyond max_result_mb.
+    Both statements together are aborted with QueryTimeout after `timeout` seconds.
+    Returns (res, gold entry if it was computed here, else None).
+    """
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+    try:
+        with time_limit(conn, timeout):
+            new_gold = None
+            if gold is None:
+                cursor.execute(ground_truth)
+                gold = new_gold = summarize_chunks(iter_chunks(cursor), max_result_mb)
+            cursor.execute(predicted_sql)
+            res = compare_chunks(iter_chunks(cursor), gold, multiset, max_extra_rows)
+        return res, new_gold
+    finally:
+        cursor.close()
+
+
+def run_gold_sql(db_path, sql, timeout=None, max_result_mb=DEFAULT_MAX_RESULT_MB):
+    """
+    Cache entry of a gold SQL, or None if it times out or exceeds max_result_mb
+    (both depend on the machine and the settings, so they are not cached).
+    """
+    try:
+        conn = get_connection(db_path)
+        cursor = conn.cursor()
+        try:
+            with time_limit(conn, timeout):
+                cursor.execute(sql)
+                return summarize_chunks(iter_chunks(cursor), max_result_mb)
+        finally:
+            cursor.close()
+    except (QueryTimeout, ResultTooLarge):
+        return None
+    except Exception as e:
+        return error_entry(e)
+
+
+def _warm_up_one(task):
+    key, db_path, sql, meta_time_out, max_result_mb = task
+    return key, run_gold_sql(db_path, sql, timeout=meta_time_out, max_result_mb=max_result_mb)
+
+
+class GoldCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS gold_results (
+                key TEXT PRIMARY KEY,
+                status TEXT,
+                n_rows INTEGER,
+                digests BLOB,
+                counts BLOB,
+                preview TEXT
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS db_hashes (
+                db_path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                sha1 TEXT
+            )
+        """)
+        self.conn.commit()
+        self._db_hashes = {}
+
+    def db_hash(self, db_path):
+        """
+        SHA-1 of the database file, recomputed only when its size or mtime changes.
+        """
+        db_path = os.path.abspath(db_path)
+        stat = os.stat(db_path)
+        if db_path in self._db_hashes and self._db_hashes[db_path][:2] == (stat.st_size, stat.st_mtime_ns):
+            return self._db_hashes[db_path][2]
+        row = self.conn.execute("SELECT size, mtime_ns, sha1 FROM db_hashes WHERE db_path = ?", (db_path,)).fetchone()
+        if row is None or tuple(row[:2]) != (stat.st_size, stat.st_mtime_ns):
+            digest = hashlib.sha1()
+            with open(db_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+            row = (stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+            self.conn.execute("INSERT OR REPLACE INTO db_hashes VALUES (?, ?, ?, ?)", (db_path, *row))
+            self.conn.commit()
+        self._db_hashes[db_path] = tuple(row)
+        return row[2]
+
+    def key(self, db_path, sql):
+        return hashlib.sha1(f"{self.db_hash(db_path)}\t{sql.strip()}".encode("utf-8")).hexdigest()
+
+    def keys(self, db_paths, sqls):
+        """
+        The key of every (db_path, sql) pair, or None where the database file cannot be read
+        (that task is not cached, and its worker reports the missing database as an error).
+        """
+        keys = []
+        for db_path, sql in zip(db_paths, sqls):
+            try:
+                keys.append(self.key(db_path, sql))
+            except OSError:
+                keys.append(None)
+        return keys
+
+    def get(self, key):
+        if key is None:
+            return None
+        row = self.conn.execute(
+            "SELECT status, n_rows, digests, counts, preview FROM gold_results WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        status, n_rows, digests, counts, preview_text = row
+        return {"status": status, "n_rows": n_rows, "digests": bytes(digests), "counts": bytes(counts),
+                "preview": preview_text}
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def put_many(self, items):
+        """
+        Stores (key, entry) pairs; pairs whose key or entry is None are skipped.
+        """
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO gold_results VALUES (?, ?, ?, ?, ?, ?)",
+            [(key, entry["status"], entry["n_rows"], entry["digests"], entry["counts"], entry["preview"])
+             for key, entry in items if key is not None and entry is not None]
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def load_gold_sqls(gold_sql_file, db_root_path):
+    """
+    (gold SQL, database path) per line of a <data_mode>_gold.sql file ("SQL<TAB>db_id").
+    """
+    with open(gold_sql_file, 'r') as f:
+        lines = [line.strip() for line in f if line.strip()]
+    gold = []
+    for line in lines:
+        sql, db_name = line.split('\t')
+        gold.append((sql, db_root_path + db_name + '/' + db_name + '.sqlite'))
+    return gold
+
+
+def warm_up(cache, gold, num_cpus=1, meta_time_out=30.0, max_result_mb=DEFAULT_MAX_RESULT_MB):
+    """
+    Executes every (gold SQL, db path) that is not cached yet, in parallel, and stores the results.
+    Returns the number of newly cached results.
+    """
+    tasks = {}
+    # Grouped by database so each worker reuses its pooled connections
+    for sql, db_path in sorted(gold, key=lambda pair: pair[1]):
+        key = cache.key(db_path, sql)
+        if key not in tasks and cache.get(key) is None:
+            tasks[key] = (key, db_path, sql, meta_time_out, max_result_mb)
+    print(f"{len(gold)} gold queries, {len(tasks)} not cached")
+    if not tasks:
+        return 0
+
+    start_time = time.time()
+    stored = 0
+    batch = []
+    with mp.Pool(processes=num_cpus) as pool:
+        for i, (key, entry) in enumerate(pool.imap_unordered(_warm_up_one, tasks.values()), 1):
+            if entry is None:
+                print(f"Timeout or result too large: {tasks[key][2]}")
+            else:
+                batch.append((key, entry))
+            if len(batch) >= 100 or i == len(tasks):
+                cache.put_many(batch)
+                stored += len(batch)
+                batch = []
+                print(f"{i}/{len(tasks)} gold queries executed ({time.time() - start_time:.1f}s)")
+    return stored
+
+
+if __name__ == '__main__':
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument('--gold_sql_file', type=str, required=True)
+    args_parser.add_argument('--db_root_path', type=str, required=True)
+    args_parser.add_argument('--num_cpus', type=int, default=1)
+    args_parser.add_argument('--meta_time_out', type=float, default=30.0)
+    args_parser.add_argument('--cache_path', type=str, default=DEFAULT_CACHE_PATH)
+    args_parser.add_argument('--max_result_mb', type=int, default=DEFAULT_MAX_RESULT_MB)
+    args = args_parser.parse_args()
+
+    cache = GoldCache(args.cache_path)
+    stored = warm_up(cache, load_gold_sqls(args.gold_sql_file, args.db_root_path),
+                     num_cpus=args.num_cpus, meta_time_out=args.meta_time_out, max_result_mb=args.max_result_mb)
+    cache.close()
+    print(f"Cached {stored} gold results in {args.cache_path}")
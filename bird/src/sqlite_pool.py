@@ -0,0 +1,77 @@
+import os
+import pathlib
+import sqlite3
+import time
+from contextlib import contextmanager
+
+"""
+This module keeps a per-process pool of read-only SQLite connections for the evaluation workers.
+Every question of a split hits one of a handful of databases, so a worker opens each database once
+(file:...?mode=ro&immutable=1, with mmap, a larger page cache and in-memory temp storage) and reuses
+the connection for every task instead of connecting per query pair.
+Timeouts are enforced inside SQLite: time_limit installs a progress handler that aborts the running
+statement once its deadline has passed, so a runaway query stops instead of running on in a background thread.
+"""
+
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KIB = 64 * 1024
+# Number of SQLite VM instructions between two deadline checks
+PROGRESS_STEPS = 1000
+# Coarser checks for timed runs, so the Python handler adds no measurable time to what is being timed
+TIMING_PROGRESS_STEPS = 1000000
+
+_connections = {}
+
+
+class QueryTimeout(Exception):
+    """
+    Raised when a statement is aborted by time_limit because its deadline has passed.
+    """
+
+
+def connection_uri(db_path):
+    return pathlib.Path(db_path).resolve().as_uri() + "?mode=ro&immutable=1"
+
+
+def get_connection(db_path):
+    """
+    The pooled read-only connection of db_path in this process (opened on first use).
+    """
+    key = os.path.abspath(db_path)
+    conn = _connections.get(key)
+    if conn is None:
+        conn = sqlite3.connect(connection_uri(db_path), uri=True)
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        _connections[key] = conn
+    return conn
+
+
+@contextmanager
+def time_limit(conn, seconds, steps=PROGRESS_STEPS):
+    """
+    Aborts any statement run on conn inside the block once `seconds` have passed (no limit if None),
+    raising QueryTimeout. The deadline is checked every `steps` SQLite VM instructions.
+    The connection stays usable afterwards.
+    """
+    if seconds is None:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, steps)
+    try:
+        yield
+    except sqlite3.OperationalError as e:
+        if time.monotonic() > deadline:
+            raise QueryTimeout(f"query exceeded {seconds}s") from e
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+
+
+def group_by_db(db_places):
+    """
+    Task indices ordered by database (stable within a database), so consecutive tasks reuse the pooled connections.
+    """
+    return sorted(range(len(db_places)), key=lambda i: db_places[i])
@@ -3,14 +3,19 @@ import re
 import numpy as np
 import pandas as pd
 import joblib
-from sentence_transformers import SentenceTransformer
+import os
+import sys
+
+# เพิ่ม root ของ repo ใน sys.path เพื่อ import โมดูลที่ใช้ร่วมกัน
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from embed_and_vector_store.embedding_cache import CachedEncoder
 
 # ---------- STEP 1: Load Model and Preprocessors ----------
 model = joblib.load("resource/lgbm_smote_class2_model.joblib")
 scaler = joblib.load("resource/scaler.joblib")
 svd_question = joblib.load("resource/svd_question.joblib")
 svd_sql = joblib.load("resource/svd_sql.joblib")
-embedder = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+embedder = CachedEncoder("sentence-transformers/all-MiniLM-L6-v2", normalize_embeddings=True)
 
 # ---------- STEP 2: Handcrafted Feature Extractor ----------
 def extract_sql_features(sql):
@@ -61,11 +66,11 @@ feature_df = pd.DataFrame(feature_list.tolist())
 feature_scaled = scaler.transform(feature_df)
 
 print("Encoding and reducing question embeddings...")
-question_embeddings = embedder.encode(df["question"].tolist(), normalize_embeddings=True)
+question_embeddings = embedder.encode(df["question"].tolist())
 question_reduced = svd_question.transform(question_embeddings)
 
 print("Encoding and reducing SQL embeddings...")
-sql_embeddings = embedder.encode(df["query"].tolist(), normalize_embeddings=True)
+sql_embeddings = embedder.encode(df["query"].tolist())
 sql_reduced = svd_sql.transform(sql_embeddings)
 
 X_combined = np.hstack([feature_scaled, question_reduced, sql_reduced])
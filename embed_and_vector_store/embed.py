@@ -1,7 +1,27 @@
 import json
-from sentence_transformers import SentenceTransformer
+import time
+import hashlib
 import chromadb
 import ast
+from embedding_cache import CachedEncoder
+
+# โหลด Train set
+train_file = 'bird/data/train/train_bird_th.json'
+
+# โมเดล embedding
+embedding_model_name = 'sentence-transformers/paraphrase-multilingual-mpnet-base-v2'
+
+# กำหนด path
+persist_directory = "vector_store/"
+
+collection_name = "bird_train_rag_para_v2_cosine"
+
+# ขนาด batch ตอน encode และจำนวน process (0 = ใช้ process เดียว, > 0 = ใช้ multi-process pool บน CPU)
+encode_batch_size = 64
+num_encode_processes = 0
+
+# True = อัปเดตเฉพาะ record ที่เพิ่ม/เปลี่ยน และลบ record ที่ไม่มีแล้ว, False = ลบ collection แล้วสร้างใหม่ทั้งหมด
+incremental = True
 
 def batch_add_to_collection(collection, ids, embeddings, documents, metadatas, batch_size=1000):
     total = len(ids)
@@ -15,87 +35,192 @@ def batch_add_to_collection(collection, ids, embeddings, documents, metadatas, b
             metadatas=metadatas[start:end]
         )
 
-# โหลด Train set
-train_file = 'bird/data/train/train_bird_th.json'
-with open(train_file, 'r', encoding='utf-8') as f:
-    train_data = json.load(f)
-
-# โหลดโมเดล embedding (BAAI/bge-m3)
-embedding_model = SentenceTransformer('sentence-transformers/paraphrase-multilingual-mpnet-base-v2')
-
-# กำหนด path
-persist_directory = "vector_store/"
-
-# ใช้ PersistentClient แบบใหม่
-client = chromadb.PersistentClient(path=persist_directory)
-
-collection_name = "bird_train_rag_para_v2_cosine"
+def batch_upsert_to_collection(collection, ids, embeddings, documents, metadatas, batch_size=1000):
+    total = len(ids)
+    for start in range(0, total, batch_size):
+        end = start + batch_size
+        print(f"[BATCH] Upserting records {start} to {min(end, total)} / {total}")
+        collection.upsert(
+            ids=ids[start:end],
+            embeddings=embeddings[start:end],
+            documents=documents[start:end],
+            metadatas=metadatas[start:end]
+        )
 
-# ลบ collection เดิมก่อน ถ้ามี
-if collection_name in [col.name for col in client.list_collections()]:
-    client.delete_collection(collection_name)
-    print(f"[INFO] Deleted existing collection: {collection_name}")
-
-collection = client.create_collection(
-    name=collection_name,
-    metadata={"hnsw:space": "cosine"}
-)
-
-all_ids = []
-all_embeddings = []
-all_documents = []
-all_metadatas = []
-
-for i, item in enumerate(train_data, start=1):
-    print(f"Process: {i}/{len(train_data)}")
-    question_id = item['question_id']
-    question = item['question']
-    question_th = item.get('question_th', '')
-    sql = item.get('SQL', '')
-    tables_raw = item.get('table', [])
-    tables = []
-    # print(f"[DEBUG] q{item.get('question_id')}: raw table = {tables_raw} | type = {type(tables_raw)}")
+def batch_delete_from_collection(collection, ids, batch_size=1000):
+    total = len(ids)
+    for start in range(0, total, batch_size):
+        end = start + batch_size
+        print(f"[BATCH] Deleting records {start} to {min(end, total)} / {total}")
+        collection.delete(ids=ids[start:end])
 
+# ฟังก์ชันแปลง field table ให้เป็น list ของชื่อตาราง
+def parse_tables(tables_raw, question_id):
     if isinstance(tables_raw, str):
         try:
             parsed = ast.literal_eval(tables_raw)
             if isinstance(parsed, list):
-                tables = [str(t) for t in parsed]
-            else:
-                tables = [str(parsed)]
+                return [str(t) for t in parsed]
+            return [str(parsed)]
         except (ValueError, SyntaxError):
-            print(f"[WARNING] Failed to parse table for q{item.get('question_id')}: {tables_raw}")
-            tables = [tables_raw]
-    elif isinstance(tables_raw, list):
-        tables = [str(t) for t in tables_raw]
+            print(f"[WARNING] Failed to parse table for q{question_id}: {tables_raw}")
+            return [tables_raw]
+    if isinstance(tables_raw, list):
+        return [str(t) for t in tables_raw]
+    return [str(tables_raw)]
+
+# hash ของ (question, question_th, SQL, table) ใช้ตรวจว่า record เปลี่ยนไปจากที่อยู่ใน collection หรือไม่
+def compute_record_hash(question, question_th, sql, table_text):
+    payload = json.dumps([question, question_th, sql, table_text], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# รวบรวม id / document / metadata ของคำถามภาษาอังกฤษและภาษาไทยทั้งหมด (เรียงตรงกันทุก list)
+def build_records(train_data):
+    all_ids = []
+    all_documents = []
+    all_metadatas = []
+
+    for item in train_data:
+        question_id = item['question_id']
+        question = item['question']
+        question_th = item.get('question_th', '')
+        sql = item.get('SQL', '')
+        tables = parse_tables(item.get('table', []), question_id)
+        table_text = ', '.join(tables) if tables else ''
+        record_hash = compute_record_hash(question, question_th, sql, table_text)
+
+        if question:
+            all_ids.append(f"q{question_id}_en")
+            all_documents.append(question)
+            all_metadatas.append({
+                "language": "en",
+                "question_eng": question,
+                "question_th": question_th,
+                "SQL": sql,
+                "table": table_text,
+                "record_hash": record_hash
+            })
+
+        if question_th:
+            all_ids.append(f"q{question_id}_th")
+            all_documents.append(question_th)
+            all_metadatas.append({
+                "language": "th",
+                "question_th": question_th,
+                "question_eng": question,
+                "SQL": sql,
+                "table": table_text,
+                "record_hash": record_hash
+            })
+
+    return all_ids, all_documents, all_metadatas
+
+# encode ข้อความทั้งหมดเป็น batch แทนการเรียก encode ทีละประโยค (ข้อความที่เคย encode แล้วจะดึงจาก embedding cache)
+def encode_texts(encoder, texts, batch_size=64, num_processes=0):
+    def encode_with_pool(missing_texts):
+        embedding_model = encoder.get_model()
+        pool = embedding_model.start_multi_process_pool(target_devices=['cpu'] * num_processes)
+        try:
+            return embedding_model.encode_multi_process(missing_texts, pool, batch_size=batch_size)
+        finally:
+            embedding_model.stop_multi_process_pool(pool)
+
+    start_time = time.time()
+    misses_before = encoder.misses
+    embeddings = encoder.encode(
+        texts,
+        batch_size=batch_size,
+        show_progress_bar=True,
+        encode_fn=encode_with_pool if num_processes > 0 else None
+    )
+    elapsed = time.time() - start_time
+    encoded = encoder.misses - misses_before
+    throughput = encoded / elapsed if elapsed > 0 else float('inf')
+    print(f"[ENCODE] {len(texts)} sentences ({encoded} encoded, {len(texts) - encoded} from cache) in {elapsed:.2f}s "
+          f"({throughput:.1f} sentences/sec, batch_size={batch_size}, processes={max(num_processes, 1)})")
+    return embeddings
+
+# ดึง hash ของทุก id ที่มีอยู่แล้วใน collection
+def get_existing_hashes(collection, batch_size=5000):
+    existing_hashes = {}
+    total = collection.count()
+    for offset in range(0, total, batch_size):
+        existing = collection.get(include=["metadatas"], limit=batch_size, offset=offset)
+        for doc_id, meta in zip(existing["ids"], existing["metadatas"]):
+            existing_hashes[doc_id] = (meta or {}).get("record_hash")
+    return existing_hashes
+
+def rebuild_collection(client, embedding_model, all_ids, all_documents, all_metadatas):
+    # ลบ collection เดิมก่อน ถ้ามี
+    if collection_name in [col.name for col in client.list_collections()]:
+        client.delete_collection(collection_name)
+        print(f"[INFO] Deleted existing collection: {collection_name}")
+
+    # เก็บชื่อโมเดล embedding ไว้ใน metadata ของ collection เพื่อให้โหมด incremental ตรวจได้ว่าโมเดลเปลี่ยนหรือไม่
+    collection = client.create_collection(
+        name=collection_name,
+        metadata={"hnsw:space": "cosine", "embedding_model": embedding_model_name}
+    )
+
+    embeddings = encode_texts(embedding_model, all_documents, batch_size=encode_batch_size, num_processes=num_encode_processes)
+    all_embeddings = embeddings.tolist()
+
+    batch_add_to_collection(collection, all_ids, all_embeddings, all_documents, all_metadatas)
+
+def update_collection_incrementally(client, embedding_model, all_ids, all_documents, all_metadatas):
+    # record_hash ไม่รวมชื่อโมเดล ถ้า collection เดิมสร้างด้วยโมเดลอื่น (หรือไม่ได้บันทึกโมเดลไว้) ต้องสร้างใหม่ทั้งหมด
+    if collection_name in [col.name for col in client.list_collections()]:
+        stored_model = (client.get_collection(collection_name).metadata or {}).get("embedding_model")
+        if stored_model != embedding_model_name:
+            print(f"[WARNING] Collection '{collection_name}' was embedded with '{stored_model}', not "
+                  f"'{embedding_model_name}'; rebuilding the whole collection")
+            rebuild_collection(client, embedding_model, all_ids, all_documents, all_metadatas)
+            return
+
+    collection = client.get_or_create_collection(
+        name=collection_name,
+        metadata={"hnsw:space": "cosine", "embedding_model": embedding_model_name}
+    )
+    existing_hashes = get_existing_hashes(collection)
+
+    # เลือกเฉพาะ record ที่ยังไม่มี หรือ hash ไม่ตรงกับของเดิม
+    changed = [
+        i for i, doc_id in enumerate(all_ids)
+        if existing_hashes.get(doc_id) != all_metadatas[i]["record_hash"]
+    ]
+    current_ids = set(all_ids)
+    stale_ids = [doc_id for doc_id in existing_hashes if doc_id not in current_ids]
+    print(f"[INFO] Incremental update: {len(changed)} new/changed, {len(stale_ids)} removed, "
+          f"{len(all_ids) - len(changed)} unchanged")
+
+    if stale_ids:
+        batch_delete_from_collection(collection, stale_ids)
+
+    if changed:
+        changed_ids = [all_ids[i] for i in changed]
+        changed_documents = [all_documents[i] for i in changed]
+        changed_metadatas = [all_metadatas[i] for i in changed]
+        embeddings = encode_texts(embedding_model, changed_documents, batch_size=encode_batch_size, num_processes=num_encode_processes)
+        batch_upsert_to_collection(collection, changed_ids, embeddings.tolist(), changed_documents, changed_metadatas)
+
+def main():
+    with open(train_file, 'r', encoding='utf-8') as f:
+        train_data = json.load(f)
+
+    # โหลดโมเดล embedding (ผ่าน embedding cache, โมเดลจะถูกโหลดเมื่อมีข้อความที่ยังไม่เคย encode เท่านั้น)
+    embedding_model = CachedEncoder(embedding_model_name)
+
+    # ใช้ PersistentClient แบบใหม่
+    client = chromadb.PersistentClient(path=persist_directory)
+
+    all_ids, all_documents, all_metadatas = build_records(train_data)
+
+    if incremental:
+        update_collection_incrementally(client, embedding_model, all_ids, all_documents, all_metadatas)
     else:
-        tables = [str(tables_raw)]
-    # print(f"[DEBUG] parsed tables = {tables}")
-
-    if question:
-        all_ids.append(f"q{question_id}_en")
-        all_embeddings.append(embedding_model.encode(question).tolist())
-        all_documents.append(question)
-        all_metadatas.append({
-            "language": "en",
-            "question_eng": question,
-            "question_th": question_th,
-            "SQL": sql,
-            "table": ', '.join(tables) if tables else ''
-        })
-
-    if question_th:
-        all_ids.append(f"q{question_id}_th")
-        all_embeddings.append(embedding_model.encode(question_th).tolist())
-        all_documents.append(question_th)
-        all_metadatas.append({
-            "language": "th",
-            "question_th": question_th,
-            "question_eng": question,
-            "SQL": sql,
-            "table": ', '.join(tables) if tables else ''
-        })
-
-batch_add_to_collection(collection, all_ids, all_embeddings, all_documents, all_metadatas)
-
-print(f"Processed {len(train_data)} questions and added to Vector Store in collection '{collection_name}' at '{persist_directory}'")
\ No newline at end of file
+        rebuild_collection(client, embedding_model, all_ids, all_documents, all_metadatas)
+
+    print(f"Processed {len(train_data)} questions and added to Vector Store in collection '{collection_name}' at '{persist_directory}'")
+
+if __name__ == "__main__":
+    main()
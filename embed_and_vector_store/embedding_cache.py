@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import unicodedata
+import numpy as np
+
+"""
+This module implements a persistent, content-addressed cache for sentence embeddings.
+Embeddings are keyed by (model name, hash of the normalized text) and stored per model as
+a raw float32 matrix (memory-mapped on read) plus an append-only index file of text hashes.
+Row i of the matrix belongs to line i of the index file.
+"""
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_cache")
+
+
+def normalize_text(text):
+    """
+    Normalizes a text before hashing: Unicode NFC and collapsed whitespace.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_hash(text):
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    On-disk embedding store for a single model namespace.
+    The directory contains vectors.f32 (rows of float32), index.txt (one text hash per row)
+    and meta.json (embedding dimension).
+    """
+    def __init__(self, namespace, cache_dir=DEFAULT_CACHE_DIR):
+        safe_name = namespace.replace("/", "__").replace(":", "_")
+        self.model_dir = os.path.join(cache_dir, safe_name)
+        os.makedirs(self.model_dir, exist_ok=True)
+        self.vectors_path = os.path.join(self.model_dir, "vectors.f32")
+        self.index_path = os.path.join(self.model_dir, "index.txt")
+        self.meta_path = os.path.join(self.model_dir, "meta.json")
+        self.dim = None
+        self.rows = {}
+        self._matrix = None
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r") as f:
+                self.dim = json.load(f)["dim"]
+        if self.dim is None or not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "r") as f:
+            hashes = [line.strip() for line in f if line.strip()]
+        row_bytes = self.dim * 4
+        stored_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        # A crash between the two appends can leave the files out of step; keep the common prefix
+        n_rows = min(len(hashes), stored_rows)
+        if stored_rows != n_rows or len(hashes) != n_rows:
+            with open(self.vectors_path, "a+b") as f:
+                f.truncate(n_rows * row_bytes)
+            with open(self.index_path, "w") as f:
+                f.writelines(h + "\n" for h in hashes[:n_rows])
+        self.rows = {h: i for i, h in enumerate(hashes[:n_rows])}
+
+    def _get_matrix(self):
+        if self._matrix is None or self._matrix.shape[0] < len(self.rows):
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(len(self.rows), self.dim))
+        return self._matrix
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, keys):
+        """
+        Returns a float32 array with one row per key. All keys must already be cached.
+        """
+        if not keys:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        matrix = self._get_matrix()
+        return np.asarray(matrix[[self.rows[k] for k in keys]], dtype=np.float32)
+
+    def add(self, keys, vectors):
+        """
+        Appends new vectors to the cache. Keys that are already cached are skipped.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = int(vectors.shape[1])
+            with open(self.meta_path, "w") as f:
+                json.dump({"dim": self.dim}, f)
+        new_keys, new_rows, seen = [], [], set()
+        for key, vector in zip(keys, vectors):
+            if key in self.rows or key in seen:
+                continue
+            seen.add(key)
+            new_keys.append(key)
+            new_rows.append(vector)
+        if not new_keys:
+            return
+        # Vectors first, then the index, so the index never points past the end of the matrix
+        with open(self.vectors_path, "ab") as f:
+            f.write(np.ascontiguousarray(new_rows, dtype=np.float32).tobytes())
+        with open(self.index_path, "a") as f:
+            f.writelines(k + "\n" for k in new_keys)
+        start = len(self.rows)
+        for i, key in enumerate(new_keys):
+            self.rows[key] = start + i
+        self._matrix = None
+
+
+class CachedEncoder:
+    """
+    Drop-in replacement for SentenceTransformer.encode that goes through an EmbeddingCache.
+    The underlying SentenceTransformer is only loaded when a text is not in the cache,
+    so fully cached runs never touch the transformer.
+    """
+    def __init__(self, model_name, model=None, normalize_embeddings=False, cache_dir=DEFAULT_CACHE_DIR):
+        self.model_name = model_name
+        self.model = model
+        self.normalize_embeddings = normalize_embeddings
+        namespace = f"{model_name}-normalized" if normalize_embeddings else model_name
+        self.cache = EmbeddingCache(namespace, cache_dir=cache_dir)
+        self.hits = 0
+        self.misses = 0
+
+    def get_model(self):
+        if self.model is None:
+            from sentence_transformers import SentenceTransformer
+            self.model = SentenceTransformer(self.model_name)
+        return self.model
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False, encode_fn=None):
+        """
+        Encodes a text or a list of texts, returning a float32 numpy array like SentenceTransformer.encode.
+        encode_fn(texts) can be passed to customize how cache misses are encoded (e.g. a multi-process pool).
+        """
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        keys = [text_hash(t) for t in texts]
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self.cache and key not in missing:
+                missing[key] = text
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+
+        if missing:
+            missing_texts = list(missing.values())
+            if encode_fn is not None:
+                vectors = encode_fn(missing_texts)
+            else:
+                vectors = self.get_model().encode(
+                    missing_texts,
+                    batch_size=batch_size,
+                    show_progress_bar=show_progress_bar,
+                    convert_to_numpy=True,
+                    normalize_embeddings=self.normalize_embeddings
+                )
+            self.cache.add(list(missing.keys()), vectors)
+
+        embeddings = self.cache.get(keys)
+        return embeddings[0] if single else embeddings
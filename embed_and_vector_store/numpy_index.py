@@ -0,0 +1,364 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+"""
+This module implements an in-process exact k-nearest-neighbour index backed by NumPy.
+It is meant for small corpora (BIRD train questions, evidence) that fit in a single float32 matrix.
+Embeddings are L2-normalized and saved to a .npy file that is memory-mapped at load time;
+ids, documents and metadatas are kept in a JSON sidecar.
+The query method mirrors chromadb's Collection.query and returns cosine distances,
+so the index can be used wherever a Chroma collection is expected.
+
+The index can also search over quantized codes (float16, or int8 with a per-dimension scale).
+In that mode the first-stage search runs on the codes and the top candidates are re-scored
+with the full-precision vectors, which are only memory-mapped when the first re-scoring happens.
+
+An index exported from a Chroma collection records the collection's fingerprint in source.json: its record
+count and collection metadata (which holds the embedding model), plus a digest of every id with its record_hash.
+At load time only the count and metadata are compared, so no records are read; the index is re-exported when
+they differ, or on request (rebuild=True) after records were updated in place.
+"""
+
+QUANTIZATIONS = ("float32", "float16", "int8")
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize_int8(matrix, block_size=8192):
+    """
+    Symmetric per-dimension int8 quantization. Returns (codes, scale) with matrix ~= codes * scale.
+    """
+    scale = np.zeros(matrix.shape[1], dtype=np.float32)
+    for start in range(0, matrix.shape[0], block_size):
+        block = np.asarray(matrix[start:start + block_size], dtype=np.float32)
+        scale = np.maximum(scale, np.abs(block).max(axis=0))
+    scale = scale / 127.0
+    scale[scale == 0] = 1.0
+    codes = np.empty(matrix.shape, dtype=np.int8)
+    for start in range(0, matrix.shape[0], block_size):
+        block = np.asarray(matrix[start:start + block_size], dtype=np.float32)
+        codes[start:start + block_size] = np.clip(np.rint(block / scale), -127, 127)
+    return codes, scale
+
+
+def records_fingerprint(ids, documents, metadatas):
+    """
+    {"count", "digest"} of a set of records: SHA-1 over every id with its record_hash
+    (or its document and metadata when the record has no record_hash), independent of order.
+    """
+    rows = []
+    for doc_id, document, metadata in zip(ids, documents, metadatas):
+        record_hash = (metadata or {}).get("record_hash")
+        if record_hash is None:
+            record_hash = json.dumps([document, metadata], ensure_ascii=False, sort_keys=True)
+        rows.append((doc_id, record_hash))
+    digest = hashlib.sha1()
+    for row in sorted(rows):
+        digest.update(json.dumps(row, ensure_ascii=False).encode("utf-8"))
+    return {"count": len(rows), "digest": digest.hexdigest()}
+
+
+def collection_version(collection):
+    """
+    Cheap signature of a Chroma collection, read without touching its records: the record count and the
+    collection metadata. Records updated in place (same count) are not noticed.
+    """
+    return {"count": collection.count(), "metadata": collection.metadata or {}}
+
+
+class NumpyKnnIndex:
+    EMBEDDINGS_FILE = "embeddings.npy"
+    RECORDS_FILE = "records.json"
+    SOURCE_FILE = "source.json"
+    CODES_FILES = {"float16": "codes_float16.npy", "int8": "codes_int8.npy"}
+    INT8_SCALE_FILE = "int8_scale.npy"
+
+    def __init__(self, index_dir, quantization="float32", rescore_multiplier=4, block_size=8192):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.index_dir = index_dir
+        self.quantization = quantization
+        # Like Collection.name; the quantization is part of it because it changes the results
+        self.name = f"{os.path.basename(os.path.normpath(index_dir))}-{quantization}"
+        self.rescore_multiplier = rescore_multiplier
+        self.block_size = block_size
+        self._full = None
+        self.scale = None
+        if quantization == "float32":
+            self.embeddings = self._get_full()
+        else:
+            codes_path = os.path.join(index_dir, self.CODES_FILES[quantization])
+            if self.codes_stale(index_dir, quantization):
+                self.quantize(index_dir, quantization)
+            self.embeddings = np.load(codes_path, mmap_mode="r")
+            if quantization == "int8":
+                self.scale = np.load(os.path.join(index_dir, self.INT8_SCALE_FILE))
+        with open(os.path.join(index_dir, self.RECORDS_FILE), "r", encoding="utf-8") as f:
+            records = json.load(f)
+        self.ids = records["ids"]
+        self.documents = records["documents"]
+        self.metadatas = records["metadatas"]
+        self._filtered = {}
+        self._positions = None
+
+    @classmethod
+    def codes_stale(cls, index_dir, quantization):
+        """
+        True if the quantized codes are missing or were written before embeddings.npy
+        (or do not have its shape), i.e. they must be regenerated.
+        """
+        paths = [os.path.join(index_dir, cls.CODES_FILES[quantization])]
+        if quantization == "int8":
+            paths.append(os.path.join(index_dir, cls.INT8_SCALE_FILE))
+        if not all(os.path.exists(path) for path in paths):
+            return True
+        embeddings_path = os.path.join(index_dir, cls.EMBEDDINGS_FILE)
+        if any(os.path.getmtime(path) < os.path.getmtime(embeddings_path) for path in paths):
+            return True
+        codes = np.load(paths[0], mmap_mode="r")
+        return codes.shape != np.load(embeddings_path, mmap_mode="r").shape
+
+    @classmethod
+    def quantize(cls, index_dir, quantization):
+        """
+        Writes the quantized codes for an existing float32 index.
+        """
+        full = np.load(os.path.join(index_dir, cls.EMBEDDINGS_FILE), mmap_mode="r")
+        codes_path = os.path.join(index_dir, cls.CODES_FILES[quantization])
+        if quantization == "float16":
+            np.save(codes_path, np.asarray(full, dtype=np.float16))
+        else:
+            codes, scale = quantize_int8(full)
+            np.save(codes_path, codes)
+            np.save(os.path.join(index_dir, cls.INT8_SCALE_FILE), scale)
+        print(f"[INFO] Wrote {quantization} codes to '{codes_path}'")
+
+    def _get_full(self):
+        """
+        Full-precision vectors, memory-mapped on first use.
+        """
+        if self._full is None:
+            self._full = np.load(os.path.join(self.index_dir, self.EMBEDDINGS_FILE), mmap_mode="r")
+        return self._full
+
+    def nbytes(self):
+        """
+        Size of the matrix used for the first-stage search.
+        """
+        return int(self.embeddings.nbytes)
+
+    @classmethod
+    def build(cls, index_dir, ids, embeddings, documents, metadatas, source=None):
+        """
+        Writes a new index to index_dir and returns it loaded.
+        source describes the collection the records come from (records_fingerprint plus the collection metadata).
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        # Codes quantized from the previous embeddings no longer match
+        for name in [*cls.CODES_FILES.values(), cls.INT8_SCALE_FILE]:
+            path = os.path.join(index_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+        np.save(os.path.join(index_dir, cls.EMBEDDINGS_FILE), normalize_rows(embeddings))
+        with open(os.path.join(index_dir, cls.RECORDS_FILE), "w", encoding="utf-8") as f:
+            json.dump({"ids": list(ids), "documents": list(documents), "metadatas": list(metadatas)}, f, ensure_ascii=False)
+        source_path = os.path.join(index_dir, cls.SOURCE_FILE)
+        if source is not None:
+            with open(source_path, "w", encoding="utf-8") as f:
+                json.dump(source, f)
+        elif os.path.exists(source_path):
+            os.remove(source_path)
+        return cls(index_dir)
+
+    @classmethod
+    def read_source(cls, index_dir):
+        """
+        The collection fingerprint saved when the index was exported, or None.
+        """
+        source_path = os.path.join(index_dir, cls.SOURCE_FILE)
+        if not os.path.exists(source_path):
+            return None
+        with open(source_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @classmethod
+    def from_collection(cls, collection, index_dir, batch_size=5000):
+        """
+        Exports every record of a Chroma collection into a NumpyKnnIndex at index_dir.
+        """
+        ids, embeddings, documents, metadatas = [], [], [], []
+        total = collection.count()
+        for offset in range(0, total, batch_size):
+            batch = collection.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+            ids.extend(batch["ids"])
+            embeddings.extend(batch["embeddings"])
+            documents.extend(batch["documents"])
+            metadatas.extend(batch["metadatas"])
+        print(f"[INFO] Exported {len(ids)} records from collection '{collection.name}' to '{index_dir}'")
+        source = {**records_fingerprint(ids, documents, metadatas), "metadata": collection.metadata or {}}
+        return cls.build(index_dir, ids, embeddings, documents, metadatas, source=source)
+
+    def count(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _where_conditions(where):
+        """
+        Supports equality filters only: {"key": value} or {"key": {"$eq": value}}.
+        """
+        conditions = []
+        for key, value in where.items():
+            if isinstance(value, dict):
+                if set(value) != {"$eq"}:
+                    raise ValueError(f"Unsupported where operator for '{key}': {value}")
+                value = value["$eq"]
+            conditions.append((key, value))
+        return tuple(sorted(conditions))
+
+    def _filter(self, where):
+        """
+        Row indices matching a where filter (None for no filter), cached per filter.
+        Only the indices are cached; the rows themselves stay in the memory-mapped matrix.
+        """
+        if not where:
+            return None
+        key = self._where_conditions(where)
+        if key not in self._filtered:
+            self._filtered[key] = np.array([
+                i for i, meta in enumerate(self.metadatas)
+                if all((meta or {}).get(k) == v for k, v in key)
+            ], dtype=np.int64)
+        return self._filtered[key]
+
+    def _scores(self, queries, rows=None):
+        """
+        Inner products between float32 queries and the search matrix (restricted to rows, if given),
+        computed block by block so filtered rows are gathered from the memory map and quantized codes
+        are upcast only a block at a time.
+        """
+        if self.scale is not None:
+            queries = queries * self.scale
+        if self.quantization == "float32" and rows is None:
+            return queries @ self.embeddings.T
+        n_rows = self.embeddings.shape[0] if rows is None else len(rows)
+        scores = np.empty((queries.shape[0], n_rows), dtype=np.float32)
+        for start in range(0, n_rows, self.block_size):
+            block_rows = slice(start, start + self.block_size) if rows is None else rows[start:start + self.block_size]
+            block = np.asarray(self.embeddings[block_rows], dtype=np.float32)
+            scores[:, start:start + self.block_size] = queries @ block.T
+        return scores
+
+    @staticmethod
+    def _top_k(scores, candidates, k):
+        """
+        Picks the k best candidates per query, sorted by score with ties broken by candidate index.
+        """
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        top = np.take_along_axis(candidates, top, axis=1)
+        order = np.lexsort((top, -top_scores), axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def search(self, query_embeddings, n_results=10, where=None):
+        """
+        Exact cosine search. Returns (row indices, cosine distances), each of shape (n_queries, k),
+        sorted by distance with ties broken by row index so results are deterministic.
+        For quantized indexes the top n_results * rescore_multiplier candidates of the
+        first-stage search are re-scored with the full-precision vectors.
+        """
+        queries = normalize_rows(np.atleast_2d(query_embeddings))
+        rows = self._filter(where)
+        n_rows = self.embeddings.shape[0] if rows is None else len(rows)
+        k = min(n_results, n_rows)
+        if k == 0:
+            empty = np.zeros((queries.shape[0], 0))
+            return empty.astype(np.int64), empty
+        scores = self._scores(queries, rows)
+        local = np.broadcast_to(np.arange(n_rows), scores.shape)
+
+        if self.quantization == "float32":
+            top, top_scores = self._top_k(scores, local, k)
+            if rows is not None:
+                top = rows[top]
+            return top, 1.0 - top_scores
+
+        n_candidates = min(k * self.rescore_multiplier, n_rows)
+        candidates, _ = self._top_k(scores, local, n_candidates)
+        if rows is not None:
+            candidates = rows[candidates]
+        full = self._get_full()
+        unique_rows, inverse = np.unique(candidates, return_inverse=True)
+        candidate_vectors = np.asarray(full[unique_rows], dtype=np.float32)[inverse.reshape(candidates.shape)]
+        exact_scores = np.einsum("qd,qcd->qc", queries, candidate_vectors)
+        top, top_scores = self._top_k(exact_scores, candidates, k)
+        return top, 1.0 - top_scores
+
+    def get(self, ids=None, include=("documents", "metadatas")):
+        """
+        Mirrors Collection.get: the records with the given ids (all records if None).
+        """
+        if ids is None:
+            rows = range(len(self.ids))
+        else:
+            positions = self._get_positions()
+            rows = [positions[doc_id] for doc_id in ids if doc_id in positions]
+        result = {"ids": [self.ids[i] for i in rows]}
+        if "documents" in include:
+            result["documents"] = [self.documents[i] for i in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [self.metadatas[i] for i in rows]
+        return result
+
+    def _get_positions(self):
+        if self._positions is None:
+            self._positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        return self._positions
+
+    def query(self, query_embeddings, n_results=10, where=None):
+        top, distances = self.search(query_embeddings, n_results=n_results, where=where)
+        return {
+            "ids": [[self.ids[i] for i in row] for row in top],
+            "documents": [[self.documents[i] for i in row] for row in top],
+            "metadatas": [[self.metadatas[i] for i in row] for row in top],
+            "distances": [[float(d) for d in row] for row in distances]
+        }
+
+
+def load_search_index(backend, collection, index_dir, quantization="float32", rebuild=False):
+    """
+    Returns the object used for similarity search: the Chroma collection itself for backend="chroma",
+    or a NumpyKnnIndex for backend="numpy", exported from the collection on first use, when rebuild is set,
+    or when the collection's count or metadata no longer match the ones saved at export time.
+    """
+    if backend == "chroma":
+        return collection
+    if backend == "numpy":
+        if rebuild or not os.path.exists(os.path.join(index_dir, NumpyKnnIndex.EMBEDDINGS_FILE)):
+            NumpyKnnIndex.from_collection(collection, index_dir)
+        else:
+            stored = NumpyKnnIndex.read_source(index_dir) or {}
+            current = collection_version(collection)
+            if {key: stored.get(key) for key in current} != current:
+                stored_count = stored.get("count", "unknown")
+                print(f"[WARNING] NumPy index '{index_dir}' ({stored_count} records) does not match collection "
+                      f"'{collection.name}' ({current['count']} records); re-exporting")
+                NumpyKnnIndex.from_collection(collection, index_dir)
+        return NumpyKnnIndex(index_dir, quantization=quantization)
+    raise ValueError(f"Unknown search backend: {backend}")
+
+
+def recall_at_k(baseline_index, index, query_embeddings, k=15, where=None):
+    """
+    Mean fraction of the baseline top-k ids that the other index also returns in its top-k.
+    """
+    baseline_top, _ = baseline_index.search(query_embeddings, n_results=k, where=where)
+    top, _ = index.search(query_embeddings, n_results=k, where=where)
+    hits = [len(set(b) & set(t)) / len(b) for b, t in zip(baseline_top.tolist(), top.tolist()) if len(b)]
+    return sum(hits) / len(hits) if hits else 0.0
@@ -0,0 +1,52 @@
+import argparse
+import json
+import time
+import numpy as np
+from numpy_index import NumpyKnnIndex, recall_at_k
+from embedding_cache import CachedEncoder
+
+"""
+This script builds float16/int8 codes for an existing NumPy kNN index and reports,
+for each storage mode, the size of the first-stage search matrix, the mean query latency
+and recall@k against the float32 baseline.
+Queries are taken from a test split JSON file if given, otherwise a random sample of
+the indexed vectors is used as queries.
+"""
+
+
+def load_queries(args, baseline):
+    if args.queries_file:
+        with open(args.queries_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        texts = [item[args.query_field] for item in data if item.get(args.query_field)]
+        encoder = CachedEncoder(args.model_name)
+        return encoder.encode(texts, batch_size=32)
+    rng = np.random.default_rng(args.seed)
+    sample = rng.choice(baseline.count(), size=min(args.num_queries, baseline.count()), replace=False)
+    return np.asarray(baseline.embeddings[np.sort(sample)], dtype=np.float32)
+
+
+if __name__ == '__main__':
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument('--index_dir', type=str, required=True)
+    args_parser.add_argument('--queries_file', type=str, default='')
+    args_parser.add_argument('--query_field', type=str, default='question_th')
+    args_parser.add_argument('--model_name', type=str, default='BAAI/bge-m3')
+    args_parser.add_argument('--num_queries', type=int, default=500)
+    args_parser.add_argument('--top_k', type=int, default=15)
+    args_parser.add_argument('--rescore_multiplier', type=int, default=4)
+    args_parser.add_argument('--seed', type=int, default=0)
+    args = args_parser.parse_args()
+
+    baseline = NumpyKnnIndex(args.index_dir)
+    queries = load_queries(args, baseline)
+    print(f"Index: {args.index_dir} ({baseline.count()} vectors), {len(queries)} queries, k={args.top_k}")
+
+    print("{:10} {:>12} {:>16} {:>12}".format('mode', 'size (MB)', 'latency (ms/q)', f'recall@{args.top_k}'))
+    for quantization in ("float32", "float16", "int8"):
+        index = NumpyKnnIndex(args.index_dir, quantization=quantization, rescore_multiplier=args.rescore_multiplier)
+        start_time = time.perf_counter()
+        index.search(queries, n_results=args.top_k)
+        latency_ms = (time.perf_counter() - start_time) * 1000 / max(len(queries), 1)
+        recall = recall_at_k(baseline, index, queries, k=args.top_k)
+        print("{:10} {:>12.2f} {:>16.3f} {:>12.4f}".format(quantization, index.nbytes() / 2**20, latency_ms, recall))
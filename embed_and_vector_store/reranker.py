@@ -0,0 +1,133 @@
+import re
+import time
+import numpy as np
+
+"""
+This module implements a local cross-encoder reranking stage for retrieved candidates.
+Each (query, candidate) pair is scored by a multilingual cross-encoder (bge-reranker by default)
+on the CPU in batches, which takes tens of milliseconds per question instead of an LLM generation.
+An LLM is only consulted, optionally, for near-ties at the top-k cut: candidates whose score is within
+tie_margin of the k-th best score on both sides of the cut.
+rerank_candidates is the entry point used by the retrieval scripts.
+"""
+
+DEFAULT_RERANKER_MODEL = "BAAI/bge-reranker-v2-m3"
+
+
+class CrossEncoderReranker:
+    """
+    The CrossEncoder is only loaded when the first pair is scored.
+    """
+    def __init__(self, model_name=DEFAULT_RERANKER_MODEL, model=None, batch_size=32, max_length=512, device="cpu",
+                 tie_margin=0.02):
+        self.model_name = model_name
+        self.model = model
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.device = device
+        self.tie_margin = tie_margin
+
+    def get_model(self):
+        if self.model is None:
+            from sentence_transformers import CrossEncoder
+            self.model = CrossEncoder(self.model_name, max_length=self.max_length, device=self.device)
+        return self.model
+
+    def score(self, query, candidates):
+        """
+        Relevance score of every candidate for the query (higher is better), as a float32 array.
+        """
+        if not candidates:
+            return np.zeros(0, dtype=np.float32)
+        pairs = [(query, candidate) for candidate in candidates]
+        scores = self.get_model().predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+        return np.asarray(scores, dtype=np.float32).reshape(-1)
+
+    def near_ties(self, scores, order, top_k):
+        """
+        Candidates whose score is within tie_margin of the k-th best score, if they straddle the top-k cut
+        (otherwise the selection would not change and [] is returned).
+        """
+        if top_k <= 0 or len(order) <= top_k:
+            return []
+        boundary = scores[order[top_k - 1]]
+        tied = [i for i in order if abs(scores[i] - boundary) <= self.tie_margin]
+        inside = set(order[:top_k])
+        if all(i in inside for i in tied) or not any(i in inside for i in tied):
+            return []
+        return tied
+
+    def rerank(self, query, candidates, top_k, tie_breaker=None):
+        """
+        Returns (indices of the top_k candidates, best first; rerank time in seconds).
+        tie_breaker(tied, slots), if given, is called for near-ties at the cut and returns which
+        `slots` of the `tied` indices to keep; invalid answers fall back to the score order.
+        """
+        start_time = time.time()
+        scores = self.score(query, candidates)
+        # Highest score first, ties broken by the retrieval order
+        order = sorted(range(len(candidates)), key=lambda i: (-scores[i], i))
+        top_indices = order[:top_k]
+        tied = self.near_ties(scores, order, top_k) if tie_breaker is not None else []
+        if tied:
+            fixed = [i for i in top_indices if i not in tied]
+            slots = top_k - len(fixed)
+            chosen = [i for i in dict.fromkeys(tie_breaker(tied, slots)) if i in tied][:slots]
+            chosen += [i for i in tied if i not in chosen][:slots - len(chosen)]
+            top_indices = fixed + chosen
+        return top_indices, time.time() - start_time
+
+
+def llm_tie_breaker(client, query, candidates, error_log, log_entry, num_ctx=None, token_log=None, question_id=None,
+                    token_counter=None):
+    """
+    Returns a tie_breaker for CrossEncoderReranker.rerank that asks the LLM (through query_llm)
+    to pick the most relevant of the near-tied candidates. On an LLM error it returns the
+    tied candidates in score order.
+    If token_log is given, every tie-break call is appended to it as a "rerank_tie_break" entry,
+    with the prompt's token count from token_counter(prompt) when a counter is given.
+    """
+    from gensql_common.llm_client import query_llm
+
+    def tie_breaker(tied, slots):
+        listing = "\n".join(f"Candidate {i}: {candidates[i]}" for i in tied)
+        prompt = f"""You are an expert in evaluating semantic relevance.
+The candidates below scored almost the same for the query. Select the {slots} most relevant candidate(s).
+
+Query:
+{query}
+
+Candidates:
+{listing}
+
+Output only the indices of the selected candidates, separated by commas. Do not include any explanations.
+"""
+        response, generation_time = query_llm(client, prompt, error_log, log_entry, num_ctx=num_ctx)
+        if token_log is not None:
+            token_log.append({
+                "stage": "rerank_tie_break",
+                "question_id": question_id,
+                "prompt": prompt,
+                "token_count": token_counter(prompt) if token_counter is not None else None,
+                "generation_time": generation_time,
+                "num_ctx": num_ctx
+            })
+        indices = [int(idx) for idx in re.findall(r"\d+", response or "")]
+        return [i for i in indices if i in tied] or tied
+
+    return tie_breaker
+
+
+def rerank_candidates(reranker, query, candidates, top_k, question_id=None, client=None, error_log=None, token_log=None,
+                      token_counter=None):
+    """
+    Returns (indices of the top_k candidates, best first; rerank time in seconds) from the cross-encoder.
+    With a client, near-ties at the cut are settled by llm_tie_breaker: its errors are appended to
+    error_log and its calls to token_log (see llm_tie_breaker).
+    """
+    tie_breaker = None
+    if client is not None:
+        log_entry = {"question_id": f"tie_break_q{question_id}", "question": query}
+        tie_breaker = llm_tie_breaker(client, query, candidates, error_log if error_log is not None else [], log_entry,
+                                      token_log=token_log, question_id=question_id, token_counter=token_counter)
+    return reranker.rerank(query, candidates, top_k, tie_breaker=tie_breaker)
@@ -0,0 +1,60 @@
+from collections import defaultdict
+
+"""
+This module implements batched similarity search over a vector store collection.
+All queries are encoded in one batched pass and sent to the collection as many
+query_embeddings per call, grouped by language filter.
+With a RetrievalCache, queries whose results are cached skip both the encoder and the collection.
+"""
+
+
+def batch_similarity_search(collection, encoder, query_texts, langs=None, top_n=15, batch_size=32, query_chunk_size=256,
+                            cache=None):
+    """
+    Runs a similarity search for every text in query_texts.
+    If langs is given, query i is restricted with where={"language": langs[i]};
+    queries that share a language are sent to the collection together.
+    If cache (a RetrievalCache for this collection) is given, cached results are reused
+    and only the remaining queries are encoded and searched.
+    Returns a list aligned with query_texts of (ids, documents, metadatas, distances) tuples.
+    """
+    if not query_texts:
+        return []
+    results = [None] * len(query_texts)
+    pending = list(range(len(query_texts)))
+    keys = None
+    if cache is not None:
+        keys = [cache.key(text, langs[i] if langs is not None else None, top_n) for i, text in enumerate(query_texts)]
+        for i, result in zip(pending, cache.get_many([keys[i] for i in pending])):
+            results[i] = result
+        pending = [i for i in pending if results[i] is None]
+        if not pending:
+            return results
+    embeddings = encoder.encode([query_texts[i] for i in pending], batch_size=batch_size)
+    # Row of embeddings for query i
+    embedding_rows = {i: row for row, i in enumerate(pending)}
+
+    groups = defaultdict(list)
+    for i in pending:
+        groups[langs[i] if langs is not None else None].append(i)
+
+    for lang, indices in groups.items():
+        for start in range(0, len(indices), query_chunk_size):
+            chunk = indices[start:start + query_chunk_size]
+            query_kwargs = {
+                "query_embeddings": embeddings[[embedding_rows[i] for i in chunk]].tolist(),
+                "n_results": top_n
+            }
+            if lang is not None:
+                query_kwargs["where"] = {"language": lang}
+            response = collection.query(**query_kwargs)
+            for j, i in enumerate(chunk):
+                results[i] = (
+                    response["ids"][j],
+                    response["documents"][j],
+                    response["metadatas"][j],
+                    response["distances"][j]
+                )
+    if cache is not None:
+        cache.add([(keys[i], results[i][0], results[i][3]) for i in pending])
+    return results
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+from embed_and_vector_store.embedding_cache import normalize_text
+from embed_and_vector_store.numpy_index import NumpyKnnIndex, records_fingerprint
+
+"""
+This module implements a persistent cache for similarity search results.
+A result (ids and distances) is keyed by the search index (backend and collection name),
+a version of the collection, the embedding model, the normalized query text,
+the language filter and n_results. The version is read without a full scan of the store: a NumPy index
+reuses the fingerprint saved in its source.json, a Chroma collection is versioned by its count, its ids
+with their record_hash and its collection metadata (which holds the embedding model).
+Documents and metadatas are not stored: those of cached hits are fetched by id from the index,
+so a cache hit needs neither the encoder nor a similarity search.
+Results are appended to one JSONL file per (index, version); a new version starts a new file.
+"""
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "retrieval_cache")
+# Number of ids per get() call when fetching the records of cached hits
+FETCH_BATCH_SIZE = 1000
+
+
+def index_namespace(search_index):
+    """
+    Name of a search index for the cache: backend plus collection name, e.g. "Collection-bird_train_set_evidence_bge_m3".
+    """
+    return f"{type(search_index).__name__}-{search_index.name}"
+
+
+def index_version(search_index, batch_size=5000):
+    """
+    Version of the records behind a search index (a dict, see records_fingerprint), read without documents.
+    """
+    if isinstance(search_index, NumpyKnnIndex):
+        source = NumpyKnnIndex.read_source(search_index.index_dir)
+        if source is not None:
+            return source
+        return records_fingerprint(search_index.ids, search_index.documents, search_index.metadatas)
+    ids, metadatas = [], []
+    for offset in range(0, search_index.count(), batch_size):
+        batch = search_index.get(include=["metadatas"], limit=batch_size, offset=offset)
+        ids.extend(batch["ids"])
+        metadatas.extend(batch["metadatas"])
+    # Records without a record_hash are versioned by their metadata
+    return {**records_fingerprint(ids, [None] * len(ids), metadatas), "metadata": search_index.metadata or {}}
+
+
+class RetrievalCache:
+    def __init__(self, search_index, model_name, cache_dir=DEFAULT_CACHE_DIR):
+        self.search_index = search_index
+        self.model_name = model_name
+        self.records = {}
+        self.version = hashlib.sha1(
+            json.dumps(index_version(search_index), ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        safe_name = index_namespace(search_index).replace("/", "__").replace(":", "_")
+        directory = os.path.join(cache_dir, safe_name)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{self.version[:16]}.jsonl")
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        # Drop a partial last line left by a crash in the middle of a write
+        complete = data[:data.rfind(b"\n") + 1]
+        if len(complete) != len(data):
+            with open(self.path, "r+b") as f:
+                f.truncate(len(complete))
+        for line in complete.decode("utf-8").splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                self.entries[entry["key"]] = (entry["ids"], entry["distances"])
+
+    def key(self, query_text, lang, n_results):
+        return hashlib.sha1(
+            json.dumps([self.model_name, normalize_text(query_text), lang, n_results], ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+
+    def _fetch_records(self, ids):
+        """
+        Reads the documents and metadatas of ids that are not known yet from the search index.
+        """
+        missing = [doc_id for doc_id in dict.fromkeys(ids) if doc_id not in self.records]
+        for start in range(0, len(missing), FETCH_BATCH_SIZE):
+            batch = self.search_index.get(ids=missing[start:start + FETCH_BATCH_SIZE], include=["documents", "metadatas"])
+            for doc_id, document, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"]):
+                self.records[doc_id] = (document, metadata)
+
+    def get_many(self, keys):
+        """
+        Returns the cached (ids, documents, metadatas, distances) for every key (None if not cached).
+        The records of all hits are fetched from the search index together.
+        """
+        entries = [self.entries.get(key) for key in keys]
+        self._fetch_records([doc_id for entry in entries if entry is not None for doc_id in entry[0]])
+        results = []
+        for entry in entries:
+            # A result that points at a record no longer in the index is a miss
+            if entry is None or any(doc_id not in self.records for doc_id in entry[0]):
+                self.misses += 1
+                results.append(None)
+                continue
+            self.hits += 1
+            ids, distances = entry
+            results.append((
+                list(ids),
+                [self.records[doc_id][0] for doc_id in ids],
+                [self.records[doc_id][1] for doc_id in ids],
+                list(distances)
+            ))
+        return results
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def add(self, items):
+        """
+        Stores (key, ids, distances) results and appends them to the cache file.
+        """
+        lines = []
+        for key, ids, distances in items:
+            if key in self.entries:
+                continue
+            self.entries[key] = (list(ids), [float(d) for d in distances])
+            lines.append(json.dumps({"key": key, "ids": self.entries[key][0], "distances": self.entries[key][1]},
+                                    ensure_ascii=False) + "\n")
+        if lines:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(lines)
@@ -1,8 +1,14 @@
 import json
-import requests
 import re
 import time
 from transformers import AutoTokenizer
+import os
+import sys
+
+# เพิ่ม root ของ repo ใน sys.path เพื่อ import โมดูลที่ใช้ร่วมกัน
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from gensql_common.llm_client import create_client, query_llm
+from gensql_common.schema_registry import render_schema
 
 # ใช้ tokenizer ของ google/gemma-3-12b-it
 tokenizer = AutoTokenizer.from_pretrained("google/gemma-3-12b-it")
@@ -43,19 +49,9 @@ def format_time(seconds):
     remaining_seconds = remaining_seconds % 60
     return f"{hours} ชั่วโมง {minutes} นาที {remaining_seconds:.2f} วินาที ({seconds:.2f} วินาที)"
 
-# ฟังก์ชันดึง schema จาก train_tables.json (เพิ่ม backticks รอบชื่อคอลัมน์)
+# ฟังก์ชันดึง schema จาก train_tables.json (เพิ่ม backticks รอบชื่อคอลัมน์) โดยโหลดไฟล์ครั้งเดียวผ่าน schema registry
 def get_schema(db_id, tables_file='./bird/data/train/train_tables.json'):
-    with open(tables_file, 'r') as f:
-        tables = json.load(f)
-    for db in tables:
-        if db['db_id'] == db_id:
-            schema = []
-            for table_idx, table_name in enumerate(db['table_names_original']):
-                columns = [f"`{col[1]}`" for col in db['column_names_original'] if col[0] == table_idx]
-                if columns:
-                    schema.append(f"Table: {table_name}, Columns: {', '.join(columns)}")
-            return '\n'.join(schema)
-    return ""
+    return render_schema(db_id, tables_file, schema_format="backticks")
 
 # ฟังก์ชันล้าง Markdown และแปลง SQL เป็นบรรทัดเดียว
 def clean_sql(sql):
@@ -65,33 +61,8 @@ def clean_sql(sql):
         sql += ';'
     return sql.strip()
 
-# ฟังก์ชันเรียก Ollama API และวัดเวลา
-def query_ollama(prompt, error_log, question_id, question, num_ctx):
-    url = "http://localhost:11434/api/generate"
-    payload = {
-        "model": "gemma3:12b_8192",
-        "prompt": prompt,
-        "stream": False,
-        "options": {"num_ctx": num_ctx}
-    }
-    start_time = time.time()
-    try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        if 'response' not in data:
-            raise ValueError("Invalid response format: 'response' key missing")
-        end_time = time.time()
-        generation_time = end_time - start_time
-        return data['response'].strip(), generation_time
-    except (requests.RequestException, ValueError) as e:
-        print(f"Error for Question ID {question_id}: {e}")
-        error_log.append({
-            "question_id": question_id,
-            "question": question,
-            "error": str(e)
-        })
-        return "", -1
+# LLM client กลาง (connection pool, timeout และ retry)
+llm_client = create_client("ollama", model="gemma3:12b_8192")
 
 # อ่าน Test Set
 with open('./bird/data/train/test_split_bird_20.json', 'r', encoding='utf-8') as f:
@@ -105,7 +76,7 @@ error_log_test = []
 overall_start_time = time.time()
 
 # ทดสอบการเชื่อมต่อกับ Ollama API
-response, generation_time = query_ollama("Test prompt", [], "test_question_id", "Test question", num_ctx=2048)
+response, generation_time = query_llm(llm_client, "Test prompt", [], {"question_id": "test_question_id", "question": "Test question"}, num_ctx=2048)
 print("Ollama Response:", response)
 print("Generation Time:", format_time(generation_time))
 
@@ -146,7 +117,7 @@ Translate the following natural language question into a valid SQL query:
     print(f"Dynamic num_ctx: {num_ctx}")
 
     # เรียก API และเก็บเวลาการ Generate
-    sql, generation_time = query_ollama(prompt, error_log_test, question_id, question, num_ctx)
+    sql, generation_time = query_llm(llm_client, prompt, error_log_test, {"question_id": question_id, "question": question}, num_ctx)
     cleaned_sql = clean_sql(sql)
     
     # บันทึกข้อมูลโทเค็นลง token_log
@@ -1,12 +1,24 @@
 import json
-import requests
+import argparse
 import re
 import time
 import chromadb
-from sentence_transformers import SentenceTransformer
 from transformers import AutoTokenizer
 import math
 import fasttext
+import os
+import sys
+
+# เพิ่ม root ของ repo ใน sys.path เพื่อ import โมดูลที่ใช้ร่วมกัน
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from embed_and_vector_store.embedding_cache import CachedEncoder
+from embed_and_vector_store.retrieval import batch_similarity_search
+from embed_and_vector_store.numpy_index import load_search_index
+from embed_and_vector_store.retrieval_cache import RetrievalCache
+from embed_and_vector_store.reranker import CrossEncoderReranker, rerank_candidates
+from gensql_common.llm_client import create_client, query_llm
+from gensql_common.checkpoint import JsonlCheckpoint
+from gensql_common.schema_registry import render_schema
 
 # โหลดโมเดล fastText language detection
 lang_model = fasttext.load_model("./lang_detect_model/lid.176.bin")
@@ -73,37 +85,14 @@ def format_time(seconds):
     remaining_seconds = remaining_seconds % 60
     return f"{hours} ชั่วโมง {minutes} นาที {remaining_seconds:.2f} วินาที ({seconds:.2f} วินาที)"
 
-# ฟังก์ชันเรียก Ollama API
-def query_ollama(prompt, question_id, query, num_ctx):
-    url = "http://localhost:11434/api/generate"
-    payload = {
-        "model": "gemma3:12b",
-        "prompt": prompt,
-        "stream": False,
-        "options": {"num_ctx": num_ctx}
-    }
-    start_time = time.time()
-    try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        if 'response' not in data:
-            print(f"Ollama returned: {json.dumps(data, indent=2)}")
-            raise ValueError("Invalid response format: 'response' key missing")
-        end_time = time.time()
-        generation_time = end_time - start_time
-        return data['response'].strip(), generation_time
-    except (requests.RequestException, ValueError) as e:
-        print(f"Error for Question ID {question_id}: {e}")
-        error_log.append({
-            "question_id": question_id,
-            "question": query,
-            "error": str(e)
-        })
-        return "", -1
+# LLM client กลาง (connection pool, timeout และ retry)
+llm_client = create_client("ollama", model="gemma3:12b")
+
+# cross-encoder สำหรับ rerank (โหลดโมเดลเมื่อใช้งานครั้งแรก)
+reranker = CrossEncoderReranker()
 
 # โหลดโมเดล embedding
-embedding_model = SentenceTransformer('BAAI/bge-m3')
+embedding_model = CachedEncoder('BAAI/bge-m3')
 
 # กำหนด path สำหรับ Vector Store
 persist_directory = "./embed_and_vector_store/vector_store/"
@@ -113,19 +102,12 @@ client = chromadb.PersistentClient(path=persist_directory)
 evidence_collection_name = "bird_train_set_evidence_bge_m3"
 evidence_collection = client.get_collection(evidence_collection_name)
 
-# ฟังก์ชัน Similarity Search (Top N = 15) พร้อมกรองภาษา
-def perform_similarity_search(query_text, lang="en", top_n=15):
-    query_embedding = embedding_model.encode([query_text]).tolist()[0]
-    results = evidence_collection.query(
-        query_embeddings=[query_embedding],
-        n_results=top_n,
-        where={"language": lang}
-    )
-    ids = results["ids"][0]
-    documents = results["documents"][0]
-    metadatas = results["metadatas"][0]
-    distances = results["distances"][0]
-    return ids, documents, metadatas, distances
+# path ของ NumPy exact kNN index (ใช้เมื่อเลือก --search_backend numpy)
+numpy_index_dir = os.path.join("./embed_and_vector_store/numpy_index/", evidence_collection_name)
+
+# ฟังก์ชัน Similarity Search (Top N) แบบ batch ทั้ง test set พร้อม filter ภาษา (จัดกลุ่ม query ตามภาษา)
+def perform_batch_similarity_search(search_index, query_texts, langs, top_n=15, cache=None):
+    return batch_similarity_search(search_index, embedding_model, query_texts, langs=langs, top_n=top_n, cache=cache)
 
 # ฟังก์ชันคัดกรองด้วย LLM เพื่อเลือก Top K = 5
 def rerank_with_llm(original_query, lang_display, question_id, ids, documents, metadatas, distances, top_k=5):
@@ -162,7 +144,7 @@ def rerank_with_llm(original_query, lang_display, question_id, ids, documents, m
     print(f"Dynamic num_ctx for reranking: {num_ctx}")
     print(f"\nReranking for Top K = {top_k}...")
 
-    response, rerank_time = query_ollama(prompt, f"rerank_q{question_id}", original_query, num_ctx)
+    response, rerank_time = query_llm(llm_client, prompt, error_log, {"question_id": f"rerank_q{question_id}", "question": original_query}, num_ctx)
     
     # บันทึกข้อมูลโทเค็นของ rerank
     token_log.append({
@@ -192,19 +174,9 @@ def rerank_with_llm(original_query, lang_display, question_id, ids, documents, m
     
     return top_indices, rerank_time
 
-# ฟังก์ชันดึง schema จาก train_tables.json (เพิ่ม backticks รอบชื่อคอลัมน์)
+# ฟังก์ชันดึง schema จาก train_tables.json (เพิ่ม backticks รอบชื่อคอลัมน์) โดยโหลดไฟล์ครั้งเดียวผ่าน schema registry
 def get_schema(db_id, tables_file='./bird/data/train/train_tables.json'):
-    with open(tables_file, 'r') as f:
-        tables = json.load(f)
-    for db in tables:
-        if db['db_id'] == db_id:
-            schema = []
-            for table_idx, table_name in enumerate(db['table_names_original']):
-                columns = [f"`{col[1]}`" for col in db['column_names_original'] if col[0] == table_idx]
-                if columns:
-                    schema.append(f"Table: {table_name}, Columns: {', '.join(columns)}")
-            return '\n'.join(schema)
-    return ""
+    return render_schema(db_id, tables_file, schema_format="backticks")
 
 # ฟังก์ชันล้าง Markdown และแปลง SQL เป็นบรรทัดเดียว
 def clean_sql(sql):
@@ -255,7 +227,7 @@ def generate_sql(query_text, lang_display, question_id, db_id, evidence_text, to
     print(f"\nSQL Generating...\n")
 
     # เรียก API และเก็บเวลาการ Generate
-    sql, sql_gen_time = query_ollama(prompt, question_id, query_text, num_ctx)
+    sql, sql_gen_time = query_llm(llm_client, prompt, error_log, {"question_id": question_id, "question": query_text}, num_ctx)
     cleaned_sql = clean_sql(sql)
     
     # บันทึกข้อมูลโทเค็นของ SQL generation
@@ -271,8 +243,25 @@ def generate_sql(query_text, lang_display, question_id, db_id, evidence_text, to
     return cleaned_sql, sql_gen_time
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--search_backend', choices=['chroma', 'numpy'], default='chroma')
+    parser.add_argument('--quantization', choices=['float32', 'float16', 'int8'], default='float32')
+    parser.add_argument('--rebuild_index', action='store_true', help='re-export the NumPy index from the collection (e.g. after records were updated in place)')
+    parser.add_argument('--reranker', choices=['cross_encoder', 'llm'], default='cross_encoder')
+    parser.add_argument('--llm_tie_break', action='store_true', help='ask the LLM only for near-ties at the top-k cut (cross_encoder)')
+    parser.add_argument('--no_retrieval_cache', action='store_true', help='always re-run the similarity search')
+    parser.add_argument('--resume', action='store_true', help='skip question_ids already in the checkpoint')
+    args = parser.parse_args()
+
+    # เลือก backend สำหรับ Similarity Search (chroma หรือ NumPy exact kNN, ใช้ float16/int8 ได้เมื่อเป็น numpy)
+    search_index = load_search_index(args.search_backend, evidence_collection, numpy_index_dir, quantization=args.quantization, rebuild=args.rebuild_index)
+    print(f"Search backend: {args.search_backend} ({args.quantization})")
+
+    # cache ผลลัพธ์ Similarity Search (ใช้ซ้ำได้เมื่อ collection, คำถาม, ภาษา และ top_n เหมือนเดิม)
+    retrieval_cache = None if args.no_retrieval_cache else RetrievalCache(search_index, embedding_model.model_name)
+
     # ทดสอบการเชื่อมต่อกับ Ollama API
-    response, generation_time = query_ollama("Test prompt", "test_question_id", "Test query", num_ctx=2048)
+    response, generation_time = query_llm(llm_client, "Test prompt", [], {"question_id": "test_question_id", "question": "Test query"}, num_ctx=2048)
     print("Ollama Response:", response)
     print(f"Generation Time: {format_time(generation_time)}\n\n")
 
@@ -281,11 +270,16 @@ def main():
     with open(test_file, 'r', encoding='utf-8') as f:
         test_data = json.load(f)
 
-    # เตรียม dictionary สำหรับ predict_test.json
-    predict_test_json = {}
+    # Checkpoint แบบ JSONL: เขียนผลของแต่ละคำถามทันทีที่เสร็จ และใช้ --resume เพื่อข้ามคำถามที่ทำเสร็จแล้ว
+    checkpoint_file = './bird/exp_result/gemma3_test_split_output/log/eng_baseline_with_evidence_checkpoint.jsonl'
+    checkpoint = JsonlCheckpoint(checkpoint_file, resume=args.resume)
 
     data = test_data[:10]
+    skipped = sum(1 for item in data if checkpoint.is_done(item['question_id']))
+    data = [item for item in data if not checkpoint.is_done(item['question_id'])]
     total_data = len(data)
+    if args.resume:
+        print(f"Resume: {skipped} questions already in checkpoint, {total_data} remaining\n")
 
     top_n = 15
     top_k = 5
@@ -293,16 +287,12 @@ def main():
     # วัดเวลาเริ่มต้นทั้งหมด
     overall_start_time = time.time()
 
-    # ประมวลผล Test set
-    for i, item in enumerate(data):
-        print(f"Processed Test question {i+1}/{total_data}")
-        question_id = item['question_id']
-        question = item['question']
-        question_th = item.get('question_th')
-        db_id = item['db_id']
-        
+    # ตรวจจับภาษาของทุกคำถามก่อน เพื่อดึง Top N Evidence แบบ batch ครั้งเดียว
+    query_texts = []
+    query_langs = []
+    for item in data:
         # เลือกคำถามที่ใช้
-        query_text = question_th
+        query_text = item.get('question_th')
 
         # ตรวจจับภาษา
         lang = detect_language(query_text)
@@ -310,20 +300,40 @@ def main():
             lang_count_log[lang] += 1
         else:
             lang_count_log["other"] += 1
-            print(f"⚠️ Unsupported language '{lang}' detected for Question ID {question_id}, falling back to 'en'")
+            print(f"⚠️ Unsupported language '{lang}' detected for Question ID {item['question_id']}, falling back to 'en'")
             lang = 'en'
 
+        query_texts.append(query_text)
+        query_langs.append(lang)
+
+    # ดึง Top N Evidence ของทุกคำถาม
+    search_start_time = time.time()
+    search_results = perform_batch_similarity_search(search_index, query_texts, query_langs, top_n=top_n, cache=retrieval_cache)
+    print(f"Batch Similarity Search Time: {format_time(time.time() - search_start_time)} for {total_data} questions")
+
+    # ประมวลผล Test set
+    for i, item in enumerate(data):
+        print(f"Processed Test question {i+1}/{total_data}")
+        question_id = item['question_id']
+
+        # ตำแหน่งเริ่มต้นของ log ของคำถามนี้ (เพื่อเก็บลง checkpoint)
+        token_log_start = len(token_log)
+        token_exceed_log_start = len(token_exceed_log)
+        error_log_start = len(error_log)
+        db_id = item['db_id']
+        query_text = query_texts[i]
+        lang = query_langs[i]
+
         lang_display = {
             "th": "Thai",
             "en": "English"
         }.get(lang, lang.capitalize())
 
-        # ดึง Top N Evidence
         print(f"\n=== Fetching Evidence for Question ID: {question_id} ===")
         print(f"Original Query: {query_text}")
-        ids, documents, metadatas, distances = perform_similarity_search(query_text, lang=lang, top_n=top_n)
+        ids, documents, metadatas, distances = search_results[i]
         
-        print(f"\nInitial Top {top_n} Results (Before LLM Reranking):")
+        print(f"\nInitial Top {top_n} Results (Before Reranking):")
         has_matching_id_top_n = False
         for j, (doc_id, doc, meta, dist) in enumerate(zip(ids, documents, metadatas, distances)):
             evidence_number_top_n = int(re.search(r'q(\d+)_', doc_id).group(1)) if re.search(r'q(\d+)_', doc_id) else None
@@ -344,10 +354,17 @@ def main():
         else:
             id_match_log_top_n["incorrect"] += 1
 
-        # คัดกรองด้วย LLM เพื่อเลือก Top K
-        top_indices, rerank_time = rerank_with_llm(query_text, lang_display, question_id, ids, documents, metadatas, distances, top_k=top_k)
+        # คัดกรองด้วย cross-encoder (ค่าเริ่มต้น) หรือ LLM เพื่อเลือก Top K
+        if args.reranker == 'llm':
+            top_indices, rerank_time = rerank_with_llm(query_text, lang_display, question_id, ids, documents, metadatas, distances, top_k=top_k)
+        else:
+            candidates = [meta['evidence'] for meta in metadatas]
+            top_indices, rerank_time = rerank_candidates(reranker, query_text, candidates, top_k, question_id=question_id,
+                                                         client=llm_client if args.llm_tie_break else None, error_log=error_log,
+                                                         token_log=token_log, token_counter=lambda prompt: count_tokens(prompt, question_id, query_text))
+            print(f"\nCross-encoder reranking time: {format_time(rerank_time)}")
         
-        print(f"\nTop {top_k} Results (After LLM Reranking):")
+        print(f"\nTop {top_k} Results (After {'LLM' if args.reranker == 'llm' else 'Cross-Encoder'} Reranking):")
         selected_evidence = []
         has_matching_id_top_k = False
         for j, idx in enumerate(top_indices):
@@ -393,7 +410,22 @@ def main():
         
         # รูปแบบสำหรับ predict_test.json: SQL \t----- bird -----\t db_id
         json_line = f"{cleaned_sql}\t----- bird -----\t{db_id}"
-        predict_test_json[str(question_id)] = json_line
+
+        # บันทึกผลของคำถามนี้ลง checkpoint ทันที
+        checkpoint.append({
+            "question_id": question_id,
+            "db_id": db_id,
+            "ok": sql_gen_time >= 0,
+            "predict_line": json_line,
+            "rerank_time": rerank_time,
+            "sql_gen_time": sql_gen_time,
+            "total_llm_time": total_llm_time,
+            "match_top_n": has_matching_id_top_n,
+            "match_top_k": has_matching_id_top_k,
+            "token_log": token_log[token_log_start:],
+            "token_exceed_log": token_exceed_log[token_exceed_log_start:],
+            "error_log": error_log[error_log_start:]
+        })
         
         print(f"Question ID: {question_id}")
         print(f"Question: {query_text}")
@@ -403,13 +435,22 @@ def main():
         print(f"Total LLM Time: {formatted_total_llm_time}")
         print("-----------------------------------------------------------------------------------------------------------\n\n")
 
-    # สร้าง predict_test.json
-    with open('./bird/exp_result/gemma3_test_split_output/eng_baseline_with_evidence.json', 'w', encoding='utf-8') as f:
-        json.dump(predict_test_json, f, ensure_ascii=False, indent=4)
+    # สร้าง predict_test.json จาก checkpoint (รวมคำถามที่ทำเสร็จจากรอบก่อนหน้าด้วย)
+    checkpoint.compile_json('./bird/exp_result/gemma3_test_split_output/eng_baseline_with_evidence.json', 'predict_line')
+    records = checkpoint.records()
 
-    # สร้าง token_log.json
+    # สร้าง token_log.json จาก checkpoint
+    all_token_log = [entry for record in records for entry in record['token_log']]
     with open('./bird/exp_result/gemma3_test_split_output/log/eng_baseline_with_evidence_token_log.json', 'w', encoding='utf-8') as f:
-        json.dump(token_log, f, ensure_ascii=False, indent=4)
+        json.dump(all_token_log, f, ensure_ascii=False, indent=4)
+
+    # สรุปผลจาก checkpoint ทั้งหมด ไม่ใช่เฉพาะรอบนี้
+    token_exceed_log[:] = [entry for record in records for entry in record['token_exceed_log']]
+    error_log[:] = [entry for record in records for entry in record['error_log']]
+    id_match_log_top_n["correct"] = sum(1 for record in records if record['match_top_n'])
+    id_match_log_top_n["incorrect"] = len(records) - id_match_log_top_n["correct"]
+    id_match_log_top_k["correct"] = sum(1 for record in records if record['match_top_k'])
+    id_match_log_top_k["incorrect"] = len(records) - id_match_log_top_k["correct"]
 
     print("=== Generated successful!!! ===")
 
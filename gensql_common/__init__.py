@@ -0,0 +1,3 @@
+"""
+Shared code for the SQL generation, retrieval and reranking scripts.
+"""
@@ -0,0 +1,69 @@
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+This module implements the concurrent driver used by the dev-set generation scripts.
+Each question is processed by a plain (blocking) function that runs in a worker thread;
+an asyncio semaphore keeps at most `concurrency` questions in flight, and the client's
+rate limiter spaces out the requests sent to the backend.
+Results are returned in input order, so output files are written exactly as in a sequential run.
+"""
+
+# Default number of questions in flight for each backend.
+# Ollama only runs OLLAMA_NUM_PARALLEL requests at once (4 by default); the rest wait in its queue.
+DEFAULT_CONCURRENCY = {
+    "ollama": 4,
+    "openai": 16,
+    "mock": 32
+}
+
+
+def parse_driver_args(client, description=None, resumable=False):
+    """
+    Parses --concurrency and --rate_limit from the command line and applies them to the client.
+    --rate_limit is in requests per second; 0 disables rate limiting, and when omitted the
+    backend default from create_client is kept.
+    With resumable=True a --resume flag is added for scripts that write a JsonlCheckpoint.
+    """
+    args_parser = argparse.ArgumentParser(description=description)
+    args_parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY.get(client.backend.name, 4))
+    args_parser.add_argument('--rate_limit', type=float, default=None)
+    if resumable:
+        args_parser.add_argument('--resume', action='store_true', help='skip question_ids already in the checkpoint')
+    args = args_parser.parse_args()
+    if args.concurrency < 1:
+        args_parser.error("--concurrency must be at least 1")
+    client.set_pool_size(max(args.concurrency, 1))
+    if args.rate_limit is not None:
+        client.set_rate_limit(args.rate_limit)
+    return args
+
+
+async def _run_all(items, process_fn, concurrency, on_done):
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    results = [None] * len(items)
+    completed = 0
+
+    async def run_one(i, item):
+        nonlocal completed
+        async with semaphore:
+            results[i] = await loop.run_in_executor(executor, process_fn, i, item)
+        completed += 1
+        if on_done is not None:
+            on_done(completed, len(items), results[i])
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        await asyncio.gather(*(run_one(i, item) for i, item in enumerate(items)))
+    return results
+
+
+def run_concurrent(items, process_fn, concurrency=4, on_done=None):
+    """
+    Calls process_fn(i, item) for every item with at most `concurrency` calls in flight
+    and returns the results in the order of items.
+    on_done(completed, total, result) is called from the event loop as each item finishes,
+    so progress printing from it never interleaves.
+    """
+    return asyncio.run(_run_all(items, process_fn, concurrency, on_done))
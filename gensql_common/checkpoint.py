@@ -0,0 +1,73 @@
+import json
+import os
+
+"""
+This module implements an append-only JSONL checkpoint for generation runs.
+Every finished question is appended as one JSON line (flushed and fsynced), so a crash
+loses at most the question that was in flight. With resume=True the existing file is read
+back and questions that already finished successfully are skipped; the final prediction
+file is compiled from the checkpoint rather than from in-memory state.
+"""
+
+
+class JsonlCheckpoint:
+    """
+    Records are dicts keyed by record[key] (question_id by default). If a key appears
+    more than once, the last record wins. A record with "ok": False (e.g. an LLM error)
+    is kept for the final output but is not treated as done, so --resume retries it.
+    """
+    def __init__(self, path, key="question_id", resume=False):
+        self.path = path
+        self.key = key
+        self._records = {}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if resume:
+            self._load()
+        else:
+            open(path, "w", encoding="utf-8").close()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        # A crash in the middle of a write leaves a partial last line; drop it before appending
+        complete = data[:data.rfind(b"\n") + 1]
+        if len(complete) != len(data):
+            with open(self.path, "r+b") as f:
+                f.truncate(len(complete))
+        for line in complete.decode("utf-8").splitlines():
+            if line.strip():
+                record = json.loads(line)
+                self._records[str(record[self.key])] = record
+
+    def __len__(self):
+        return len(self._records)
+
+    def is_done(self, key_value):
+        record = self._records.get(str(key_value))
+        return record is not None and record.get("ok", True)
+
+    def append(self, record):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._records[str(record[self.key])] = record
+
+    def records(self):
+        """
+        Latest record per key, sorted by key.
+        """
+        return sorted(self._records.values(), key=lambda record: record[self.key])
+
+    def compile_json(self, output_path, field):
+        """
+        Writes {str(key): record[field]} for every record (sorted by key) to output_path and returns it.
+        """
+        compiled = {str(record[self.key]): record[field] for record in self.records()}
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(compiled, f, ensure_ascii=False, indent=4)
+        return compiled
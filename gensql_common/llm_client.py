@@ -0,0 +1,228 @@
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+"""
+This module implements the LLM client shared by all generation, translation and reranking scripts.
+A single pooled requests.Session is reused for every call (keep-alive, no new TCP connection per prompt),
+every request has connect/read timeouts, and 5xx responses and connection errors are retried
+with exponential backoff. The backend (Ollama, OpenAI chat completions or a local mock) is pluggable.
+"""
+
+
+class LLMError(Exception):
+    """
+    Raised when a generation request fails after all retries or returns an unusable response.
+    """
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket: on average at most `rate` requests per second, with bursts of up to `burst`.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Reserve a token even if it is not there yet, so waiting callers are served in order
+            wait = (1.0 - self.tokens) / self.rate if self.tokens < 1.0 else 0.0
+            self.tokens -= 1.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class OllamaBackend:
+    name = "ollama"
+
+    def __init__(self, model="gemma3:12b", base_url="http://localhost:11434"):
+        self.model = model
+        self.url = f"{base_url.rstrip('/')}/api/generate"
+
+    def build_request(self, prompt, num_ctx=None):
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": False
+        }
+        if num_ctx is not None:
+            payload["options"] = {"num_ctx": num_ctx}
+        return self.url, payload, {}
+
+    def parse_response(self, data):
+        if 'response' not in data:
+            raise LLMError("Invalid response format: 'response' key missing")
+        return data['response'].strip()
+
+
+class OpenAIChatBackend:
+    name = "openai"
+
+    def __init__(self, model="gpt-4.1-mini", api_key=None, base_url="https://api.openai.com/v1",
+                 system_prompt=None, max_tokens=200, temperature=0.0):
+        self.model = model
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.url = f"{base_url.rstrip('/')}/chat/completions"
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+
+    def build_request(self, prompt, num_ctx=None):
+        messages = []
+        if self.system_prompt:
+            messages.append({"role": "system", "content": self.system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature
+        }
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        return self.url, payload, headers
+
+    def parse_response(self, data):
+        try:
+            return data["choices"][0]["message"]["content"].strip()
+        except (KeyError, IndexError, TypeError, AttributeError):
+            raise LLMError("Invalid response format: 'choices[0].message.content' missing")
+
+
+class MockBackend:
+    """
+    Local backend that never touches the network, for dry runs and tests.
+    responder(prompt) returns the text; by default every prompt gets the same fixed response.
+    """
+    name = "mock"
+
+    def __init__(self, responder=None, response="SELECT 1;", latency=0.0):
+        self.responder = responder or (lambda prompt: response)
+        self.latency = latency
+
+    def complete(self, prompt, num_ctx=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.responder(prompt)
+
+
+class LLMClient:
+    def __init__(self, backend, timeout=(10, 300), max_retries=3, backoff_base=1.0, backoff_max=30.0, pool_size=16,
+                 rate_limit=None):
+        self.backend = backend
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.session = requests.Session()
+        self.set_pool_size(pool_size)
+        self.set_rate_limit(rate_limit)
+
+    def set_pool_size(self, pool_size):
+        """
+        Sizes the connection pool; it should be at least the number of concurrent callers.
+        """
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def set_rate_limit(self, rate_limit):
+        """
+        Limits requests to rate_limit per second across all threads; None or 0 disables the limit.
+        """
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+
+    def close(self):
+        self.session.close()
+
+    def _backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        time.sleep(delay * (1 + 0.1 * random.random()))
+
+    def generate(self, prompt, num_ctx=None):
+        """
+        Sends one prompt and returns (text, generation_time in seconds).
+        Connection errors, timeouts and 5xx responses are retried up to max_retries times;
+        any other failure raises LLMError immediately.
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        start_time = time.time()
+        if hasattr(self.backend, "complete"):
+            text = self.backend.complete(prompt, num_ctx=num_ctx)
+            return text, time.time() - start_time
+
+        url, payload, headers = self.backend.build_request(prompt, num_ctx=num_ctx)
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(url, json=payload, headers=headers, timeout=self.timeout)
+                if response.status_code >= 500:
+                    last_error = LLMError(f"{self.backend.name} returned HTTP {response.status_code}: {response.text[:200]}")
+                else:
+                    response.raise_for_status()
+                    text = self.backend.parse_response(response.json())
+                    return text, time.time() - start_time
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = e
+            except (requests.RequestException, ValueError) as e:
+                raise LLMError(str(e)) from e
+            if attempt < self.max_retries:
+                print(f"[LLM] {self.backend.name} request failed ({last_error}), retry {attempt + 1}/{self.max_retries}")
+                self._backoff(attempt)
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire()
+        raise LLMError(f"Failed after {self.max_retries + 1} attempts: {last_error}")
+
+
+BACKENDS = {
+    "ollama": OllamaBackend,
+    "openai": OpenAIChatBackend,
+    "mock": MockBackend
+}
+
+# Default requests per second for each backend (None = unlimited).
+# A local Ollama server is bounded by its own parallelism, OpenAI by the account's RPM limit.
+DEFAULT_RATE_LIMITS = {
+    "ollama": None,
+    "openai": 8.0,
+    "mock": None
+}
+
+
+def create_client(backend="ollama", timeout=(10, 300), max_retries=3, rate_limit=None, **backend_kwargs):
+    """
+    Creates an LLMClient for the named backend. The LLM_BACKEND environment variable overrides
+    the backend name (e.g. LLM_BACKEND=mock for a dry run of any script).
+    rate_limit defaults to DEFAULT_RATE_LIMITS for the backend.
+    """
+    backend = os.getenv("LLM_BACKEND", backend)
+    if backend == "mock":
+        backend_kwargs = {}
+    if rate_limit is None:
+        rate_limit = DEFAULT_RATE_LIMITS[backend]
+    return LLMClient(BACKENDS[backend](**backend_kwargs), timeout=timeout, max_retries=max_retries, rate_limit=rate_limit)
+
+
+def query_llm(client, prompt, error_log, log_entry, num_ctx=None):
+    """
+    Calls client.generate and returns (text, generation_time).
+    On failure the error is printed, {**log_entry, "error": message} is appended to error_log
+    and ("", -1) is returned, which is the convention every generation script uses for errors.
+    """
+    try:
+        return client.generate(prompt, num_ctx=num_ctx)
+    except LLMError as e:
+        key, value = next(iter(log_entry.items()))
+        print(f"Error for {key} {value}: {e}")
+        error_log.append({**log_entry, "error": str(e)})
+        return "", -1
@@ -0,0 +1,70 @@
+import json
+import os
+import threading
+
+"""
+This module implements the schema registry shared by the generation scripts.
+Each tables JSON file (train_tables.json, dev_tables.json, spider tables.json) is loaded once
+per process and indexed by db_id, and the rendered "Table: ..., Columns: ..." prompt string
+is memoized per (tables file, db_id, format).
+"""
+
+# How a column name is written in the prompt
+SCHEMA_FORMATS = {
+    "backticks": lambda column: f"`{column}`",  # BIRD
+    "plain": lambda column: column               # Spider
+}
+
+
+class SchemaRegistry:
+    def __init__(self):
+        self._databases = {}
+        self._rendered = {}
+        self._lock = threading.Lock()
+
+    def _get_databases(self, tables_file):
+        path = os.path.abspath(tables_file)
+        if path not in self._databases:
+            with self._lock:
+                if path not in self._databases:
+                    with open(path, 'r') as f:
+                        tables = json.load(f)
+                    self._databases[path] = {db['db_id']: db for db in tables}
+        return path, self._databases[path]
+
+    def get_database(self, db_id, tables_file):
+        """
+        Returns the raw tables JSON entry for db_id, or None if the file has no such database.
+        """
+        return self._get_databases(tables_file)[1].get(db_id)
+
+    def render(self, db_id, tables_file, schema_format="backticks"):
+        """
+        Returns the "Table: name, Columns: a, b" lines for db_id (tables without columns are skipped),
+        or "" if db_id is not in the file.
+        """
+        path, databases = self._get_databases(tables_file)
+        key = (path, db_id, schema_format)
+        if key not in self._rendered:
+            db = databases.get(db_id)
+            if db is None:
+                return ""
+            format_column = SCHEMA_FORMATS[schema_format]
+            columns_by_table = {}
+            for table_idx, column_name in db['column_names_original']:
+                columns_by_table.setdefault(table_idx, []).append(format_column(column_name))
+            schema = []
+            for table_idx, table_name in enumerate(db['table_names_original']):
+                columns = columns_by_table.get(table_idx)
+                if columns:
+                    schema.append(f"Table: {table_name}, Columns: {', '.join(columns)}")
+            self._rendered[key] = '\n'.join(schema)
+        return self._rendered[key]
+
+
+# Registry shared by every caller in the process
+schema_registry = SchemaRegistry()
+
+
+def render_schema(db_id, tables_file, schema_format="backticks"):
+    return schema_registry.render(db_id, tables_file, schema_format=schema_format)
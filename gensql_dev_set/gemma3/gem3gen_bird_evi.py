@@ -1,20 +1,18 @@
 import json
-import requests
 import re
+import os
+import sys
 
-# ฟังก์ชันดึง schema จาก dev_tables.json (เพิ่ม backticks รอบชื่อคอลัมน์)
+# เพิ่ม root ของ repo ใน sys.path เพื่อ import โมดูลที่ใช้ร่วมกัน
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from gensql_common.llm_client import create_client, query_llm
+from gensql_common.async_driver import parse_driver_args, run_concurrent
+from gensql_common.checkpoint import JsonlCheckpoint
+from gensql_common.schema_registry import render_schema
+
+# ฟังก์ชันดึง schema จาก dev_tables.json (เพิ่ม backticks รอบชื่อคอลัมน์) โดยโหลดไฟล์ครั้งเดียวผ่าน schema registry
 def get_schema(db_id, tables_file='bird/data/dev/dev_tables.json'):
-    with open(tables_file, 'r') as f:
-        tables = json.load(f)
-    for db in tables:
-        if db['db_id'] == db_id:
-            schema = []
-            for table_idx, table_name in enumerate(db['table_names_original']):
-                columns = [f"`{col[1]}`" for col in db['column_names_original'] if col[0] == table_idx]
-                if columns:
-                    schema.append(f"Table: {table_name}, Columns: {', '.join(columns)}")
-            return '\n'.join(schema)
-    return ""
+    return render_schema(db_id, tables_file, schema_format="backticks")
 
 # ฟังก์ชันล้าง Markdown และแปลง SQL เป็นบรรทัดเดียว
 def clean_sql(sql):
@@ -24,69 +22,73 @@ def clean_sql(sql):
         sql += ';'
     return sql.strip()
 
-# ฟังก์ชันเรียก Ollama API
-def query_ollama(prompt, error_log, question_id, question):
-    url = "http://localhost:11434/api/generate"
-    payload = {
-        "model": "gemma3:12b",
-        "prompt": prompt,
-        "stream": False
-    }
-    try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        return response.json()['response'].strip()
-    except Exception as e:
-        print(f"Error for Question ID {question_id}: {e}")
-        error_log.append({
-            "question_id": question_id,
-            "question": question,
-            "error": str(e)
-        })
-        return ""
+# LLM client กลาง (connection pool, timeout และ retry)
+llm_client = create_client("ollama", model="gemma3:12b")
 
 # อ่าน dev.json ของ BIRD-SQL
 with open('bird/data/dev/dev.json', 'r') as f:
     dev_data = json.load(f)
 
+# จำนวนคำถามที่ประมวลผลพร้อมกัน, rate limit และ --resume
+args = parse_driver_args(llm_client, resumable=True)
+
+# Checkpoint แบบ JSONL: เขียนผลของแต่ละคำถามทันทีที่เสร็จ และใช้ --resume เพื่อข้ามคำถามที่ทำเสร็จแล้ว
+checkpoint = JsonlCheckpoint('bird/exp_result/gemma3_output_kg/predict_dev_checkpoint.jsonl', resume=args.resume)
+pending_data = [item for item in dev_data if not checkpoint.is_done(item['question_id'])]
+if args.resume:
+    print(f"Resume: {len(dev_data) - len(pending_data)} questions already in checkpoint, {len(pending_data)} remaining\n")
+
 # เตรียม dictionary สำหรับ predict_dev.json และ list สำหรับเก็บ error
 predict_json = {}
 error_log = []
 
-# สร้าง predict_dev.txt และเก็บข้อมูลสำหรับ predict_dev.json
-with open('bird/exp_result/gemma3_output_kg/predict_dev.txt', 'w') as f:
-    for i, item in enumerate(dev_data):
-        question_id = item['question_id']
-        question = item['question']
-        db_id = item['db_id']
-        evidence = item.get('evidence', '')  # ดึง evidence ถ้าไม่มีให้เป็น string ว่าง
-        schema = get_schema(db_id)
-        
-        # เพิ่ม evidence ใน prompt ถ้ามี
-        evidence_text = f"\nAdditional evidence: {evidence}" if evidence else ""
-        prompt = f"""Given the following database schema:
+# ฟังก์ชันประมวลผลคำถามหนึ่งข้อ (รันใน worker thread)
+def process_item(i, item):
+    question_id = item['question_id']
+    question = item['question']
+    db_id = item['db_id']
+    evidence = item.get('evidence', '')  # ดึง evidence ถ้าไม่มีให้เป็น string ว่าง
+    schema = get_schema(db_id)
+    
+    # เพิ่ม evidence ใน prompt ถ้ามี
+    evidence_text = f"\nAdditional evidence: {evidence}" if evidence else ""
+    prompt = f"""Given the following database schema:
 {schema}{evidence_text}
 Translate this natural language question into a valid SQL query:
 {question}
 Output only the SQL query as a single line, without Markdown formatting (e.g., ```sql), explanations, or additional text."""
-        
-        sql = query_ollama(prompt, error_log, question_id, question)
-        cleaned_sql = clean_sql(sql)
-        
+    
+    question_errors = []
+    sql, _ = query_llm(llm_client, prompt, question_errors, {"question_id": question_id, "question": question})
+    cleaned_sql = clean_sql(sql)
+    return {"question_id": question_id, "ok": not question_errors, "question": question, "evidence": evidence, "db_id": db_id, "sql": cleaned_sql, "error_log": question_errors}
+
+# บันทึกลง checkpoint และแสดงผลเมื่อแต่ละคำถามเสร็จ (ลำดับตามที่เสร็จก่อน)
+def on_question_done(completed, total, result):
+    checkpoint.append(result)
+    print(f"Processed question {completed}/{total}")
+    print(f"Question ID: {result['question_id']}")
+    print(f"Question: {result['question']}")
+    print(f"Evidence: {result['evidence']}")
+    print(f"SQL query: {result['sql']}")
+    print("-----------------------------------------------------------------------------------------------------------\n\n")
+
+run_concurrent(pending_data, process_item, concurrency=args.concurrency, on_done=on_question_done)
+
+# ผลและ error ของทุกคำถามจาก checkpoint ตามลำดับ question_id (รวมคำถามที่ทำเสร็จจากรอบก่อนหน้าด้วย)
+results = checkpoint.records()
+error_log[:] = [error for result in results for error in result.get('error_log', [])]
+
+# สร้าง predict_dev.txt และเก็บข้อมูลสำหรับ predict_dev.json ตามลำดับ question_id
+with open('bird/exp_result/gemma3_output_kg/predict_dev.txt', 'w') as f:
+    for result in results:
         # รูปแบบสำหรับ predict_dev.txt: question_id \t SQL \t----- bird -----\t db_id
-        output_line = f"{question_id}\t{cleaned_sql}\t----- bird -----\t{db_id}"
+        output_line = f"{result['question_id']}\t{result['sql']}\t----- bird -----\t{result['db_id']}"
         f.write(f"{output_line}\n")
         
         # รูปแบบสำหรับ predict_dev.json: SQL \t----- bird -----\t db_id
-        json_line = f"{cleaned_sql}\t----- bird -----\t{db_id}"
-        predict_json[str(question_id)] = json_line
-        
-        print(f"Processed question {i+1}/{len(dev_data)}")
-        print(f"Question ID: {question_id}")
-        print(f"Question: {question}")
-        print(f"Evidence: {evidence}")
-        print(f"SQL query: {cleaned_sql}")
-        print("-----------------------------------------------------------------------------------------------------------\n\n")
+        json_line = f"{result['sql']}\t----- bird -----\t{result['db_id']}"
+        predict_json[str(result['question_id'])] = json_line
 
 # สร้าง predict_dev.json
 with open('bird/exp_result/gemma3_output_kg/predict_dev.json', 'w') as f:
@@ -1,20 +1,18 @@
 import json
-import requests
 import re
+import os
+import sys
 
-# ฟังก์ชันดึง schema จาก tables.json
+# เพิ่ม root ของ repo ใน sys.path เพื่อ import โมดูลที่ใช้ร่วมกัน
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from gensql_common.llm_client import create_client, query_llm
+from gensql_common.async_driver import parse_driver_args, run_concurrent
+from gensql_common.checkpoint import JsonlCheckpoint
+from gensql_common.schema_registry import render_schema
+
+# ฟังก์ชันดึง schema จาก tables.json โดยโหลดไฟล์ครั้งเดียวผ่าน schema registry
 def get_schema(db_id, tables_file='spider/data/tables.json'):
-    with open(tables_file, 'r') as f:
-        tables = json.load(f)
-    for db in tables:
-        if db['db_id'] == db_id:
-            schema = []
-            for table_idx, table_name in enumerate(db['table_names_original']):
-                columns = [col[1] for col in db['column_names_original'] if col[0] == table_idx]
-                if columns:
-                    schema.append(f"Table: {table_name}, Columns: {', '.join(columns)}")
-            return '\n'.join(schema)
-    return ""
+    return render_schema(db_id, tables_file, schema_format="plain")
 
 # ฟังก์ชันล้าง Markdown และแปลง SQL เป็นบรรทัดเดียว
 def clean_sql(sql):
@@ -23,54 +21,59 @@ def clean_sql(sql):
     sql = sql.rstrip(';')
     return sql.strip()
 
-# ฟังก์ชันเรียก Ollama API
-def query_ollama(prompt, error_log, index, question):
-    url = "http://localhost:11434/api/generate"
-    payload = {
-        "model": "gemma3:12b",
-        "prompt": prompt,
-        "stream": False
-    }
-    try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        return response.json()['response'].strip()
-    except Exception as e:
-        print(f"Error at index {index+1}: {e}")
-        # เก็บข้อมูล error ลงใน error_log
-        error_log.append({
-            "index": index+1,
-            "question": question,
-            "error": str(e)
-        })
-        return ""
+# LLM client กลาง (connection pool, timeout และ retry)
+llm_client = create_client("ollama", model="gemma3:12b")
 
 # อ่าน dev.json
 with open('spider/data/dev/dev.json', 'r') as f:
     dev_data = json.load(f)
 
+# จำนวนคำถามที่ประมวลผลพร้อมกัน, rate limit และ --resume
+args = parse_driver_args(llm_client, resumable=True)
+
+# Checkpoint แบบ JSONL (key เป็นลำดับใน dev.json): เขียนผลของแต่ละคำถามทันทีที่เสร็จ และใช้ --resume เพื่อข้ามคำถามที่ทำเสร็จแล้ว
+checkpoint = JsonlCheckpoint('spider/data/pred/gemma12b_pred_1034_checkpoint.jsonl', key="index", resume=args.resume)
+pending_data = [dict(item, index=i+1) for i, item in enumerate(dev_data) if not checkpoint.is_done(i+1)]
+if args.resume:
+    print(f"Resume: {len(dev_data) - len(pending_data)} questions already in checkpoint, {len(pending_data)} remaining\n")
+
 # เตรียม list สำหรับเก็บ error
 error_log = []
 
-# สร้าง predicted_sql.txt
-with open('spider/data/pred/gemma12b_pred_1034.txt', 'w') as f:
-    for i, item in enumerate(dev_data):
-        question = item['question']
-        db_id = item['db_id']
-        schema = get_schema(db_id)
-        prompt = f"""Given the following database schema:
+# ฟังก์ชันประมวลผลคำถามหนึ่งข้อ (รันใน worker thread)
+def process_item(i, item):
+    question = item['question']
+    db_id = item['db_id']
+    schema = get_schema(db_id)
+    prompt = f"""Given the following database schema:
 {schema}
 Translate this natural language question into a valid SQL query:
 {question}
 Output only the SQL query as a single line, without Markdown formatting (e.g., ```sql), explanations, or additional text."""
-        sql = query_ollama(prompt, error_log, i, question)
-        # ล้าง Markdown และแปลงเป็นบรรทัดเดียว
-        cleaned_sql = clean_sql(sql)
-        f.write(f"{cleaned_sql}\n")
-        print(f"Processed question {i+1}/{len(dev_data)}")
-        print(f"Question: {question}")
-        print(f"SQL query: {cleaned_sql}")
-        print("-----------------------------------------------------------------------------------------------------------\n\n")
+    question_errors = []
+    sql, _ = query_llm(llm_client, prompt, question_errors, {"index": item['index'], "question": question})
+    # ล้าง Markdown และแปลงเป็นบรรทัดเดียว
+    cleaned_sql = clean_sql(sql)
+    return {"index": item['index'], "ok": not question_errors, "question": question, "sql": cleaned_sql, "error_log": question_errors}
+
+# บันทึกลง checkpoint และแสดงผลเมื่อแต่ละคำถามเสร็จ (ลำดับตามที่เสร็จก่อน)
+def on_question_done(completed, total, result):
+    checkpoint.append(result)
+    print(f"Processed question {completed}/{total}")
+    print(f"Question: {result['question']}")
+    print(f"SQL query: {result['sql']}")
+    print("-----------------------------------------------------------------------------------------------------------\n\n")
+
+run_concurrent(pending_data, process_item, concurrency=args.concurrency, on_done=on_question_done)
+
+# ผลและ error ของทุกคำถามจาก checkpoint ตามลำดับของ dev.json (รวมคำถามที่ทำเสร็จจากรอบก่อนหน้าด้วย)
+results = checkpoint.records()
+error_log[:] = [error for result in results for error in result.get('error_log', [])]
+
+# สร้าง predicted_sql.txt ตามลำดับของ dev.json
+with open('spider/data/pred/gemma12b_pred_1034.txt', 'w') as f:
+    for result in results:
+        f.write(f"{result['sql']}\n")
 
 print("=== Generated successful!!! ===")
 
@@ -1,9 +1,16 @@
 import json
-import requests
 import re
 import time
 import csv
 import os
+import sys
+
+# เพิ่ม root ของ repo ใน sys.path เพื่อ import โมดูลที่ใช้ร่วมกัน
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from gensql_common.llm_client import create_client, query_llm
+from gensql_common.async_driver import parse_driver_args, run_concurrent
+from gensql_common.checkpoint import JsonlCheckpoint
+from gensql_common.schema_registry import render_schema
 
 # ฟังก์ชันแปลงเวลาจากวินาทีเป็นนาที+วินาที
 def format_time(seconds):
@@ -15,33 +22,8 @@ def format_time(seconds):
     remaining_seconds = seconds % 60
     return f"{minutes} นาที {remaining_seconds:.2f} วินาที ({seconds:.2f} วินาที)"
 
-# ฟังก์ชันเรียก Ollama API และวัดเวลา
-def query_ollama(prompt, error_log, question_id, context, max_retries=3, timeout=120):
-    url = "http://localhost:11434/api/generate"
-    payload = {
-        "model": "gemma3:12b",
-        "prompt": prompt,
-        "stream": False
-    }
-    start_time = time.time()
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(url, json=payload, timeout=timeout)
-            response.raise_for_status()
-            end_time = time.time()
-            generation_time = end_time - start_time
-            return response.json()['response'].strip(), generation_time
-        except Exception as e:
-            if attempt == max_retries - 1:
-                print(f"Error for Question ID {question_id} after {max_retries} attempts: {e}")
-                error_log.append({
-                    "question_id": question_id,
-                    "context": context,
-                    "error": str(e)
-                })
-                return "", -1
-            time.sleep(1)
-    return "", -1
+# LLM client กลาง (connection pool, timeout และ retry)
+llm_client = create_client("ollama", model="gemma3:12b", timeout=(10, 120), max_retries=2)
 
 # ฟังก์ชันแปลภาษาด้วย LLM และเก็บเวลาแปล
 def translate_to_english_with_llm(text, error_log, question_id):
@@ -56,23 +38,13 @@ Thai text:
 - Output only the translated English text.
 - Do not include explanations or additional text.
 """
-    translated_text, translation_time = query_ollama(prompt, error_log, question_id, f"Translation of: {text}")
+    translated_text, translation_time = query_llm(llm_client, prompt, error_log, {"question_id": question_id, "context": f"Translation of: {text}"})
     translated_text = translated_text if translated_text else text
     return translated_text, translation_time
 
-# ฟังก์ชันดึง schema จาก dev_tables.json
+# ฟังก์ชันดึง schema จาก dev_tables.json โดยโหลดไฟล์ครั้งเดียวผ่าน schema registry
 def get_schema(db_id, tables_file='bird/data/dev/dev_tables.json'):
-    with open(tables_file, 'r') as f:
-        tables = json.load(f)
-    for db in tables:
-        if db['db_id'] == db_id:
-            schema = []
-            for table_idx, table_name in enumerate(db['table_names_original']):
-                columns = [f"`{col[1]}`" for col in db['column_names_original'] if col[0] == table_idx]
-                if columns:
-                    schema.append(f"Table: {table_name}, Columns: {', '.join(columns)}")
-            return '\n'.join(schema)
-    return ""
+    return render_schema(db_id, tables_file, schema_format="backticks")
 
 # ฟังก์ชันล้าง Markdown และแปลง SQL เป็นบรรทัดเดียว
 def clean_sql(sql):
@@ -96,6 +68,15 @@ with open(log_file, 'w', newline='', encoding='utf-8') as f:
 with open('bird/data/dev/dev_j2c2j_error.json', 'r', encoding='utf-8') as f:
     dev_data = json.load(f)
 
+# จำนวนคำถามที่ประมวลผลพร้อมกัน, rate limit และ --resume
+args = parse_driver_args(llm_client, resumable=True)
+
+# Checkpoint แบบ JSONL: เขียนผลของแต่ละคำถามทันทีที่เสร็จ และใช้ --resume เพื่อข้ามคำถามที่ทำเสร็จแล้ว
+checkpoint = JsonlCheckpoint(os.path.join(log_dir, '12b_envi_j2c2j_tran_error_checkpoint.jsonl'), resume=args.resume)
+pending_data = [item for item in dev_data if not checkpoint.is_done(item['question_id'])]
+if args.resume:
+    print(f"Resume: {len(dev_data) - len(pending_data)} questions already in checkpoint, {len(pending_data)} remaining\n")
+
 # เตรียม dictionary สำหรับ predict_dev.json และ list สำหรับเก็บ error
 predict_json = {}
 error_log = []
@@ -103,8 +84,8 @@ error_log = []
 # วัดเวลาเริ่มต้นทั้งหมด
 overall_start_time = time.time()
 
-# ประมวลผลและเก็บข้อมูลสำหรับ predict_dev.json
-for i, item in enumerate(dev_data):
+# ฟังก์ชันประมวลผลคำถามหนึ่งข้อ (รันใน worker thread)
+def process_item(i, item):
     question_id = item['question_id']
     question_th = item['question_th']
     db_id = item['db_id']
@@ -113,9 +94,10 @@ for i, item in enumerate(dev_data):
     gold_sql = item.get('SQL', 'N/A')
     schema = get_schema(db_id)
     
+    question_errors = []
     # แปลคำถามและ evidence เป็นภาษาอังกฤษด้วย LLM พร้อมเก็บเวลา
-    question_en, question_translation_time = translate_to_english_with_llm(question_th, error_log, question_id)
-    evidence_en, evidence_translation_time = translate_to_english_with_llm(evidence_th, error_log, question_id)
+    question_en, question_translation_time = translate_to_english_with_llm(question_th, question_errors, question_id)
+    evidence_en, evidence_translation_time = translate_to_english_with_llm(evidence_th, question_errors, question_id)
     evidence_text = f"\nAdditional evidence: {evidence_en}" if evidence_en else ""
     
     # Prompt สำหรับ Generate SQL (ใช้คำถามภาษาอังกฤษ)
@@ -141,35 +123,65 @@ Translate the following natural language question into a valid SQL query:
 """
         
     # เรียก API และเก็บเวลาการ Generate
-    sql, generation_time = query_ollama(prompt, error_log, question_id, question_th, max_retries=3)
+    sql, generation_time = query_llm(llm_client, prompt, question_errors, {"question_id": question_id, "context": question_th})
     cleaned_sql = clean_sql(sql)
     
     # แปลงเวลาเป็นรูปแบบ "นาที+วินาที"
     formatted_generation_time = format_time(generation_time)
     formatted_question_translation_time = format_time(question_translation_time)
     formatted_evidence_translation_time = format_time(evidence_translation_time)
-    
+    return {
+        "question_id": question_id,
+        "ok": not question_errors,
+        "question_th": question_th,
+        "question_en": question_en,
+        "question_translation_time": question_translation_time,
+        "evidence_th": evidence_th,
+        "evidence_en": evidence_en,
+        "evidence_translation_time": evidence_translation_time,
+        "db_id": db_id,
+        "difficulty": difficulty,
+        "gold_sql": gold_sql,
+        "cleaned_sql": cleaned_sql,
+        "generation_time": generation_time,
+        "formatted_generation_time": formatted_generation_time,
+        "formatted_question_translation_time": formatted_question_translation_time,
+        "formatted_evidence_translation_time": formatted_evidence_translation_time,
+        "error_log": question_errors
+    }
+
+# บันทึกลง checkpoint และแสดงผลเมื่อแต่ละคำถามเสร็จ (ลำดับตามที่เสร็จก่อน)
+def on_question_done(completed, total, result):
+    checkpoint.append(result)
+    print(f"Processed question {completed}/{total}")
+    print(f"Question ID: {result['question_id']}")
+    print(f"Question (Thai): {result['question_th']}")
+    print(f"Question (English): {result['question_en']}")
+    print(f"Question Translation Time: {result['formatted_question_translation_time']}")
+    print(f"Evidence (Thai): {result['evidence_th']}")
+    print(f"Evidence (English): {result['evidence_en']}")
+    print(f"Evidence Translation Time: {result['formatted_evidence_translation_time']}")
+    print(f"Difficulty: {result['difficulty']}")
+    print(f"SQL query: {result['cleaned_sql']}")
+    print(f"SQL Generation Time: {result['formatted_generation_time']}")
+    print("-----------------------------------------------------------------------------------------------------------\n\n")
+
+run_concurrent(pending_data, process_item, concurrency=args.concurrency, on_done=on_question_done)
+
+# ผลและ error ของทุกคำถามจาก checkpoint ตามลำดับ question_id (รวมคำถามที่ทำเสร็จจากรอบก่อนหน้าด้วย)
+results = checkpoint.records()
+error_log[:] = [error for result in results for error in result.get('error_log', [])]
+
+# บันทึก log และเก็บข้อมูลสำหรับ predict_dev.json ตามลำดับ question_id
+for result in results:
     # บันทึก log (เก็บทั้งคำถามภาษาไทยและอังกฤษ รวมถึงเวลาแปล)
     with open(log_file, 'a', newline='', encoding='utf-8') as log_f:
         writer = csv.writer(log_f)
-        writer.writerow([question_id, question_th, question_en, question_translation_time, evidence_th, evidence_en, evidence_translation_time, difficulty, cleaned_sql, gold_sql, formatted_generation_time, generation_time])
+        writer.writerow([result['question_id'], result['question_th'], result['question_en'], result['question_translation_time'], result['evidence_th'], result['evidence_en'], result['evidence_translation_time'], result['difficulty'], result['cleaned_sql'], result['gold_sql'], result['formatted_generation_time'], result['generation_time']])
     
     # รูปแบบสำหรับ predict_dev.json
-    json_line = f"{cleaned_sql}\t----- bird -----\t{db_id}"
-    predict_json[str(question_id)] = json_line
-    
-    print(f"Processed question {i+1}/{len(dev_data)}")
-    print(f"Question ID: {question_id}")
-    print(f"Question (Thai): {question_th}")
-    print(f"Question (English): {question_en}")
-    print(f"Question Translation Time: {formatted_question_translation_time}")
-    print(f"Evidence (Thai): {evidence_th}")
-    print(f"Evidence (English): {evidence_en}")
-    print(f"Evidence Translation Time: {formatted_evidence_translation_time}")
-    print(f"Difficulty: {difficulty}")
-    print(f"SQL query: {cleaned_sql}")
-    print(f"SQL Generation Time: {formatted_generation_time}")
-    print("-----------------------------------------------------------------------------------------------------------\n\n")
+    json_line = f"{result['cleaned_sql']}\t----- bird -----\t{result['db_id']}"
+    predict_json[str(result['question_id'])] = json_line
 
 # สร้าง predict_dev.json
 with open('bird/exp_result/gemma3_output_kg/th/predict_dev_th_j2c2j_tran_error.json', 'w', encoding='utf-8') as f:
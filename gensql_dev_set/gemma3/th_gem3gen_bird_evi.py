@@ -1,9 +1,16 @@
 import json
-import requests
 import re
 import time
 import csv
 import os
+import sys
+
+# เพิ่ม root ของ repo ใน sys.path เพื่อ import โมดูลที่ใช้ร่วมกัน
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from gensql_common.llm_client import create_client, query_llm
+from gensql_common.async_driver import parse_driver_args, run_concurrent
+from gensql_common.checkpoint import JsonlCheckpoint
+from gensql_common.schema_registry import render_schema
 
 # ฟังก์ชันแปลงเวลาจากวินาทีเป็นนาที+วินาที
 def format_time(seconds):
@@ -15,19 +22,9 @@ def format_time(seconds):
     remaining_seconds = seconds % 60  # หาวินาทีที่เหลือ
     return f"{minutes} นาที {remaining_seconds:.2f} วินาที ({seconds:.2f} วินาที)"
 
-# ฟังก์ชันดึง schema จาก dev_tables.json (เพิ่ม backticks รอบชื่อคอลัมน์)
+# ฟังก์ชันดึง schema จาก dev_tables.json (เพิ่ม backticks รอบชื่อคอลัมน์) โดยโหลดไฟล์ครั้งเดียวผ่าน schema registry
 def get_schema(db_id, tables_file='bird/data/dev/dev_tables.json'):
-    with open(tables_file, 'r') as f:
-        tables = json.load(f)
-    for db in tables:
-        if db['db_id'] == db_id:
-            schema = []
-            for table_idx, table_name in enumerate(db['table_names_original']):
-                columns = [f"`{col[1]}`" for col in db['column_names_original'] if col[0] == table_idx]
-                if columns:
-                    schema.append(f"Table: {table_name}, Columns: {', '.join(columns)}")
-            return '\n'.join(schema)
-    return ""
+    return render_schema(db_id, tables_file, schema_format="backticks")
 
 # ฟังก์ชันล้าง Markdown และแปลง SQL เป็นบรรทัดเดียว
 def clean_sql(sql):
@@ -37,32 +34,8 @@ def clean_sql(sql):
         sql += ';'
     return sql.strip()
 
-# ฟังก์ชันเรียก Ollama API และวัดเวลา
-def query_ollama(prompt, error_log, question_id, question):
-    url = "http://localhost:11434/api/generate"
-    payload = {
-        "model": "gemma3:12b",
-        "prompt": prompt,
-        "stream": False
-    }
-    # วัดเวลาเริ่มต้น
-    start_time = time.time()
-    try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        # วัดเวลาสิ้นสุด
-        end_time = time.time()
-        generation_time = end_time - start_time  # คำนวณเวลา (วินาที)
-        return response.json()['response'].strip(), generation_time
-    except Exception as e:
-        print(f"Error for Question ID {question_id}: {e}")
-        error_log.append({
-            "question_id": question_id,
-            "question": question,
-            "error": str(e)
-        })
-        # ถ้ามี error ให้คืนค่า generation_time เป็น -1
-        return "", -1
+# LLM client กลาง (connection pool, timeout และ retry)
+llm_client = create_client("ollama", model="gemma3:12b")
 
 # สร้างโฟลเดอร์สำหรับเก็บ log ถ้ายังไม่มี
 log_dir = 'bird/exp_result/gemma3_output_kg/logs/th/'
@@ -79,12 +52,20 @@ with open(log_file, 'w', newline='', encoding='utf-8') as f:
 with open('bird/data/dev/dev_j2c2j_100.json', 'r', encoding='utf-8') as f:
     dev_data = json.load(f)
 
-# เตรียม dictionary สำหรับ predict_dev.json และ list สำหรับเก็บ error
-predict_json = {}
+# จำนวนคำถามที่ประมวลผลพร้อมกัน, rate limit และ --resume
+args = parse_driver_args(llm_client, resumable=True)
+
+# Checkpoint แบบ JSONL: เขียนผลของแต่ละคำถามทันทีที่เสร็จ และใช้ --resume เพื่อข้ามคำถามที่ทำเสร็จแล้ว
+checkpoint = JsonlCheckpoint(os.path.join(log_dir, '12b_envi_j2c2j_100_checkpoint.jsonl'), resume=args.resume)
+pending_data = [item for item in dev_data if not checkpoint.is_done(item['question_id'])]
+if args.resume:
+    print(f"Resume: {len(dev_data) - len(pending_data)} questions already in checkpoint, {len(pending_data)} remaining\n")
+
+# เตรียม list สำหรับเก็บ error (รวมจาก checkpoint หลังประมวลผลเสร็จ)
 error_log = []
 
-# ประมวลผลและเก็บข้อมูลสำหรับ predict_dev.json
-for i, item in enumerate(dev_data):
+# ฟังก์ชันประมวลผลคำถามหนึ่งข้อ (รันใน worker thread)
+def process_item(i, item):
     question_id = item['question_id']
     question = item['question_th']
     db_id = item['db_id']
@@ -113,35 +94,54 @@ Translate the following natural language question into a valid SQL query:
 - Output only the SQL query as a single line.
 - Do not include Markdown formatting (e.g., ```sql), explanations, or additional text."""
         
-    # เรียก API และเก็บเวลาการ Generate
-    sql, generation_time = query_ollama(prompt, error_log, question_id, question)
+    # เรียก API และเก็บเวลาการ Generate (error ของคำถามนี้เก็บแยกไว้ใน checkpoint)
+    question_errors = []
+    sql, generation_time = query_llm(llm_client, prompt, question_errors, {"question_id": question_id, "question": question})
     cleaned_sql = clean_sql(sql)
     
     # แปลงเวลาเป็นรูปแบบ "นาที+วินาที" ก่อนเขียนลง log
     formatted_time = format_time(generation_time)
-    
-    # บันทึก log ลงไฟล์ CSV
+    return {
+        "question_id": question_id,
+        "ok": generation_time >= 0,
+        # รูปแบบสำหรับ predict_dev.json: SQL \t----- bird -----\t db_id
+        "predict_line": f"{cleaned_sql}\t----- bird -----\t{db_id}",
+        "question": question,
+        "db_id": db_id,
+        "evidence": evidence,
+        "difficulty": difficulty,
+        "cleaned_sql": cleaned_sql,
+        "formatted_time": formatted_time,
+        "generation_time": generation_time,
+        "error_log": question_errors
+    }
+
+# บันทึกลง checkpoint และแสดงผลเมื่อแต่ละคำถามเสร็จ (ลำดับตามที่เสร็จก่อน)
+def on_question_done(completed, total, result):
+    checkpoint.append(result)
+    print(f"Processed question {completed}/{total}")
+    print(f"Question ID: {result['question_id']}")
+    print(f"Question: {result['question']}")
+    print(f"Evidence: {result['evidence']}")
+    print(f"Difficulty: {result['difficulty']}")
+    print(f"SQL query: {result['cleaned_sql']}")
+    print(f"Generation Time: {result['formatted_time']}")
+    print("-----------------------------------------------------------------------------------------------------------\n\n")
+
+run_concurrent(pending_data, process_item, concurrency=args.concurrency, on_done=on_question_done)
+
+# บันทึก log จาก checkpoint ตามลำดับ question_id (รวมคำถามที่ทำเสร็จจากรอบก่อนหน้าด้วย)
+for result in checkpoint.records():
     with open(log_file, 'a', newline='', encoding='utf-8') as log_f:
         writer = csv.writer(log_f)
         # เก็บทั้งเวลาในรูปแบบที่แปลงแล้ว และเวลาในหน่วยวินาที
-        writer.writerow([question_id, question, evidence, difficulty, formatted_time, generation_time])
-    
-    # รูปแบบสำหรับ predict_dev.json: SQL \t----- bird -----\t db_id
-    json_line = f"{cleaned_sql}\t----- bird -----\t{db_id}"
-    predict_json[str(question_id)] = json_line
-    
-    print(f"Processed question {i+1}/{len(dev_data)}")
-    print(f"Question ID: {question_id}")
-    print(f"Question: {question}")
-    print(f"Evidence: {evidence}")
-    print(f"Difficulty: {difficulty}")
-    print(f"SQL query: {cleaned_sql}")
-    print(f"Generation Time: {formatted_time}")
-    print("-----------------------------------------------------------------------------------------------------------\n\n")
+        writer.writerow([result['question_id'], result['question'], result['evidence'], result['difficulty'], result['formatted_time'], result['generation_time']])
+
+# สร้าง predict_dev.json จาก checkpoint
+checkpoint.compile_json('bird/exp_result/gemma3_output_kg/th/predict_dev_th_j2c2j_100.json', 'predict_line')
 
-# สร้าง predict_dev.json
-with open('bird/exp_result/gemma3_output_kg/th/predict_dev_th_j2c2j_100.json', 'w', encoding='utf-8') as f:
-    json.dump(predict_json, f, ensure_ascii=False, indent=4)
+# รวม error จาก checkpoint ทั้งหมด ไม่ใช่เฉพาะรอบนี้
+error_log[:] = [error for result in checkpoint.records() for error in result.get('error_log', [])]
 
 print("=== Generated successful!!! ===")
 
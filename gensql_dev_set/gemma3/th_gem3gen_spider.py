@@ -1,9 +1,16 @@
 import json
-import requests
 import re
 import time
 import csv
 import os
+import sys
+
+# เพิ่ม root ของ repo ใน sys.path เพื่อ import โมดูลที่ใช้ร่วมกัน
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from gensql_common.llm_client import create_client, query_llm
+from gensql_common.async_driver import parse_driver_args, run_concurrent
+from gensql_common.checkpoint import JsonlCheckpoint
+from gensql_common.schema_registry import render_schema
 
 # ฟังก์ชันแปลงเวลาจากวินาทีเป็นนาที+วินาที
 def format_time(seconds):
@@ -15,19 +22,9 @@ def format_time(seconds):
     remaining_seconds = seconds % 60  # หาวินาทีที่เหลือ
     return f"{minutes} นาที {remaining_seconds:.2f} วินาที ({seconds:.2f} วินาที)"
 
-# ฟังก์ชันดึง schema จาก tables.json
+# ฟังก์ชันดึง schema จาก tables.json โดยโหลดไฟล์ครั้งเดียวผ่าน schema registry
 def get_schema(db_id, tables_file='spider/data/tables.json'):
-    with open(tables_file, 'r') as f:
-        tables = json.load(f)
-    for db in tables:
-        if db['db_id'] == db_id:
-            schema = []
-            for table_idx, table_name in enumerate(db['table_names_original']):
-                columns = [col[1] for col in db['column_names_original'] if col[0] == table_idx]
-                if columns:
-                    schema.append(f"Table: {table_name}, Columns: {', '.join(columns)}")
-            return '\n'.join(schema)
-    return ""
+    return render_schema(db_id, tables_file, schema_format="plain")
 
 # ฟังก์ชันล้าง Markdown และแปลง SQL เป็นบรรทัดเดียว
 def clean_sql(sql):
@@ -36,32 +33,8 @@ def clean_sql(sql):
     sql = sql.rstrip(';')
     return sql.strip()
 
-# ฟังก์ชันเรียก Ollama API
-def query_ollama(prompt, error_log, index, question):
-    url = "http://localhost:11434/api/generate"
-    payload = {
-        "model": "gemma3:12b",
-        "prompt": prompt,
-        "stream": False
-    }
-    # วัดเวลาเริ่มต้น
-    start_time = time.time()
-    try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        # วัดเวลาสิ้นสุด
-        end_time = time.time()
-        generation_time = end_time - start_time  # คำนวณเวลา (วินาที)
-        return response.json()['response'].strip(), generation_time
-    except Exception as e:
-        print(f"Error at index {index+1}: {e}")
-        # เก็บข้อมูล error ลงใน error_log
-        error_log.append({
-            "index": index+1,
-            "question": question,
-            "error": str(e)
-        })
-        return ""
+# LLM client กลาง (connection pool, timeout และ retry)
+llm_client = create_client("ollama", model="gemma3:12b")
 
 # สร้างโฟลเดอร์สำหรับเก็บ log ถ้ายังไม่มี
 log_dir = 'spider/data/gemma3_output/logs/th/'
@@ -77,19 +50,27 @@ with open(log_file, 'w', newline='', encoding='utf-8') as f:
 with open('spider/data/dev/dev_spider_th.json', 'r') as f:
     dev_data = json.load(f)
 
+# จำนวนคำถามที่ประมวลผลพร้อมกัน, rate limit และ --resume
+args = parse_driver_args(llm_client, resumable=True)
+
+# Checkpoint แบบ JSONL (key เป็นลำดับใน dev.json): เขียนผลของแต่ละคำถามทันทีที่เสร็จ และใช้ --resume เพื่อข้ามคำถามที่ทำเสร็จแล้ว
+checkpoint = JsonlCheckpoint('spider/data/pred/gemma12b_pred_1034_th_checkpoint.jsonl', key="index", resume=args.resume)
+pending_data = [dict(item, index=i+1) for i, item in enumerate(dev_data) if not checkpoint.is_done(i+1)]
+if args.resume:
+    print(f"Resume: {len(dev_data) - len(pending_data)} questions already in checkpoint, {len(pending_data)} remaining\n")
+
 # เตรียม list สำหรับเก็บ error
 error_log = []
 
 # วัดเวลาเริ่มต้นทั้งหมด
 overall_start_time = time.time()
 
-# สร้าง predicted_sql.txt
-with open('spider/data/pred/gemma12b_pred_1034_th.txt', 'w') as f:
-    for i, item in enumerate(dev_data):
-        question = item['question_th']
-        db_id = item['db_id']
-        schema = get_schema(db_id)
-        prompt = f"""You are an expert in translating natural language questions into SQL queries. 
+# ฟังก์ชันประมวลผลคำถามหนึ่งข้อ (รันใน worker thread)
+def process_item(i, item):
+    question = item['question_th']
+    db_id = item['db_id']
+    schema = get_schema(db_id)
+    prompt = f"""You are an expert in translating natural language questions into SQL queries. 
 The questions may be in either English or Thai, and you must handle both languages correctly. 
 Use the provided database schema to generate a valid SQL query. 
 Interpret the question based on the schema and the meaning of the question alone.
@@ -103,23 +84,46 @@ Translate the following natural language question into a valid SQL query:
 ### Instructions:
 - Output only the SQL query as a single line.
 - Do not include Markdown formatting (e.g., ```sql), explanations, or additional text."""
-        sql, generation_time = query_ollama(prompt, error_log, i, question)
-        # ล้าง Markdown และแปลงเป็นบรรทัดเดียว
-        cleaned_sql = clean_sql(sql)
+    question_errors = []
+    sql, generation_time = query_llm(llm_client, prompt, question_errors, {"index": item['index'], "question": question})
+    # ล้าง Markdown และแปลงเป็นบรรทัดเดียว
+    cleaned_sql = clean_sql(sql)
+
+    # แปลงเวลาเป็นรูปแบบ "นาที+วินาที" ก่อนเขียนลง log
+    formatted_time = format_time(generation_time)
+    return {
+        "index": item['index'],
+        "ok": not question_errors,
+        "question": question,
+        "cleaned_sql": cleaned_sql,
+        "formatted_time": formatted_time,
+        "generation_time": generation_time,
+        "error_log": question_errors
+    }
+
+# บันทึกลง checkpoint และแสดงผลเมื่อแต่ละคำถามเสร็จ (ลำดับตามที่เสร็จก่อน)
+def on_question_done(completed, total, result):
+    checkpoint.append(result)
+    print(f"Processed question {completed}/{total}")
+    print(f"Question: {result['question']}")
+    print(f"SQL query: {result['cleaned_sql']}")
+    print("-----------------------------------------------------------------------------------------------------------\n\n")
 
-        # แปลงเวลาเป็นรูปแบบ "นาที+วินาที" ก่อนเขียนลง log
-        formatted_time = format_time(generation_time)
+run_concurrent(pending_data, process_item, concurrency=args.concurrency, on_done=on_question_done)
 
-         # บันทึก log ลงไฟล์ CSV (ตัด evidence ออก)
+# ผลและ error ของทุกคำถามจาก checkpoint ตามลำดับของ dev.json (รวมคำถามที่ทำเสร็จจากรอบก่อนหน้าด้วย)
+results = checkpoint.records()
+error_log[:] = [error for result in results for error in result.get('error_log', [])]
+
+# สร้าง predicted_sql.txt และบันทึก log ตามลำดับของ dev.json
+with open('spider/data/pred/gemma12b_pred_1034_th.txt', 'w') as f:
+    for result in results:
+        # บันทึก log ลงไฟล์ CSV (ตัด evidence ออก)
         with open(log_file, 'a', newline='', encoding='utf-8') as log_f:
             writer = csv.writer(log_f)
-            writer.writerow([i+1, question, formatted_time, generation_time])
+            writer.writerow([result['index'], result['question'], result['formatted_time'], result['generation_time']])
         
-        f.write(f"{cleaned_sql}\n")
-        print(f"Processed question {i+1}/{len(dev_data)}")
-        print(f"Question: {question}")
-        print(f"SQL query: {cleaned_sql}")
-        print("-----------------------------------------------------------------------------------------------------------\n\n")
+        f.write(f"{result['cleaned_sql']}\n")
 
 print("=== Generated successful!!! ===")
 
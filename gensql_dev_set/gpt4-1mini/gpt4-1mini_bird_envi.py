@@ -3,7 +3,14 @@ import os
 import re
 import time
 import csv
-from openai import OpenAI
+import sys
+
+# เพิ่ม root ของ repo ใน sys.path เพื่อ import โมดูลที่ใช้ร่วมกัน
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from gensql_common.llm_client import create_client, query_llm
+from gensql_common.async_driver import parse_driver_args, run_concurrent
+from gensql_common.checkpoint import JsonlCheckpoint
+from gensql_common.schema_registry import render_schema
 
 # ฟังก์ชันแปลงเวลาจากวินาทีเป็นนาที+วินาที
 def format_time(seconds):
@@ -15,19 +22,9 @@ def format_time(seconds):
     remaining_seconds = seconds % 60  # หาวินาทีที่เหลือ
     return f"{minutes} นาที {remaining_seconds:.2f} วินาที ({seconds:.2f} วินาที)"
 
-# ฟังก์ชันดึง schema จาก dev_tables.json (เพิ่ม backticks รอบชื่อคอลัมน์)
+# ฟังก์ชันดึง schema จาก dev_tables.json (เพิ่ม backticks รอบชื่อคอลัมน์) โดยโหลดไฟล์ครั้งเดียวผ่าน schema registry
 def get_schema(db_id, tables_file='bird/data/dev/dev_tables.json'):
-    with open(tables_file, 'r') as f:
-        tables = json.load(f)
-    for db in tables:
-        if db['db_id'] == db_id:
-            schema = []
-            for table_idx, table_name in enumerate(db['table_names_original']):
-                columns = [f"`{col[1]}`" for col in db['column_names_original'] if col[0] == table_idx]
-                if columns:
-                    schema.append(f"Table: {table_name}, Columns: {', '.join(columns)}")
-            return '\n'.join(schema)
-    return ""
+    return render_schema(db_id, tables_file, schema_format="backticks")
 
 # ฟังก์ชันล้าง Markdown และแปลง SQL เป็นบรรทัดเดียว
 def clean_sql(sql):
@@ -37,34 +34,14 @@ def clean_sql(sql):
         sql += ';'
     return sql.strip()
 
-# ฟังก์ชันเรียก OpenAI API และวัดเวลา
-def query_openai(prompt, error_log, question_id, question):
-    try:
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        # วัดเวลาเริ่มต้น
-        start_time = time.time()
-        response = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
-                {"role": "system", "content": "You are an expert SQL query generator. Provide only the SQL query as a single line without Markdown formatting, explanations, or additional text."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=200,
-            temperature=0.0
-        )
-        # วัดเวลาสิ้นสุด
-        end_time = time.time()
-        generation_time = end_time - start_time  # คำนวณเวลา (วินาที)
-        return response.choices[0].message.content.strip(), generation_time
-    except Exception as e:
-        print(f"Error for Question ID {question_id}: {e}")
-        error_log.append({
-            "question_id": question_id,
-            "question": question,
-            "error": str(e)
-        })
-        # ถ้ามี error ให้คืนค่า generation_time เป็น -1
-        return "", -1
+# LLM client กลาง (connection pool, timeout และ retry)
+llm_client = create_client(
+    "openai",
+    model="gpt-4.1-mini",
+    system_prompt="You are an expert SQL query generator. Provide only the SQL query as a single line without Markdown formatting, explanations, or additional text.",
+    max_tokens=200,
+    temperature=0.0
+)
 
 # สร้างโฟลเดอร์สำหรับเก็บ log ถ้ายังไม่มี
 log_dir = 'bird/exp_result/gpt4-1mini_output_kg/logs/'
@@ -80,12 +57,21 @@ with open(log_file, 'w', newline='', encoding='utf-8') as f:
 with open('bird/data/dev/dev.json', 'r') as f:
     dev_data = json.load(f)
 
+# จำนวนคำถามที่ประมวลผลพร้อมกัน, rate limit และ --resume
+args = parse_driver_args(llm_client, resumable=True)
+
+# Checkpoint แบบ JSONL: เขียนผลของแต่ละคำถามทันทีที่เสร็จ และใช้ --resume เพื่อข้ามคำถามที่ทำเสร็จแล้ว
+checkpoint = JsonlCheckpoint('bird/exp_result/gpt4-1mini_output_kg/predict_dev_checkpoint.jsonl', resume=args.resume)
+pending_data = [item for item in dev_data if not checkpoint.is_done(item['question_id'])]
+if args.resume:
+    print(f"Resume: {len(dev_data) - len(pending_data)} questions already in checkpoint, {len(pending_data)} remaining\n")
+
 # เตรียม dictionary สำหรับ predict_dev.json และ list สำหรับเก็บ error
 predict_json = {}
 error_log = []
 
-# ประมวลผลและเก็บข้อมูลสำหรับ predict_dev.json
-for i, item in enumerate(dev_data):
+# ฟังก์ชันประมวลผลคำถามหนึ่งข้อ (รันใน worker thread)
+def process_item(i, item):
     question_id = item['question_id']
     question = item['question']
     db_id = item['db_id']
@@ -101,30 +87,54 @@ Translate this natural language question into a valid SQL query:
 {question}
 Output only the SQL query as a single line, without Markdown formatting (e.g., ```sql), explanations, or additional text."""
     
+    question_errors = []
     # เรียก API และเก็บเวลาการ Generate
-    sql, generation_time = query_openai(prompt, error_log, question_id, question)
+    sql, generation_time = query_llm(llm_client, prompt, question_errors, {"question_id": question_id, "question": question})
     cleaned_sql = clean_sql(sql)
     
     # แปลงเวลาเป็นรูปแบบ "นาที+วินาที" ก่อนเขียนลง log
     formatted_time = format_time(generation_time)
-    
+    return {
+        "question_id": question_id,
+        "ok": not question_errors,
+        "question": question,
+        "db_id": db_id,
+        "evidence": evidence,
+        "difficulty": difficulty,
+        "cleaned_sql": cleaned_sql,
+        "formatted_time": formatted_time,
+        "generation_time": generation_time,
+        "error_log": question_errors
+    }
+
+# บันทึกลง checkpoint และแสดงผลเมื่อแต่ละคำถามเสร็จ (ลำดับตามที่เสร็จก่อน)
+def on_question_done(completed, total, result):
+    checkpoint.append(result)
+    print(f"Processed question {completed}/{total}")
+    print(f"Question ID: {result['question_id']}")
+    print(f"Question: {result['question']}")
+    print(f"Evidence: {result['evidence']}")
+    print(f"Difficulty: {result['difficulty']}")
+    print(f"SQL query: {result['cleaned_sql']}")
+    print(f"Generation Time: {result['formatted_time']}")
+    print("-----------------------------------------------------------------------------------------------------------\n\n")
+
+run_concurrent(pending_data, process_item, concurrency=args.concurrency, on_done=on_question_done)
+
+# ผลและ error ของทุกคำถามจาก checkpoint ตามลำดับ question_id (รวมคำถามที่ทำเสร็จจากรอบก่อนหน้าด้วย)
+results = checkpoint.records()
+error_log[:] = [error for result in results for error in result.get('error_log', [])]
+
+# บันทึก log และเก็บข้อมูลสำหรับ predict_dev.json ตามลำดับ question_id
+for result in results:
     # บันทึก log ลงไฟล์ CSV
     with open(log_file, 'a', newline='', encoding='utf-8') as log_f:
         writer = csv.writer(log_f)
-        writer.writerow([question_id, question, evidence, difficulty, formatted_time, generation_time])
+        writer.writerow([result['question_id'], result['question'], result['evidence'], result['difficulty'], result['formatted_time'], result['generation_time']])
     
     # รูปแบบสำหรับ predict_dev.json: SQL \t----- bird -----\t db_id
-    json_line = f"{cleaned_sql}\t----- bird -----\t{db_id}"
-    predict_json[str(question_id)] = json_line
-    
-    print(f"Processed question {i+1}/{len(dev_data)}")
-    print(f"Question ID: {question_id}")
-    print(f"Question: {question}")
-    print(f"Evidence: {evidence}")
-    print(f"Difficulty: {difficulty}")
-    print(f"SQL query: {cleaned_sql}")
-    print(f"Generation Time: {formatted_time}")
-    print("-----------------------------------------------------------------------------------------------------------\n\n")
+    json_line = f"{result['cleaned_sql']}\t----- bird -----\t{result['db_id']}"
+    predict_json[str(result['question_id'])] = json_line
 
 # สร้าง predict_dev.json
 with open('bird/exp_result/gpt4-1mini_output_kg/predict_dev.json', 'w') as f:
@@ -3,7 +3,14 @@ import os
 import re
 import time
 import csv
-from openai import OpenAI
+import sys
+
+# เพิ่ม root ของ repo ใน sys.path เพื่อ import โมดูลที่ใช้ร่วมกัน
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from gensql_common.llm_client import create_client, query_llm
+from gensql_common.async_driver import parse_driver_args, run_concurrent
+from gensql_common.checkpoint import JsonlCheckpoint
+from gensql_common.schema_registry import render_schema
 
 # ฟังก์ชันแปลงเวลาจากวินาทีเป็นนาที+วินาที
 def format_time(seconds):
@@ -15,19 +22,9 @@ def format_time(seconds):
     remaining_seconds = seconds % 60  # หาวินาทีที่เหลือ
     return f"{minutes} นาที {remaining_seconds:.2f} วินาที ({seconds:.2f} วินาที)"
 
-# ฟังก์ชันดึง schema จาก tables.json
+# ฟังก์ชันดึง schema จาก tables.json โดยโหลดไฟล์ครั้งเดียวผ่าน schema registry
 def get_schema(db_id, tables_file='spider/data/tables.json'):
-    with open(tables_file, 'r') as f:
-        tables = json.load(f)
-    for db in tables:
-        if db['db_id'] == db_id:
-            schema = []
-            for table_idx, table_name in enumerate(db['table_names_original']):
-                columns = [col[1] for col in db['column_names_original'] if col[0] == table_idx]
-                if columns:
-                    schema.append(f"Table: {table_name}, Columns: {', '.join(columns)}")
-            return '\n'.join(schema)
-    return ""
+    return render_schema(db_id, tables_file, schema_format="plain")
 
 # ฟังก์ชันล้าง Markdown และแปลง SQL เป็นบรรทัดเดียว
 def clean_sql(sql):
@@ -36,34 +33,14 @@ def clean_sql(sql):
     sql = sql.rstrip(';')
     return sql.strip()
 
-# ฟังก์ชันเรียก OpenAI API และวัดเวลา
-def query_openai(prompt, error_log, index, question):
-    try:
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        # วัดเวลาเริ่มต้น
-        start_time = time.time()
-        response = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
-                {"role": "system", "content": "You are an expert SQL query generator. Provide only the SQL query as a single line without Markdown formatting, explanations, or additional text."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=200,
-            temperature=0.0
-        )
-        # วัดเวลาสิ้นสุด
-        end_time = time.time()
-        generation_time = end_time - start_time  # คำนวณเวลา (วินาที)
-        return response.choices[0].message.content.strip(), generation_time
-    except Exception as e:
-        print(f"Error at index {index+1}: {e}")
-        error_log.append({
-            "index": index+1,
-            "question": question,
-            "error": str(e)
-        })
-        # ถ้ามี error ให้คืนค่า generation_time เป็น -1
-        return "", -1
+# LLM client กลาง (connection pool, timeout และ retry)
+llm_client = create_client(
+    "openai",
+    model="gpt-4.1-mini",
+    system_prompt="You are an expert SQL query generator. Provide only the SQL query as a single line without Markdown formatting, explanations, or additional text.",
+    max_tokens=200,
+    temperature=0.0
+)
 
 # สร้างโฟลเดอร์สำหรับเก็บ log และผลลัพธ์
 output_dir = 'spider/data/pred/gpt4-1mini_pred/'
@@ -80,43 +57,73 @@ with open(log_file, 'w', newline='', encoding='utf-8') as f:
 with open('spider/data/dev/dev.json', 'r') as f:
     dev_data = json.load(f)
 
+# จำนวนคำถามที่ประมวลผลพร้อมกัน, rate limit และ --resume
+args = parse_driver_args(llm_client, resumable=True)
+
+# Checkpoint แบบ JSONL (key เป็นลำดับใน dev.json): เขียนผลของแต่ละคำถามทันทีที่เสร็จ และใช้ --resume เพื่อข้ามคำถามที่ทำเสร็จแล้ว
+checkpoint = JsonlCheckpoint(os.path.join(output_dir, 'gpt4-1mini_pred_checkpoint.jsonl'), key="index", resume=args.resume)
+pending_data = [dict(item, index=i+1) for i, item in enumerate(dev_data) if not checkpoint.is_done(i+1)]
+if args.resume:
+    print(f"Resume: {len(dev_data) - len(pending_data)} questions already in checkpoint, {len(pending_data)} remaining\n")
+
 # เตรียม list สำหรับเก็บ error
 error_log = []
 
-# สร้าง predicted_sql.txt
-with open(os.path.join(output_dir, 'gpt4-1mini_pred.txt'), 'w') as f:
-    for i, item in enumerate(dev_data):
-        question = item['question']
-        db_id = item['db_id']
-        schema = get_schema(db_id)
-        
-        prompt = f"""Given the following database schema:
+# ฟังก์ชันประมวลผลคำถามหนึ่งข้อ (รันใน worker thread)
+def process_item(i, item):
+    question = item['question']
+    db_id = item['db_id']
+    schema = get_schema(db_id)
+    
+    prompt = f"""Given the following database schema:
 {schema}
 Translate this natural language question into a valid SQL query:
 {question}
 Output only the SQL query as a single line, without Markdown formatting (e.g., ```sql), explanations, or additional text."""
-        
-        # เรียก API และเก็บเวลาการ Generate
-        sql, generation_time = query_openai(prompt, error_log, i, question)
-        cleaned_sql = clean_sql(sql)
-        
-        # แปลงเวลาเป็นรูปแบบ "นาที+วินาที" ก่อนเขียนลง log
-        formatted_time = format_time(generation_time)
-        
+    
+    question_errors = []
+    # เรียก API และเก็บเวลาการ Generate
+    sql, generation_time = query_llm(llm_client, prompt, question_errors, {"index": item['index'], "question": question})
+    cleaned_sql = clean_sql(sql)
+    
+    # แปลงเวลาเป็นรูปแบบ "นาที+วินาที" ก่อนเขียนลง log
+    formatted_time = format_time(generation_time)
+    return {
+        "index": item['index'],
+        "ok": not question_errors,
+        "question": question,
+        "cleaned_sql": cleaned_sql,
+        "formatted_time": formatted_time,
+        "generation_time": generation_time,
+        "error_log": question_errors
+    }
+
+# บันทึกลง checkpoint และแสดงผลเมื่อแต่ละคำถามเสร็จ (ลำดับตามที่เสร็จก่อน)
+def on_question_done(completed, total, result):
+    checkpoint.append(result)
+    print(f"Processed question {completed}/{total}")
+    print(f"Index: {result['index']}")
+    print(f"Question: {result['question']}")
+    print(f"SQL query: {result['cleaned_sql']}")
+    print(f"Generation Time: {result['formatted_time']}")
+    print("-----------------------------------------------------------------------------------------------------------\n\n")
+
+run_concurrent(pending_data, process_item, concurrency=args.concurrency, on_done=on_question_done)
+
+# ผลและ error ของทุกคำถามจาก checkpoint ตามลำดับของ dev.json (รวมคำถามที่ทำเสร็จจากรอบก่อนหน้าด้วย)
+results = checkpoint.records()
+error_log[:] = [error for result in results for error in result.get('error_log', [])]
+
+# สร้าง predicted_sql.txt และบันทึก log ตามลำดับของ dev.json
+with open(os.path.join(output_dir, 'gpt4-1mini_pred.txt'), 'w') as f:
+    for result in results:
         # บันทึก log ลงไฟล์ CSV
         with open(log_file, 'a', newline='', encoding='utf-8') as log_f:
             writer = csv.writer(log_f)
-            writer.writerow([i+1, question, formatted_time, generation_time])
+            writer.writerow([result['index'], result['question'], result['formatted_time'], result['generation_time']])
         
         # เขียน SQL ลง predicted_sql.txt
-        f.write(f"{cleaned_sql}\n")
-        
-        print(f"Processed question {i+1}/{len(dev_data)}")
-        print(f"Index: {i+1}")
-        print(f"Question: {question}")
-        print(f"SQL query: {cleaned_sql}")
-        print(f"Generation Time: {formatted_time}")
-        print("-----------------------------------------------------------------------------------------------------------\n\n")
+        f.write(f"{result['cleaned_sql']}\n")
 
 print("=== Generated successful!!! ===")
 
@@ -0,0 +1,85 @@
+import argparse
+import json
+import os
+import random
+import time
+from collections import defaultdict
+from steiner_tree import KouMarkowskyAlgorithm
+from path_index import SchemaPathIndex, path_index_file
+from local_graph import LocalSchemaGraph
+
+"""
+This script compares the approximate Steiner tree (greedy growth over the terminals) with the exact
+Dreyfus-Wagner solver on every database. For each db_id and terminal count it samples random sets of
+table nodes and reports, per terminal count, the mean tree size (edges), how often the exact tree is
+smaller and the mean latency of each solver, which is what exact_max_terminals should be chosen from.
+Graphs are read from the SchemaPathIndex files in --path_index_dir, from a LocalSchemaGraph pickle
+(--local_graph), or from Neo4j if neither is given.
+"""
+
+
+def load_indexes(args):
+    if args.path_index_dir:
+        db_ids = args.db_ids or sorted(
+            name[:-len(".npz")] for name in os.listdir(args.path_index_dir) if name.endswith(".npz")
+        )
+        return {db_id: SchemaPathIndex.load(path_index_file(args.path_index_dir, db_id)) for db_id in db_ids}
+    if args.local_graph:
+        steiner = KouMarkowskyAlgorithm(None, None, local_graph=LocalSchemaGraph.load(args.local_graph))
+    else:
+        with open("table_metadata_store/graph_db/db_config.json") as f:
+            db_config = json.load(f)
+        steiner = KouMarkowskyAlgorithm("bolt://localhost:7687", (db_config["username"], db_config["password"]))
+    steiner.preload(args.db_ids)
+    indexes = {db_id: SchemaPathIndex.build(*steiner.get_graph(db_id)) for db_id in sorted(steiner._graph_cache)}
+    steiner.close()
+    return indexes
+
+
+def timed(solve, terminals, repeats):
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        result = solve(terminals)
+    return result, (time.perf_counter() - start_time) * 1000 / repeats
+
+
+if __name__ == '__main__':
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument('--path_index_dir', type=str, default='')
+    args_parser.add_argument('--db_ids', type=str, nargs='*', default=None)
+    args_parser.add_argument('--local_graph', type=str, default='')
+    args_parser.add_argument('--min_terminals', type=int, default=2)
+    args_parser.add_argument('--max_terminals', type=int, default=8)
+    args_parser.add_argument('--samples', type=int, default=20)
+    args_parser.add_argument('--repeats', type=int, default=3)
+    args_parser.add_argument('--seed', type=int, default=0)
+    args = args_parser.parse_args()
+
+    indexes = load_indexes(args)
+    print(f"Loaded {len(indexes)} schema graphs")
+    rng = random.Random(args.seed)
+    stats = defaultdict(lambda: defaultdict(float))
+    for db_id, index in indexes.items():
+        tables = [node for node in index.nodes if node.count(".") == 1]
+        for k in range(args.min_terminals, min(args.max_terminals, len(tables)) + 1):
+            for _ in range(args.samples):
+                terminals = rng.sample(tables, k)
+                approx, approx_ms = timed(index.steiner_tree, terminals, args.repeats)
+                exact, exact_ms = timed(lambda t: index.steiner_tree(t, exact=True), terminals, args.repeats)
+                row = stats[k]
+                row["queries"] += 1
+                row["approx_edges"] += len(approx["edges"])
+                row["exact_edges"] += len(exact["edges"])
+                row["improved"] += len(exact["edges"]) < len(approx["edges"])
+                row["worse"] += len(exact["edges"]) > len(approx["edges"])
+                row["approx_ms"] += approx_ms
+                row["exact_ms"] += exact_ms
+
+    print("{:>3} {:>8} {:>12} {:>12} {:>10} {:>6} {:>12} {:>12}".format(
+        'k', 'queries', 'approx edges', 'exact edges', 'improved', 'worse', 'approx (ms)', 'exact (ms)'))
+    for k in sorted(stats):
+        row = stats[k]
+        n = row["queries"]
+        print("{:>3} {:>8} {:>12.2f} {:>12.2f} {:>9.1f}% {:>6} {:>12.3f} {:>12.3f}".format(
+            k, int(n), row["approx_edges"] / n, row["exact_edges"] / n, 100 * row["improved"] / n,
+            int(row["worse"]), row["approx_ms"] / n, row["exact_ms"] / n))
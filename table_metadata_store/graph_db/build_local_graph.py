@@ -0,0 +1,27 @@
+import argparse
+import os
+import time
+from local_graph import LocalSchemaGraph
+
+"""
+This script builds the LocalSchemaGraph of a tables JSON file and saves it as one pickle file.
+It is the Neo4j-free counterpart of create_graph_db.py: pass the file as local_graph to
+KouMarkowskyAlgorithm / TopKSteinerMetadata (or --local_graph to the scripts in this directory).
+"""
+
+if __name__ == '__main__':
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument('--tables_file', type=str, default='bird/data/train/train_tables.json')
+    args_parser.add_argument('--output', type=str, default='table_metadata_store/graph_db/local_graph.pkl')
+    args = args_parser.parse_args()
+
+    start_time = time.time()
+    local_graph = LocalSchemaGraph.from_tables_json(args.tables_file)
+    local_graph.save(args.output)
+    build_time = time.time() - start_time
+
+    start_time = time.time()
+    LocalSchemaGraph.load(args.output)
+    load_time = time.time() - start_time
+    print(f"Built {len(local_graph.databases)} database graphs from '{args.tables_file}' in {build_time:.2f}s")
+    print(f"Wrote '{args.output}' ({os.path.getsize(args.output) / 2**20:.2f} MB), loads in {load_time * 1000:.1f}ms")
@@ -0,0 +1,44 @@
+import argparse
+import json
+import os
+import time
+from steiner_tree import KouMarkowskyAlgorithm
+from path_index import SchemaPathIndex, path_index_file
+from local_graph import LocalSchemaGraph
+
+"""
+This script precomputes the all-pairs shortest path index (SchemaPathIndex) of every database
+in the Neo4j Graph Database (or in a LocalSchemaGraph, with --local_graph) and saves one .npz file per db_id.
+KouMarkowskyAlgorithm(..., path_index_dir=...) then answers Steiner queries from these files.
+"""
+
+if __name__ == '__main__':
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument('--index_dir', type=str, default='table_metadata_store/graph_db/path_index/')
+    args_parser.add_argument('--db_ids', type=str, nargs='*', default=None)
+    args_parser.add_argument('--local_graph', type=str, default='')
+    args = args_parser.parse_args()
+
+    if args.local_graph:
+        steiner = KouMarkowskyAlgorithm(None, None, local_graph=LocalSchemaGraph.load(args.local_graph))
+    else:
+        with open("table_metadata_store/graph_db/db_config.json") as f:
+            db_config = json.load(f)
+        steiner = KouMarkowskyAlgorithm("bolt://localhost:7687", (db_config["username"], db_config["password"]))
+
+    os.makedirs(args.index_dir, exist_ok=True)
+    start_time = time.time()
+    n_databases = steiner.preload(args.db_ids)
+    print(f"Loaded {n_databases} schema graphs in {time.time() - start_time:.2f}s")
+
+    total_bytes = 0
+    for db_id in sorted(steiner._graph_cache):
+        build_start = time.time()
+        graph, edge_types = steiner.get_graph(db_id)
+        index = SchemaPathIndex.build(graph, edge_types)
+        path = path_index_file(args.index_dir, db_id)
+        index.save(path)
+        total_bytes += os.path.getsize(path)
+        print(f"{db_id}: {len(index.nodes)} nodes, {len(index.edges)} edges, {time.time() - build_start:.3f}s")
+    print(f"Wrote {n_databases} path indexes ({total_bytes / 2**20:.2f} MB) to '{args.index_dir}'")
+    steiner.close()
@@ -1,11 +1,14 @@
 from neo4j import GraphDatabase
 import json
+import time
 
 """
 This script loads table metadata into a Neo4j Graph Database.
 The nodes and relationships are created based on the schema information provided in the train_tables.json file.
 The script connects to the Neo4j database using credentials from db_config.json and iterates through the schemas,
 creating nodes for tables and columns, and establishing relationships such as HAS_COLUMN, HAS_PRIMARY_KEY, and FOREIGN_KEY_TO.
+Each database is written in one transaction with a few batched UNWIND statements (tables, columns, PK columns,
+foreign keys) instead of one statement per table, column and foreign key.
 """
 
 with open("table_metadata_store/graph_db/db_config.json") as f:
@@ -18,48 +21,60 @@ AUTH = (db_config["username"], db_config["password"])
 
 driver = GraphDatabase.driver(URI, auth=AUTH)
 
-def load_schema(tx, db_id, table_names, column_names, column_types, primary_keys, foreign_keys):
-    # Create Table nodes
-    for idx, table_name in enumerate(table_names):
-        full_table_name = f"{db_id}.{table_name}"
-        tx.run(
-            "MERGE (t:Table {db_id: $db_id, name: $name, full_name: $full_name})",
-            db_id=db_id, name=table_name, full_name=full_table_name
-        )
+# Column full names are not unique (a table can repeat a column name with a different data type,
+# which MERGE turns into two Column nodes), so Column.full_name gets a plain index, not a constraint
+SCHEMA_STATEMENTS = [
+    "CREATE CONSTRAINT table_full_name IF NOT EXISTS FOR (t:Table) REQUIRE t.full_name IS UNIQUE",
+    "CREATE INDEX column_full_name IF NOT EXISTS FOR (c:Column) ON (c.full_name)",
+    "CREATE INDEX table_db_id IF NOT EXISTS FOR (t:Table) ON (t.db_id)"
+]
+
+CREATE_TABLES = """
+UNWIND $rows AS row
+MERGE (t:Table {db_id: row.db_id, name: row.name, full_name: row.full_name})
+"""
 
-    # Create Column nodes and HAS_COLUMN/HAS_PRIMARY_KEY edges
+CREATE_COLUMNS = """
+UNWIND $rows AS row
+MERGE (c:Column {db_id: row.db_id, table_name: row.table_name, name: row.name, data_type: row.data_type, full_name: row.full_name})
+WITH c, row
+MATCH (t:Table {full_name: row.full_table_name})
+MERGE (t)-[:%s]->(c)
+"""
+
+CREATE_FOREIGN_KEYS = """
+UNWIND $rows AS row
+MATCH (from:Column {full_name: row.from_full_col})
+MATCH (to:Column {full_name: row.to_full_col})
+MERGE (from)-[:FOREIGN_KEY_TO]->(to)
+"""
+
+def build_rows(db_id, table_names, column_names, column_types, primary_keys, foreign_keys):
+    """
+    Returns the UNWIND parameter lists of one database: (tables, PK columns, other columns, foreign keys).
+    """
+    table_rows = [
+        {"db_id": db_id, "name": table_name, "full_name": f"{db_id}.{table_name}"}
+        for table_name in table_names
+    ]
+    # Only the first column of a composite primary key is marked, as before
+    pk_indexes = {pk if isinstance(pk, int) else pk[0] for pk in primary_keys}
+    pk_rows, column_rows = [], []
     for col_idx, (table_idx, col_name) in enumerate(column_names):
         if table_idx == -1:  # skip *
             continue
         table_name = table_names[table_idx]
-        full_table_name = f"{db_id}.{table_name}"
-        full_col_name = f"{db_id}.{table_name}.{col_name}"
-        data_type = column_types[col_idx]
-        is_pk = col_idx in [pk if isinstance(pk, int) else pk[0] for pk in primary_keys]
-        if is_pk:
-            tx.run(
-                """
-                MERGE (c:Column {db_id: $db_id, table_name: $table_name, name: $col_name, data_type: $data_type, full_name: $full_col_name})
-                WITH c
-                MATCH (t:Table {full_name: $full_table_name})
-                MERGE (t)-[:HAS_PRIMARY_KEY]->(c)
-                """,
-                db_id=db_id, table_name=table_name, col_name=col_name, data_type=data_type,
-                full_col_name=full_col_name, full_table_name=full_table_name
-            )
-        else:
-            tx.run(
-                """
-                MERGE (c:Column {db_id: $db_id, table_name: $table_name, name: $col_name, data_type: $data_type, full_name: $full_col_name})
-                WITH c
-                MATCH (t:Table {full_name: $full_table_name})
-                MERGE (t)-[:HAS_COLUMN]->(c)
-                """,
-                db_id=db_id, table_name=table_name, col_name=col_name, data_type=data_type,
-                full_col_name=full_col_name, full_table_name=full_table_name
-            )
+        row = {
+            "db_id": db_id,
+            "table_name": table_name,
+            "name": col_name,
+            "data_type": column_types[col_idx],
+            "full_name": f"{db_id}.{table_name}.{col_name}",
+            "full_table_name": f"{db_id}.{table_name}"
+        }
+        (pk_rows if col_idx in pk_indexes else column_rows).append(row)
 
-    # Create FOREIGN_KEY edges
+    fk_rows = []
     for fk in foreign_keys:
         if not fk: continue
         from_idx = fk[0]
@@ -67,23 +82,31 @@ def load_schema(tx, db_id, table_names, column_names, column_types, primary_keys
         if to_idx is None: continue
         from_table_idx, from_col_name = column_names[from_idx]
         to_table_idx, to_col_name = column_names[to_idx]
-        from_full_col = f"{db_id}.{table_names[from_table_idx]}.{from_col_name}"
-        to_full_col = f"{db_id}.{table_names[to_table_idx]}.{to_col_name}"
-        tx.run(
-            """
-            MATCH (from:Column {full_name: $from_full_col})
-            MATCH (to:Column {full_name: $to_full_col})
-            MERGE (from)-[:FOREIGN_KEY_TO]->(to)
-            """,
-            from_full_col=from_full_col, to_full_col=to_full_col
-        )
+        fk_rows.append({
+            "from_full_col": f"{db_id}.{table_names[from_table_idx]}.{from_col_name}",
+            "to_full_col": f"{db_id}.{table_names[to_table_idx]}.{to_col_name}"
+        })
+    return table_rows, pk_rows, column_rows, fk_rows
+
+def load_schema(tx, table_rows, pk_rows, column_rows, fk_rows):
+    tx.run(CREATE_TABLES, rows=table_rows)
+    tx.run(CREATE_COLUMNS % "HAS_PRIMARY_KEY", rows=pk_rows)
+    tx.run(CREATE_COLUMNS % "HAS_COLUMN", rows=column_rows)
+    tx.run(CREATE_FOREIGN_KEYS, rows=fk_rows)
 
 
+# Create the constraint and indexes first so the MERGE/MATCH lookups by full_name are indexed
+with driver.session() as session:
+    for statement in SCHEMA_STATEMENTS:
+        session.run(statement)
+    session.run("CALL db.awaitIndexes()")
+
 # Iterate through the schemas in the train_tables.json file and load them into the graph database
+total_start = time.time()
 with driver.session() as session:
     for schema in schemas:
-        session.execute_write(
-            load_schema,
+        start_time = time.time()
+        rows = build_rows(
             schema["db_id"],
             schema["table_names"],
             schema["column_names"],
@@ -91,5 +114,10 @@ with driver.session() as session:
             schema["primary_keys"],
             schema["foreign_keys"]
         )
+        session.execute_write(load_schema, *rows)
+        table_rows, pk_rows, column_rows, fk_rows = rows
+        print(f"{schema['db_id']}: {len(table_rows)} tables, {len(pk_rows) + len(column_rows)} columns, "
+              f"{len(fk_rows)} foreign keys in {time.time() - start_time:.2f}s")
+print(f"Loaded {len(schemas)} databases in {time.time() - total_start:.2f}s")
 
-driver.close()
\ No newline at end of file
+driver.close()
@@ -0,0 +1,161 @@
+import json
+import pickle
+from collections import defaultdict
+
+"""
+This module builds the table metadata graph in memory, straight from a tables JSON file
+(train_tables.json, dev_tables.json), so the Steiner metadata pipeline can run without Neo4j.
+Nodes, properties and HAS_COLUMN / HAS_PRIMARY_KEY / FOREIGN_KEY_TO relationships are created
+the same way as create_graph_db.py creates them, and the trimmed subgraph and column metadata
+queries of KouMarkowskyAlgorithm and TopKSteinerMetadata are answered from plain dicts.
+The whole graph is saved as a single pickle file (see build_local_graph.py).
+"""
+
+
+def full_name(node):
+    """
+    The full_name property of a node (table nodes are their full name, column nodes (full name, data type)).
+    """
+    return node if isinstance(node, str) else node[0]
+
+
+class LocalSchemaGraph:
+    """
+    databases maps db_id to {"tables": [table full names], "columns": {column key: properties},
+    "relationships": [(src node, dst node, rel_type)]}, with relationships directed as in Neo4j
+    (Table -> Column, Column -> Column for foreign keys). A table node is its full name; a column node
+    is (full name, data type), because MERGE in create_graph_db.py matches on every property and
+    creates two Column nodes for a repeated column name with different types.
+    """
+    def __init__(self, databases):
+        self.databases = databases
+
+    @classmethod
+    def from_tables_json(cls, tables_file):
+        with open(tables_file) as f:
+            schemas = json.load(f)
+        databases = {}
+        for schema in schemas:
+            databases.setdefault(schema["db_id"], {"tables": [], "columns": {}, "relationships": []})
+            cls._load_schema(databases[schema["db_id"]], schema)
+        return cls(databases)
+
+    @staticmethod
+    def _load_schema(database, schema):
+        """
+        Mirrors load_schema in create_graph_db.py, including its MERGE semantics: nodes and
+        relationships that already exist are not created again.
+        """
+        db_id = schema["db_id"]
+        table_names = schema["table_names"]
+        column_names = schema["column_names"]
+        column_types = schema["column_types"]
+        relationships = set(database["relationships"])
+
+        def merge_relationship(src, dst, rel_type):
+            if (src, dst, rel_type) not in relationships:
+                relationships.add((src, dst, rel_type))
+                database["relationships"].append((src, dst, rel_type))
+
+        for table_name in table_names:
+            full_table_name = f"{db_id}.{table_name}"
+            if full_table_name not in database["tables"]:
+                database["tables"].append(full_table_name)
+
+        primary_keys = {pk if isinstance(pk, int) else pk[0] for pk in schema["primary_keys"]}
+        for col_idx, (table_idx, col_name) in enumerate(column_names):
+            if table_idx == -1:  # skip *
+                continue
+            table_name = table_names[table_idx]
+            full_table_name = f"{db_id}.{table_name}"
+            full_col_name = f"{db_id}.{table_name}.{col_name}"
+            column = (full_col_name, column_types[col_idx])
+            database["columns"].setdefault(column, {
+                "table_name": table_name,
+                "name": col_name,
+                "data_type": column_types[col_idx]
+            })
+            rel_type = "HAS_PRIMARY_KEY" if col_idx in primary_keys else "HAS_COLUMN"
+            merge_relationship(full_table_name, column, rel_type)
+
+        # MATCH by full_name finds every Column node with that name
+        columns_by_name = defaultdict(list)
+        for column in database["columns"]:
+            columns_by_name[column[0]].append(column)
+
+        for fk in schema["foreign_keys"]:
+            if not fk or len(fk) < 2:
+                continue
+            from_table_idx, from_col_name = column_names[fk[0]]
+            to_table_idx, to_col_name = column_names[fk[1]]
+            from_full_col = f"{db_id}.{table_names[from_table_idx]}.{from_col_name}"
+            to_full_col = f"{db_id}.{table_names[to_table_idx]}.{to_col_name}"
+            for from_column in columns_by_name.get(from_full_col, []):
+                for to_column in columns_by_name.get(to_full_col, []):
+                    merge_relationship(from_column, to_column, "FOREIGN_KEY_TO")
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump(self.databases, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls(pickle.load(f))
+
+    def db_ids(self):
+        return [db_id for db_id, database in self.databases.items() if database["tables"]]
+
+    def trimmed_subgraph(self, db_id):
+        """
+        Same (graph, edge_types) as KouMarkowskyAlgorithm._get_trimmed_subgraphs: every relationship of
+        db_id except those touching a Column node of degree 1 (leaf columns).
+        """
+        database = self.databases.get(db_id, {"columns": {}, "relationships": []})
+        degree = defaultdict(int)
+        for src, dst, _ in database["relationships"]:
+            degree[src] += 1
+            if dst != src:
+                degree[dst] += 1
+        graph = defaultdict(list)
+        edge_types = {}
+        for src, dst, rel_type in database["relationships"]:
+            if any(isinstance(node, tuple) and degree[node] == 1 for node in (src, dst)):
+                continue
+            src, dst = full_name(src), full_name(dst)
+            graph[src].append(dst)
+            graph[dst].append(src)
+            edge_types[frozenset([src, dst])] = rel_type
+        return graph, edge_types
+
+    def column_records(self, db_id, table_names=None, col_names=None):
+        """
+        Rows of the column metadata query of TopKSteinerMetadata: one dict with table_name, column_name,
+        data_type, is_pk and fk_target per (column, foreign key target) of the given tables (all tables
+        if None), restricted to col_names if given. Columns without a foreign key get fk_target None.
+        """
+        database = self.databases.get(db_id)
+        if database is None:
+            return []
+        table_names = set(database["tables"] if table_names is None else table_names)
+        col_names = set(col_names) if col_names is not None else None
+        fk_targets = defaultdict(list)
+        for src, dst, rel_type in database["relationships"]:
+            if rel_type == "FOREIGN_KEY_TO":
+                fk_targets[src].append(full_name(dst))
+        records = []
+        for src, dst, rel_type in database["relationships"]:
+            if rel_type == "FOREIGN_KEY_TO" or src not in table_names:
+                continue
+            if col_names is not None and full_name(dst) not in col_names:
+                continue
+            column = database["columns"][dst]
+            for fk_target in fk_targets.get(dst) or [None]:
+                records.append({
+                    "table_name": src,
+                    "column_name": column["name"],
+                    "data_type": column["data_type"],
+                    "is_pk": rel_type == "HAS_PRIMARY_KEY",
+                    "fk_target": fk_target
+                })
+        return records
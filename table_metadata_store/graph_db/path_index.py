@@ -0,0 +1,204 @@
+import os
+import numpy as np
+from collections import deque
+from schema_graph import IndexedSchemaGraph, CsrSchemaGraph
+
+"""
+This module precomputes all-pairs shortest paths over the trimmed schema graph of a database.
+Because every edge has weight 1, one BFS per node gives the distance and predecessor tables,
+which are stored as compact integer arrays (one .npz file per db_id).
+With the tables in place, a Steiner query is an MST-style (Prim) growth over the terminals where
+every step is a distance lookup plus a predecessor walk, instead of a multi-source Dijkstra.
+For small terminal sets the exact minimum Steiner tree can be computed instead with the
+Dreyfus-Wagner dynamic program over the same distance table.
+"""
+
+
+class SchemaPathIndex(IndexedSchemaGraph):
+    """
+    Node i is nodes[i]. dist[s, v] is the hop count from s to v (-1 if unreachable) and
+    pred[s, v] is the node before v on a shortest path from s (-1 for v == s or unreachable).
+    edges holds (u, v, edge type index) rows of the trimmed graph.
+    """
+    def __init__(self, nodes, dist, pred, edges):
+        super().__init__(nodes, edges)
+        self.dist = dist
+        self.pred = pred
+        self._component_dist = {}
+        # Plain-list copies for the per-query lookups, which are faster than numpy scalar indexing
+        self._dist_rows = dist.tolist()
+        self._pred_rows = pred.tolist()
+        # Component label of a node: the smallest node id it can reach
+        self._component = [next(i for i, d in enumerate(row) if d >= 0) for row in self._dist_rows]
+
+    @classmethod
+    def build(cls, graph, edge_types=None):
+        """
+        Builds the index from the (graph, edge_types) pair used by KouMarkowskyAlgorithm,
+        or from an already compiled CsrSchemaGraph if graph is one.
+        """
+        csr = graph if isinstance(graph, CsrSchemaGraph) else CsrSchemaGraph.from_graph(graph, edge_types)
+        n = len(csr.nodes)
+        adjacency = [csr.adjacency(u) for u in range(n)]
+        dtype = np.int16 if n < np.iinfo(np.int16).max else np.int32
+        dist = np.full((n, n), -1, dtype=dtype)
+        pred = np.full((n, n), -1, dtype=dtype)
+        for source in range(n):
+            dist_row, pred_row = dist[source], pred[source]
+            dist_row[source] = 0
+            queue = deque([source])
+            while queue:
+                u = queue.popleft()
+                for v in adjacency[u]:
+                    if dist_row[v] < 0:
+                        dist_row[v] = dist_row[u] + 1
+                        pred_row[v] = u
+                        queue.append(v)
+        return cls(csr.nodes, dist, pred, csr.edges)
+
+    def save(self, path):
+        np.savez_compressed(path, nodes=np.array(self.nodes), dist=self.dist, pred=self.pred, edges=self.edges)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["nodes"], data["dist"], data["pred"], data["edges"])
+
+    def path(self, source, target):
+        """
+        Shortest path from source to target as a list of node ids (both ends included).
+        """
+        pred_row = self._pred_rows[source]
+        path = [target]
+        while path[-1] != source:
+            path.append(pred_row[path[-1]])
+        path.reverse()
+        return path
+
+    def _component_tree(self, terminals):
+        """
+        Steiner tree for terminals that are all in one connected component, grown the same way as
+        KouMarkowskyAlgorithm.steiner_tree (Prim's algorithm over the terminals, where each step attaches
+        the terminal closest to the current tree by a shortest path), but with table lookups
+        instead of a graph search per step.
+        Returns (node ids in the order they were added, tree edges as (u, v) pairs).
+        """
+        tree = [terminals[0]]
+        remaining = list(terminals[1:])
+        edges = []
+        while remaining:
+            _, source, target = min(
+                (self._dist_rows[u][t], u, t) for u in tree for t in remaining
+            )
+            remaining.remove(target)
+            path = self.path(source, target)
+            tree.extend(path[1:])
+            edges.extend(zip(path, path[1:]))
+            # Terminals that the new path passes through are connected already
+            in_tree = set(path)
+            remaining = [t for t in remaining if t not in in_tree]
+        return tree, edges
+
+    def _get_component_dist(self, component):
+        """
+        (node ids of a connected component, int32 distance matrix between them), cached per component.
+        """
+        if component not in self._component_dist:
+            members = [u for u, c in enumerate(self._component) if c == component]
+            self._component_dist[component] = (members, self.dist[np.ix_(members, members)].astype(np.int32))
+        return self._component_dist[component]
+
+    def _exact_component_tree(self, terminals):
+        """
+        Minimum Steiner tree (Dreyfus-Wagner) for terminals that are all in one connected component.
+        dp[S, v] is the size of the smallest tree spanning the terminal subset S plus node v;
+        it costs O(3^k * n + 2^k * n^2) for k terminals and n nodes in the component.
+        Returns (node ids in BFS order from the first terminal, tree edges as (u, v) pairs).
+        """
+        if len(terminals) <= 2:
+            return self._component_tree(terminals)
+        members, dist = self._get_component_dist(self._component[terminals[0]])
+        local = {u: i for i, u in enumerate(members)}
+        root, others = local[terminals[-1]], [local[t] for t in terminals[:-1]]
+        full = (1 << len(others)) - 1
+        n = len(members)
+
+        dp = np.empty((full + 1, n), dtype=np.int32)
+        via = np.zeros((full + 1, n), dtype=np.int32)    # node where the tree of S is split
+        split = np.zeros((full + 1, n), dtype=np.int32)  # best subset D of S when splitting at a node
+        for i, t in enumerate(others):
+            dp[1 << i] = dist[t]
+        columns = np.arange(n)
+        for S in range(1, full + 1):
+            if S & (S - 1) == 0:
+                continue
+            best = np.full(n, np.iinfo(np.int32).max // 2, dtype=np.int32)
+            best_split = np.zeros(n, dtype=np.int32)
+            lowest = S & -S
+            D = (S - 1) & S
+            while D:
+                # Only subsets containing the lowest bit, so each split {D, S \ D} is tried once
+                if D & lowest:
+                    candidate = dp[D] + dp[S ^ D]
+                    better = candidate < best
+                    best[better] = candidate[better]
+                    best_split[better] = D
+                D = (D - 1) & S
+            total = best[:, None] + dist
+            via[S] = total.argmin(axis=0)
+            dp[S] = total[via[S], columns]
+            split[S] = best_split
+
+        edges = set()
+        stack = [(full, root)]
+        while stack:
+            S, v = stack.pop()
+            if S & (S - 1) == 0:
+                path = self.path(members[others[S.bit_length() - 1]], members[v])
+            else:
+                u = int(via[S, v])
+                path = self.path(members[u], members[v])
+                D = int(split[S, u])
+                stack.extend([(D, u), (S ^ D, u)])
+            edges.update(zip(path, path[1:]))
+
+        adjacency = {}
+        for a, b in edges:
+            adjacency.setdefault(a, []).append(b)
+            adjacency.setdefault(b, []).append(a)
+        order, tree_edges, seen = [terminals[0]], [], {terminals[0]}
+        for u in order:
+            for v in sorted(adjacency.get(u, ())):
+                if v not in seen:
+                    seen.add(v)
+                    order.append(v)
+                    tree_edges.append((u, v))
+        return order, tree_edges
+
+    def steiner_tree_ids(self, terminal_ids, exact=False):
+        """
+        Steiner tree of the given terminal ids, one tree per connected component.
+        exact=True uses the Dreyfus-Wagner solver instead of the greedy growth.
+        Returns (node ids, tree edges as (u, v) pairs).
+        """
+        solve_component = self._exact_component_tree if exact else self._component_tree
+        components = {}
+        for t in terminal_ids:
+            components.setdefault(self._component[t], []).append(t)
+        all_nodes, all_edges = [], []
+        for component in components.values():
+            nodes, edges = solve_component(component)
+            all_nodes.extend(nodes)
+            all_edges.extend(edges)
+        return all_nodes, all_edges
+
+    def steiner_tree(self, terminals, exact=False):
+        """
+        Same result format as KouMarkowskyAlgorithm.steiner_tree: nodes, edges, involved_columns, edge_types.
+        Terminals that are not in the trimmed graph are ignored.
+        """
+        return self.tree_result(*self.steiner_tree_ids(self.terminal_ids(terminals), exact=exact))
+
+
+def path_index_file(index_dir, db_id):
+    return os.path.join(index_dir, f"{db_id}.npz")
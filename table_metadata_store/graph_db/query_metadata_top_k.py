@@ -1,21 +1,94 @@
-from neo4j import GraphDatabase
 from collections import defaultdict
+import argparse
 import json
 from steiner_tree import KouMarkowskyAlgorithm
+from local_graph import LocalSchemaGraph
 """
 This module retrieves metadata for tables in a Neo4j Graph Database.
 It implements the Steiner Tree approximation algorithm to find the minimum spanning tree
 that connects a set of terminal nodes (tables).
+With a LocalSchemaGraph (local_graph=...) the same metadata is read from memory instead of Neo4j.
+The schema graph and column metadata of a database are fetched once and cached; run() fetches whatever
+a top_k list still needs for all of its db_ids in one session, with one batched query for each.
 """
 class TopKSteinerMetadata:
-    def __init__(self, uri, auth):
-        self.driver = GraphDatabase.driver(uri, auth=auth)
-        self.steiner = KouMarkowskyAlgorithm(uri, auth)
+    def __init__(self, uri, auth, preload_graphs=False, path_index_dir=None, exact_max_terminals=6,
+                 local_graph=None):
+        self.local_graph = local_graph
+        self.steiner = KouMarkowskyAlgorithm(uri, auth, path_index_dir=path_index_dir,
+                                             exact_max_terminals=exact_max_terminals, local_graph=local_graph)
+        # Share the Steiner driver (None with a local graph) instead of opening a second connection pool
+        self.driver = self.steiner.driver
+        # {db_id: {table full name: [column records]}}
+        self._column_cache = {}
+        if preload_graphs:
+            # Load the schema graphs and column metadata of all databases up front instead of on first use
+            self.preload()
 
     def close(self):
-        self.driver.close()
         self.steiner.close()
 
+    def preload(self, db_ids=None):
+        """
+        Loads the schema graphs and column metadata of the given db_ids (all databases if None)
+        that are not cached yet. With Neo4j this is one session with one batched query for each.
+        """
+        if self.local_graph is not None:
+            db_ids = self.local_graph.db_ids() if db_ids is None else db_ids
+            self.steiner.preload(db_ids)
+            for db_id in db_ids:
+                if db_id not in self._column_cache:
+                    self._column_cache[db_id] = self._group_by_table(self.local_graph.column_records(db_id))
+            return
+        with self.driver.session() as session:
+            if db_ids is None:
+                db_ids = session.execute_read(KouMarkowskyAlgorithm._get_db_ids)
+            self.steiner.preload(db_ids, session=session)
+            missing = [db_id for db_id in dict.fromkeys(db_ids) if db_id not in self._column_cache]
+            if missing:
+                records = session.execute_read(TopKSteinerMetadata._get_column_records, missing)
+                by_db = defaultdict(list)
+                for record in records:
+                    by_db[record["db_id"]].append(record)
+                for db_id in missing:
+                    self._column_cache[db_id] = self._group_by_table(by_db.get(db_id, []))
+
+    @staticmethod
+    def _group_by_table(records):
+        by_table = defaultdict(list)
+        for record in records:
+            by_table[record["table_name"]].append(record)
+        return dict(by_table)
+
+    @staticmethod
+    def _get_column_records(tx, db_ids):
+        """
+        One row per (column, FK target) of every table in the given db_ids.
+        is_pk comes from the type of the Table -> Column relationship that was matched.
+        """
+        query = """
+        MATCH (t:Table)-[r:HAS_COLUMN|HAS_PRIMARY_KEY]->(c:Column)
+        WHERE t.db_id IN $db_ids
+        OPTIONAL MATCH (c)-[:FOREIGN_KEY_TO]->(c2:Column)
+        RETURN t.db_id AS db_id, t.full_name AS table_name, c.name AS column_name, c.data_type AS data_type,
+               type(r) = 'HAS_PRIMARY_KEY' AS is_pk, c2.full_name AS fk_target
+        """
+        return [record.data() for record in tx.run(query, db_ids=db_ids)]
+
+    def _column_records(self, db_id, table_names, col_names=None):
+        """
+        Cached column records of the given tables, restricted to the column full names in col_names if given.
+        """
+        if db_id not in self._column_cache:
+            self.preload([db_id])
+        by_table = self._column_cache[db_id]
+        return [
+            record
+            for table_name in dict.fromkeys(table_names)
+            for record in by_table.get(table_name, [])
+            if col_names is None or f"{record['table_name']}.{record['column_name']}" in col_names
+        ]
+
     # TODO: Need to check the true format of top_k
     @staticmethod
     def extract_info_top_k(top_k):
@@ -34,51 +107,27 @@ class TopKSteinerMetadata:
         """
         Returns metadata for given tables: columns, data types, PK/FK info.
         """
-        with self.driver.session() as session:
-            query = """
-            MATCH (t:Table {db_id: $db_id})-[:HAS_COLUMN|HAS_PRIMARY_KEY]->(c:Column)
-            WHERE t.full_name IN $table_names
-            OPTIONAL MATCH (c)-[fk:FOREIGN_KEY_TO]->(c2:Column)
-            RETURN t.full_name AS table_name, c.name AS column_name, c.data_type AS data_type,
-                   exists((t)-[:HAS_PRIMARY_KEY]->(c)) AS is_pk,
-                   c2.full_name AS fk_target
-            """
-            result = list(session.run(query, db_id=db_id, table_names=table_names))
-            metadata = defaultdict(list)
-            relevant_columns = set(f"{rec['table_name']}.{rec['column_name']}" for rec in result)
-            for record in result:
-                fk_target = record["fk_target"]
-                if fk_target and fk_target not in relevant_columns:
-                    fk_target = None
-                col_info = {
-                    "column_name": record["column_name"],
-                    "data_type": record["data_type"],
-                    "is_pk": record["is_pk"],
-                    "fk_target": fk_target
-                }
-                metadata[record["table_name"]].append(col_info)
-            return dict(metadata)
+        result = self._column_records(db_id, table_names)
+        metadata = defaultdict(list)
+        relevant_columns = set(f"{rec['table_name']}.{rec['column_name']}" for rec in result)
+        for record in result:
+            fk_target = record["fk_target"]
+            if fk_target and fk_target not in relevant_columns:
+                fk_target = None
+            col_info = {
+                "column_name": record["column_name"],
+                "data_type": record["data_type"],
+                "is_pk": record["is_pk"],
+                "fk_target": fk_target
+            }
+            metadata[record["table_name"]].append(col_info)
+        return dict(metadata)
 
     def get_steiner_connection_metadata(self, db_id, steiner_tables, involved_columns):
         """
         Returns metadata for steiner tables, only for involved columns.
         """
-        # Use involved_columns directly in your Cypher query
-        with self.driver.session() as session:
-            query = """
-            MATCH (t:Table {db_id: $db_id})-[:HAS_COLUMN|HAS_PRIMARY_KEY]->(c:Column)
-            WHERE t.full_name IN $table_names AND c.full_name IN $col_names
-            OPTIONAL MATCH (c)-[fk:FOREIGN_KEY_TO]->(c2:Column)
-            RETURN t.full_name AS table_name, c.name AS column_name, c.data_type AS data_type,
-                   exists((t)-[:HAS_PRIMARY_KEY]->(c)) AS is_pk,
-                   c2.full_name AS fk_target
-            """
-            result = list(session.run(
-                query,
-                db_id=db_id,
-                table_names=steiner_tables,
-                col_names=list(involved_columns)
-            ))
+        result = self._column_records(db_id, steiner_tables, col_names=set(involved_columns))
         metadata = defaultdict(dict)
         for record in result:
             col_key = (record["column_name"], record["data_type"], record["is_pk"])
@@ -111,25 +160,16 @@ class TopKSteinerMetadata:
         Main entry: takes top_k, returns metadata for terminal and steiner tables for each db_id.
         """
         db_id_map = self.extract_info_top_k(top_k)
+        # Everything the loop below needs, for all db_ids at once
+        self.preload(list(db_id_map))
         all_results = {}
         for db_id, tables in db_id_map.items():
-            steiner_result = self.steiner.steiner_tree(tables, db_id)
+            terminal_tables, steiner_tables, steiner_result = self.steiner.steiner_tables(db_id, tables)
             involved_columns = set(steiner_result.get("involved_columns", []))
-            # Use sets for membership checks
-            tables_set = set(tables)
-            table_nodes_set = set()
-            for node in steiner_result["nodes"]:
-                if node.count(".") == 1:
-                    table_nodes_set.add(node)
-                elif node.count(".") == 2:
-                    table_name = KouMarkowskyAlgorithm.extract_table_name(node)
-                    if table_name:
-                        table_nodes_set.add(table_name)
-            terminal_tables = list(table_nodes_set & tables_set)
-            for t in tables_set:
+            # Terminals that are not in the trimmed graph still get their metadata
+            for t in dict.fromkeys(tables):
                 if t not in terminal_tables:
                     terminal_tables.append(t)
-            steiner_tables = list(table_nodes_set - tables_set)
             # Get metadata
             terminal_metadata = self.get_table_metadata(db_id, terminal_tables)
             steiner_metadata = self.get_steiner_connection_metadata(
@@ -164,9 +204,16 @@ def print_metadata(result):
         print("-" * 40)
 
 if __name__ == "__main__":
-    with open("table_metadata_store/graph_db/db_config.json") as f:
-        db_config = json.load(f)
-    fetcher = TopKSteinerMetadata("bolt://localhost:7687", (db_config["username"], db_config["password"]))
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument('--local_graph', type=str, default='',
+                             help='LocalSchemaGraph pickle (build_local_graph.py); Neo4j is used if not given')
+    args = args_parser.parse_args()
+    if args.local_graph:
+        fetcher = TopKSteinerMetadata(None, None, local_graph=LocalSchemaGraph.load(args.local_graph))
+    else:
+        with open("table_metadata_store/graph_db/db_config.json") as f:
+            db_config = json.load(f)
+        fetcher = TopKSteinerMetadata("bolt://localhost:7687", (db_config["username"], db_config["password"]))
     top_k = [
         {"db_id": "movie_platform", "table_name": "movies"},
         {"db_id": "movie_platform", "table_name": "lists"},
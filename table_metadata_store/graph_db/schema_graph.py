@@ -0,0 +1,216 @@
+import numpy as np
+from collections import deque
+
+"""
+This module compiles the trimmed schema graph of a database into integer form.
+Nodes get integer ids (sorted by full name), the adjacency is stored as CSR offset/neighbor arrays,
+and a node-kind array and a table-of array replace the "db.table" / "db.table.column" string scans.
+Because every edge has weight 1, searches are plain BFS. Connected components, the Steiner search
+and table extraction work on node ids, and names are only looked up when the result is returned.
+"""
+
+EDGE_TYPES = ("HAS_COLUMN", "HAS_PRIMARY_KEY", "FOREIGN_KEY_TO")
+JOIN_EDGE_TYPES = ("HAS_PRIMARY_KEY", "FOREIGN_KEY_TO")
+
+# Node kinds, from the full_name format of create_graph_db.py
+NODE_OTHER, NODE_TABLE, NODE_COLUMN = -1, 0, 1
+
+
+def node_kinds(nodes):
+    """
+    Returns (kind, table_of) int arrays for a list of full names: kind[i] is NODE_TABLE for "db.table",
+    NODE_COLUMN for "db.table.column" and NODE_OTHER otherwise; table_of[i] is the id of the table node
+    the node belongs to (itself for a table, -1 if that table is not in the list).
+    """
+    node_ids = {node: i for i, node in enumerate(nodes)}
+    kind = np.full(len(nodes), NODE_OTHER, dtype=np.int8)
+    table_of = np.full(len(nodes), -1, dtype=np.int32)
+    for i, node in enumerate(nodes):
+        dots = node.count(".")
+        if dots == 1:
+            kind[i], table_of[i] = NODE_TABLE, i
+        elif dots == 2:
+            kind[i] = NODE_COLUMN
+            table_of[i] = node_ids.get(node.rsplit(".", 1)[0], -1)
+    return kind, table_of
+
+
+class IndexedSchemaGraph:
+    """
+    Common part of the integer graph representations: node names and ids, node kinds, the edge list
+    as (u, v, edge type index) rows, and the conversion of a tree of node ids back to names.
+    """
+    def __init__(self, nodes, edges):
+        self.nodes = [str(node) for node in nodes]
+        self.node_ids = {node: i for i, node in enumerate(self.nodes)}
+        self.edges = edges
+        self.kind, self.table_of = node_kinds(self.nodes)
+        self._table_of = self.table_of.tolist()
+        self._edge_types = None
+        self._edge_info = None
+
+    def edge_types(self):
+        """
+        The {frozenset([a, b]): rel_type} dict of the trimmed graph, as returned by steiner_tree.
+        """
+        if self._edge_types is None:
+            self._edge_types = {
+                frozenset([self.nodes[u], self.nodes[v]]): EDGE_TYPES[t] for u, v, t in self.edges.tolist()
+            }
+        return self._edge_types
+
+    def _get_edge_info(self):
+        """
+        {(u, v): (frozenset of the two names, is PK/FK edge)} for both directions of every edge.
+        """
+        if self._edge_info is None:
+            self._edge_info = {}
+            for u, v, t in self.edges.tolist():
+                info = (frozenset([self.nodes[u], self.nodes[v]]), EDGE_TYPES[t] in JOIN_EDGE_TYPES)
+                self._edge_info[(u, v)] = info
+                self._edge_info[(v, u)] = info
+        return self._edge_info
+
+    def terminal_ids(self, terminals):
+        """
+        Sorted distinct ids of the terminals; names that are not in the trimmed graph are ignored.
+        """
+        return sorted({self.node_ids[t] for t in terminals if t in self.node_ids})
+
+    def table_ids(self, node_ids):
+        """
+        Distinct table ids of the given nodes (tables themselves, or the table of a column) in order.
+        """
+        tables = dict.fromkeys(self._table_of[u] for u in node_ids)
+        tables.pop(-1, None)
+        return list(tables)
+
+    def tree_result(self, nodes, edges):
+        """
+        Maps a tree of node ids to the steiner_tree result format: nodes, edges, involved_columns, edge_types.
+        """
+        edge_info = self._get_edge_info()
+        all_edges, involved_columns = set(), set()
+        for u, v in edges:
+            edge, is_join = edge_info[(u, v)]
+            all_edges.add(edge)
+            if is_join:
+                involved_columns.update(edge)
+        return {
+            "nodes": [self.nodes[u] for u in nodes],
+            "edges": [list(edge) for edge in all_edges],
+            "involved_columns": list(involved_columns),
+            "edge_types": dict(self.edge_types())
+        }
+
+
+class CsrSchemaGraph(IndexedSchemaGraph):
+    """
+    The neighbors of node u are neighbors[offsets[u]:offsets[u + 1]], sorted by id.
+    """
+    def __init__(self, nodes, offsets, neighbors, edges):
+        super().__init__(nodes, edges)
+        self.offsets = offsets
+        self.neighbors = neighbors
+        # Plain-list copies for the searches, which are faster than numpy scalar indexing
+        self._offsets = offsets.tolist()
+        self._neighbors = neighbors.tolist()
+        self._components = None
+
+    @classmethod
+    def from_graph(cls, graph, edge_types):
+        """
+        Compiles the (graph, edge_types) pair used by KouMarkowskyAlgorithm.
+        """
+        nodes = sorted(set(graph) | {n for neighbors in graph.values() for n in neighbors})
+        node_ids = {node: i for i, node in enumerate(nodes)}
+        pairs = sorted({(node_ids[a], node_ids[b]) for a in graph for b in graph[a]}
+                       | {(node_ids[b], node_ids[a]) for a in graph for b in graph[a]})
+        pairs = np.array(pairs, dtype=np.int32).reshape(-1, 2)
+        offsets = np.zeros(len(nodes) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(pairs[:, 0], minlength=len(nodes)), out=offsets[1:])
+        rows = []
+        for edge, rel_type in edge_types.items():
+            a, b = sorted(edge)
+            if a in node_ids and b in node_ids:
+                rows.append((node_ids[a], node_ids[b], EDGE_TYPES.index(rel_type)))
+        edges = np.array(sorted(rows), dtype=np.int32).reshape(-1, 3)
+        return cls(nodes, offsets, pairs[:, 1].copy(), edges)
+
+    def adjacency(self, u):
+        return self._neighbors[self._offsets[u]:self._offsets[u + 1]]
+
+    def bfs(self, sources):
+        """
+        Multi-source BFS. Returns (dist, parent) lists: dist[v] is the hop count from the nearest
+        source (-1 if unreachable) and parent[v] the node before v (-1 for sources and unreachable nodes).
+        """
+        n = len(self.nodes)
+        dist, parent = [-1] * n, [-1] * n
+        for s in sources:
+            dist[s] = 0
+        queue = deque(sources)
+        offsets, neighbors = self._offsets, self._neighbors
+        while queue:
+            u = queue.popleft()
+            next_dist = dist[u] + 1
+            for v in neighbors[offsets[u]:offsets[u + 1]]:
+                if dist[v] < 0:
+                    dist[v] = next_dist
+                    parent[v] = u
+                    queue.append(v)
+        return dist, parent
+
+    def components(self):
+        """
+        Component label of every node (the smallest node id in its connected component).
+        """
+        if self._components is None:
+            labels = [-1] * len(self.nodes)
+            offsets, neighbors = self._offsets, self._neighbors
+            for root in range(len(self.nodes)):
+                if labels[root] >= 0:
+                    continue
+                labels[root] = root
+                stack = [root]
+                while stack:
+                    u = stack.pop()
+                    for v in neighbors[offsets[u]:offsets[u + 1]]:
+                        if labels[v] < 0:
+                            labels[v] = root
+                            stack.append(v)
+            self._components = labels
+        return self._components
+
+    def steiner_tree_ids(self, terminal_ids):
+        """
+        The KouMarkowskyAlgorithm approximation on node ids: per connected component, start from its
+        smallest terminal and repeatedly attach the terminal closest to the tree (ties broken by id)
+        along its BFS path. Returns (node ids in the order they were added, tree edges as (u, v) pairs).
+        """
+        labels = self.components()
+        groups = {}
+        for t in terminal_ids:
+            groups.setdefault(labels[t], []).append(t)
+        all_nodes, all_edges = [], []
+        for group in groups.values():
+            tree = [group[0]]
+            in_tree = {group[0]}
+            remaining = group[1:]
+            while remaining:
+                dist, parent = self.bfs(tree)
+                target = min(remaining, key=lambda t: (dist[t], t))
+                path = [target]
+                while path[-1] not in in_tree:
+                    path.append(parent[path[-1]])
+                path.reverse()
+                tree.extend(path[1:])
+                in_tree.update(path)
+                all_edges.extend(zip(path, path[1:]))
+                # Terminals that the new path passes through are connected already
+                remaining = [t for t in remaining if t not in in_tree]
+            all_nodes.extend(tree)
+        return all_nodes, all_edges
+
+    def steiner_tree(self, terminals):
+        return self.tree_result(*self.steiner_tree_ids(self.terminal_ids(terminals)))
@@ -1,23 +1,137 @@
-from neo4j import GraphDatabase
-import heapq
+import os
 from collections import defaultdict
 from functools import lru_cache
+from path_index import SchemaPathIndex, path_index_file
+from schema_graph import CsrSchemaGraph
+
+try:
+    from neo4j import GraphDatabase
+except ImportError:  # Only needed without a LocalSchemaGraph
+    GraphDatabase = None
 
 """
-This module implements the Steiner Tree approximation algorithm for Neo4j Graphs.
+This module implements the Steiner Tree approximation algorithm for Neo4j Graphs
+(or for a LocalSchemaGraph built from the tables JSON, see local_graph.py).
 """
 
 class KouMarkowskyAlgorithm:
     """
     This class implements the Kou-Markowsky-Berman algorithm for finding a Steiner tree in a graph.
-    It uses Dijkstra's algorithm to find the shortest path from multiple source nodes to all other nodes in the graph.
+    It uses a multi-source BFS (all edges have weight 1) to find the shortest path from the tree to the other terminals.
     The class is initialized with the URI and authentication credentials for the Neo4j database.
+    The trimmed schema graph of each db_id is fetched from Neo4j once, compiled into a CsrSchemaGraph
+    (integer node ids, CSR adjacency) and cached in memory, since schemas do not change between questions.
+    If path_index_dir is given, databases with a precomputed SchemaPathIndex there (see build_path_index.py)
+    are answered from the index with table lookups instead of graph searches.
+    Queries with at most exact_max_terminals distinct terminals are solved exactly (Dreyfus-Wagner,
+    see SchemaPathIndex.steiner_tree); larger ones use the approximation. 0 disables the exact solver.
+    If local_graph (a LocalSchemaGraph) is given, graphs are read from it and Neo4j is not used at all.
     """
-    def __init__(self, uri, auth):
-        self.driver = GraphDatabase.driver(uri, auth=auth)
+    def __init__(self, uri, auth, path_index_dir=None, exact_max_terminals=6, local_graph=None):
+        self.local_graph = local_graph
+        self.driver = None
+        if local_graph is None:
+            if GraphDatabase is None:
+                raise ImportError("The neo4j package is required unless a LocalSchemaGraph is given")
+            self.driver = GraphDatabase.driver(uri, auth=auth)
+        self.path_index_dir = path_index_dir
+        self.exact_max_terminals = exact_max_terminals
+        self._graph_cache = {}
+        self._compiled_cache = {}
+        self._path_index_cache = {}
 
     def close(self):
-        self.driver.close()
+        if self.driver is not None:
+            self.driver.close()
+
+    def get_graph(self, db_id):
+        """
+        Returns (graph, edge_types) for db_id, loading it from Neo4j (or the local graph) on first use.
+        """
+        if db_id not in self._graph_cache:
+            self.preload([db_id])
+        return self._graph_cache[db_id]
+
+    def preload(self, db_ids=None, session=None):
+        """
+        Loads the graphs of the given db_ids (all databases in Neo4j if None) that are not cached yet,
+        with one batched query, so later Steiner queries never touch Neo4j.
+        An open session can be passed to share it with other queries.
+        """
+        if self.local_graph is not None:
+            for db_id in (self.local_graph.db_ids() if db_ids is None else db_ids):
+                if db_id not in self._graph_cache:
+                    graph, edge_types = self.local_graph.trimmed_subgraph(db_id)
+                    self._graph_cache[db_id] = (dict(graph), edge_types)
+            return len(self._graph_cache)
+        if session is None:
+            with self.driver.session() as session:
+                return self.preload(db_ids, session=session)
+        if db_ids is None:
+            db_ids = session.execute_read(KouMarkowskyAlgorithm._get_db_ids)
+        missing = [db_id for db_id in dict.fromkeys(db_ids) if db_id not in self._graph_cache]
+        if missing:
+            graphs = session.execute_read(KouMarkowskyAlgorithm._get_trimmed_subgraphs, missing)
+            for db_id in missing:
+                # Databases without any relationship get an empty graph, so they are not fetched again
+                graph, edge_types = graphs.get(db_id, ({}, {}))
+                self._graph_cache[db_id] = (dict(graph), edge_types)
+        return len(self._graph_cache)
+
+    def invalidate(self, db_id=None):
+        """
+        Drops the cached graph of db_id (or of every database if None), e.g. after reloading Neo4j.
+        """
+        if db_id is None:
+            self._graph_cache.clear()
+            self._compiled_cache.clear()
+            self._path_index_cache.clear()
+        else:
+            self._graph_cache.pop(db_id, None)
+            self._compiled_cache.pop(db_id, None)
+            self._path_index_cache.pop(db_id, None)
+
+    def get_compiled_graph(self, db_id):
+        """
+        Returns the CsrSchemaGraph of db_id, compiling the cached graph on first use.
+        """
+        if db_id not in self._compiled_cache:
+            self._compiled_cache[db_id] = CsrSchemaGraph.from_graph(*self.get_graph(db_id))
+        return self._compiled_cache[db_id]
+
+    def get_path_index(self, db_id):
+        """
+        Returns the precomputed SchemaPathIndex of db_id, or None if there is none.
+        """
+        if self.path_index_dir is None:
+            return None
+        if db_id not in self._path_index_cache:
+            path = path_index_file(self.path_index_dir, db_id)
+            self._path_index_cache[db_id] = SchemaPathIndex.load(path) if os.path.exists(path) else None
+        return self._path_index_cache[db_id]
+
+    def get_or_build_path_index(self, db_id):
+        """
+        Like get_path_index, but builds the index in memory from the cached graph if there is no file.
+        """
+        path_index = self.get_path_index(db_id)
+        if path_index is None:
+            path_index = SchemaPathIndex.build(self.get_compiled_graph(db_id))
+            self._path_index_cache[db_id] = path_index
+        return path_index
+
+    def _solve(self, terminals, db_id):
+        """
+        Runs the Steiner search on node ids.
+        Returns (the graph that solved it, node ids of the tree, tree edges as (u, v) pairs).
+        """
+        if len(set(terminals)) <= self.exact_max_terminals:
+            solver = self.get_or_build_path_index(db_id)
+            nodes, edges = solver.steiner_tree_ids(solver.terminal_ids(terminals), exact=True)
+        else:
+            solver = self.get_path_index(db_id) or self.get_compiled_graph(db_id)
+            nodes, edges = solver.steiner_tree_ids(solver.terminal_ids(terminals))
+        return solver, nodes, edges
 
     """
     This function finds the Steiner tree for a given set of terminals in the graph.
@@ -26,110 +140,32 @@ class KouMarkowskyAlgorithm:
     """
 
     def steiner_tree(self, terminals, db_id):
-        graph, edge_types = self.driver.session().execute_read(KouMarkowskyAlgorithm._get_trimmed_subgraph, db_id)
-        terminal_set = set(terminals)
-        all_tree_nodes = []
-        all_tree_edges = set()
-        all_involved_columns = set()
-        all_edge_types = dict(edge_types)  # Copy
-
-        components = self._get_connected_components(graph)
-        for component in components:
-            component_terminals = terminal_set & component
-            if not component_terminals:
-                continue  # No terminals in this component
-            # Pick a starting terminal in this component
-            start = next(iter(component_terminals))
-            used_terminals = {start}
-            tree_nodes = [start]
-            tree_edges = set()
-            involved_columns = set()
-            while used_terminals != component_terminals:
-                frontier, parents = self._multi_source_dijkstra(graph, set(tree_nodes))
-                min_dist, best_terminal = float('inf'), None
-                for terminal in component_terminals - used_terminals:
-                    if frontier[terminal] < min_dist:
-                        min_dist = frontier[terminal]
-                        best_terminal = terminal
-                if best_terminal is None:
-                    break
-                # Reconstruct path
-                path = []
-                current = best_terminal
-                while parents[current] is not None:
-                    prev = parents[current]
-                    edge = frozenset([prev, current])
-                    tree_edges.add(edge)
-                    rel_type = edge_types.get(edge)
-                    if rel_type in ("HAS_PRIMARY_KEY", "FOREIGN_KEY_TO"):
-                        involved_columns.update([prev, current])
-                    if current not in tree_nodes:
-                        path.append(current)
-                    current = prev
-                if current not in tree_nodes:
-                    path.append(current)
-                for node in reversed(path):
-                    tree_nodes.append(node)
-                used_terminals.add(best_terminal)
-            all_tree_nodes.extend(tree_nodes)
-            all_tree_edges.update(tree_edges)
-            all_involved_columns.update(involved_columns)
-        return {
-            "nodes": all_tree_nodes,
-            "edges": [list(edge) for edge in all_tree_edges],
-            "involved_columns": list(all_involved_columns),
-            "edge_types": all_edge_types
-        }
+        solver, nodes, edges = self._solve(terminals, db_id)
+        return solver.tree_result(nodes, edges)
+
+    def steiner_tables(self, db_id, terminals):
+        """
+        Returns (terminal tables, Steiner tables, steiner_tree result). The tables of the tree nodes are
+        looked up by node id; only the tables themselves are mapped back to names.
+        """
+        solver, nodes, edges = self._solve(terminals, db_id)
+        terminal_ids = set(solver.terminal_ids(terminals))
+        table_ids = solver.table_ids(nodes)
+        terminal_tables = [solver.nodes[t] for t in table_ids if t in terminal_ids]
+        steiner_tables = [solver.nodes[t] for t in table_ids if t not in terminal_ids]
+        return terminal_tables, steiner_tables, solver.tree_result(nodes, edges)
 
     """
     This function calls the algorithm to find Steiner tree for a given set of terminals in the graph.
     The function returns the terminal tables and Steiner tables in the order they were found.
     """
     def find_steiner_tree(self, db_id, terminals, verbose=False):
-        result = self.steiner_tree(terminals, db_id)
-        table_set = set()
-        for node in result["nodes"]:
-            if node.count(".") == 1:
-                table_set.add(node)
-            elif node.count(".") == 2:
-                table_name = self.extract_table_name(node)
-                if table_name:
-                    table_set.add(table_name)
-
-        terminal_tables = [t for t in table_set if t in terminals]
-        steiner_tables = [t for t in table_set if t not in terminals]
+        terminal_tables, steiner_tables, _ = self.steiner_tables(db_id, terminals)
         if verbose:
-            print("\nTerminal Table Nodes (unordered):", terminal_tables)
-            print("Steiner Table Nodes (unordered):", steiner_tables)
+            print("\nTerminal Table Nodes:", terminal_tables)
+            print("Steiner Table Nodes:", steiner_tables)
         return terminal_tables, steiner_tables
 
-    @staticmethod
-    def _multi_source_dijkstra(graph, terminals):
-        """
-        This function implements Dijkstra's algorithm for multiple sources.
-        It finds the shortest path from multiple source nodes to all other nodes in the graph.
-        It returns the distances and the previous nodes in the path.
-        """
-        dist = defaultdict(lambda: float('inf'))
-        prev = {}
-        heap = []
-        for terminal in terminals:
-            dist[terminal] = 0
-            heapq.heappush(heap, (0, terminal))
-            prev[terminal] = None
-
-        while heap:
-            current_dist, current_node = heapq.heappop(heap)
-            if current_dist > dist[current_node]:
-                continue
-            for neighbor in graph[current_node]:
-                distance = current_dist + 1
-                if distance < dist[neighbor]:
-                    dist[neighbor] = distance
-                    prev[neighbor] = current_node
-                    heapq.heappush(heap, (distance, neighbor))
-        return dist, prev
-
     @staticmethod
     def _get_subgraph(tx, db_id):
         """
@@ -150,30 +186,42 @@ class KouMarkowskyAlgorithm:
         return graph, edge_types
 
     @staticmethod
-    def _get_trimmed_subgraph(tx, db_id):
+    def _get_db_ids(tx):
+        """
+        Returns every db_id that has Table nodes in the Neo4j database.
+        """
+        query = """
+            MATCH (t:Table)
+            RETURN DISTINCT t.db_id AS db_id
+            """
+        return [record["db_id"] for record in tx.run(query)]
+
+    @staticmethod
+    def _get_trimmed_subgraphs(tx, db_ids):
         """
-        Retrieves the subgraph for the given db_id, excluding column nodes of degree 1 (leaf columns).
+        Retrieves the subgraphs of all the given db_ids in one query, excluding column nodes of degree 1
+        (leaf columns). Returns {db_id: (graph, edge_types)}.
         """
         query = """
             MATCH (n)
-            WHERE n.db_id = $db_id
+            WHERE n.db_id IN $db_ids
               AND NOT (
                 n:Column AND size([(n)--()|1]) = 1
               )
-            WITH collect(n) AS nodes
+            WITH n.db_id AS db_id, collect(n) AS nodes
             UNWIND nodes AS n
             MATCH (n)-[r]-(m)
             WHERE m IN nodes
-            RETURN n.full_name AS src, m.full_name AS dst, type(r) AS rel_type
+            RETURN db_id, n.full_name AS src, m.full_name AS dst, type(r) AS rel_type
         """
-        graph = defaultdict(list)
-        edge_types = {}
-        for record in tx.run(query, db_id=db_id):
+        graphs = defaultdict(lambda: (defaultdict(list), {}))
+        for record in tx.run(query, db_ids=db_ids):
+            graph, edge_types = graphs[record["db_id"]]
             src, dst, rel_type = record["src"], record["dst"], record["rel_type"]
             graph[src].append(dst)
             graph[dst].append(src)
             edge_types[frozenset([src, dst])] = rel_type
-        return graph, edge_types
+        return dict(graphs)
     
     @staticmethod
     @lru_cache(maxsize=128)
@@ -186,27 +234,3 @@ class KouMarkowskyAlgorithm:
         if node.count(".") == 2:
             return ".".join(node.split(".")[:2])
         return None
-
-    @staticmethod
-    def _get_connected_components(graph):
-        """
-        This function retrieves the connected components of the graph.
-        The algorithm uses a depth-first search to find all connected components in the graph.
-        It returns a list of sets, where each set contains the nodes in a connected component.
-        """
-        visited = set()
-        components = []
-        for node in graph:
-            if node not in visited:
-                stack = [node]
-                component = set()
-                while stack:
-                    curr = stack.pop()
-                    if curr not in visited:
-                        visited.add(curr)
-                        component.add(curr)
-                        stack.extend([nbr for nbr in graph[curr] if nbr not in visited])
-                components.append(component)
-        return components
-
-
@@ -1,5 +1,9 @@
+import argparse
+import io
 import json
+import time
 import psycopg2
+from psycopg2.extras import execute_values
 
 # Load credentials from db_config.json
 with open("table_metadata_store/db_config.json", "r") as f:
@@ -14,9 +18,11 @@ db_params = {
     "port": db_config.get("DB_PORT", 5432)
 }
 
-# Load train_tables.json
-with open("bird/data/train/train_tables.json", "r") as f:
-    train_tables = json.load(f)
+# Columns written by the loader, in row order
+METADATA_COLUMNS = (
+    "table_name", "column_name", "column_type", "is_primary_key",
+    "is_foreign_key", "foreign_key_table", "foreign_key_column", "db_id"
+)
 
 # Connect to PostgreSQL
 def connect_to_postgres():
@@ -28,11 +34,7 @@ def connect_to_postgres():
         print(f"Error connecting to PostgreSQL: {e}")
         return None
 
-def insert_metadata_to_postgres(schema_json, db_config):
-    conn = psycopg2.connect(**db_config)
-    cur = conn.cursor()
-    print("Connected to PostgreSQL database.")
-
+def create_metadata_table(cur):
     # Create table_metadata table if it doesn't exist
     cur.execute("""
         CREATE TABLE IF NOT EXISTS table_metadata (
@@ -47,62 +49,109 @@ def insert_metadata_to_postgres(schema_json, db_config):
             db_id TEXT
         );
     """)
+    # Indexes for the lookups by database and table / column
+    cur.execute("CREATE INDEX IF NOT EXISTS table_metadata_db_table_idx ON table_metadata (db_id, table_name);")
+    cur.execute("CREATE INDEX IF NOT EXISTS table_metadata_db_column_idx ON table_metadata (db_id, column_name);")
+
+def build_metadata_rows(schema_entry):
+    """
+    Returns one row (in METADATA_COLUMNS order) per column of the schema, table by table.
+    """
+    db_id = schema_entry["db_id"]
+    table_names = schema_entry["table_names"]
+    column_names = schema_entry["column_names"]
+    column_types = schema_entry["column_types"]
+
+    # Lookup maps built once per schema: primary key column indexes (first column of a composite key)
+    # and, for foreign key columns, the first column they reference
+    primary_keys = {pk if isinstance(pk, int) else pk[0] for pk in schema_entry["primary_keys"]}
+    foreign_keys = {}
+    for from_idx, to_idx in schema_entry["foreign_keys"]:
+        foreign_keys.setdefault(from_idx, to_idx)
+
+    columns_by_table = {}
+    for col_idx, (col_table_idx, col_name) in enumerate(column_names):
+        columns_by_table.setdefault(col_table_idx, []).append((col_idx, col_name))
+
+    rows = []
+    for table_idx, table_name in enumerate(table_names):
+        for col_idx, col_name in columns_by_table.get(table_idx, []):
+            foreign_key_table = foreign_key_column = None
+            if col_idx in foreign_keys:
+                foreign_key_table_idx, foreign_key_column = column_names[foreign_keys[col_idx]]
+                foreign_key_table = table_names[foreign_key_table_idx]
+            rows.append((
+                table_name, col_name, column_types[col_idx], col_idx in primary_keys,
+                col_idx in foreign_keys, foreign_key_table, foreign_key_column,
+                db_id
+            ))
+    return rows
 
-    # Iterate through all tables in the schema_json
-    for schema_entry in schema_json:
-        db_id = schema_entry["db_id"]
-        table_names = schema_entry["table_names"]
-        column_names = schema_entry["column_names"]
-        column_types = schema_entry["column_types"]
-        primary_keys = schema_entry["primary_keys"]
-        foreign_keys = schema_entry["foreign_keys"]
-
-        # Flatten primary_keys to handle nested lists
-        flat_primary_keys = [pk if isinstance(pk, int) else pk[0] for pk in primary_keys]
-
-        # Insert metadata for each table
-        for table_idx, table_name in enumerate(table_names):
-            for col_idx, (col_table_idx, col_name) in enumerate(column_names):
-                if col_table_idx != table_idx:
-                    continue
-
-                # Determine if the column is a primary key
-                is_primary_key = col_idx in flat_primary_keys
-
-                # Determine if the column is a foreign key
-                is_foreign_key = False
-                foreign_key_table = None
-                foreign_key_column = None
-
-                for from_idx, to_idx in foreign_keys:
-                    if from_idx == col_idx:
-                        is_foreign_key = True
-                        foreign_key_table_idx, foreign_key_column = column_names[to_idx]
-                        foreign_key_table = table_names[foreign_key_table_idx]
-                        break
-
-                # Insert the metadata for the column
-                cur.execute("""
-                    INSERT INTO table_metadata (
-                        table_name, column_name, column_type, is_primary_key,
-                        is_foreign_key, foreign_key_table, foreign_key_column,
-                        db_id
-                    )
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s);
-                """, (
-                    table_name, col_name, column_types[col_idx], is_primary_key,
-                    is_foreign_key, foreign_key_table, foreign_key_column,
-                    db_id
-                ))
+def copy_value(value):
+    """
+    Formats a value for COPY text format: \\N for NULL, t/f for booleans, escaped text otherwise.
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
 
+def copy_rows(cur, rows):
+    """
+    Streams rows into table_metadata with COPY FROM STDIN.
+    """
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(copy_value(value) for value in row) + "\n")
+    buffer.seek(0)
+    cur.copy_expert(f"COPY table_metadata ({', '.join(METADATA_COLUMNS)}) FROM STDIN", buffer)
+
+def insert_rows_values(cur, rows):
+    """
+    Inserts rows into table_metadata with multi-row INSERT statements (execute_values).
+    """
+    execute_values(
+        cur,
+        f"INSERT INTO table_metadata ({', '.join(METADATA_COLUMNS)}) VALUES %s",
+        rows,
+        page_size=1000
+    )
+
+def insert_metadata_to_postgres(schema_json, conn, db_ids=None, method="copy"):
+    """
+    (Re)loads the metadata of the given db_ids (every database in schema_json if None).
+    Existing rows of those db_ids are deleted in the same transaction, so a reload is idempotent.
+    """
+    write_rows = copy_rows if method == "copy" else insert_rows_values
+    schemas = [entry for entry in schema_json if db_ids is None or entry["db_id"] in db_ids]
+    with conn.cursor() as cur:
+        create_metadata_table(cur)
+        cur.execute("DELETE FROM table_metadata WHERE db_id = ANY(%s);", ([entry["db_id"] for entry in schemas],))
+        total_start = time.time()
+        for schema_entry in schemas:
+            start_time = time.time()
+            rows = build_metadata_rows(schema_entry)
+            write_rows(cur, rows)
+            print(f"{schema_entry['db_id']}: {len(rows)} columns in {time.time() - start_time:.3f}s")
     conn.commit()
-    cur.close()
-    conn.close()
-    print("PostgreSQL connection closed.")
+    print(f"Loaded {len(schemas)} databases in {time.time() - total_start:.2f}s")
 
 if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument('--tables_file', type=str, default='bird/data/train/train_tables.json')
+    args_parser.add_argument('--db_ids', type=str, nargs='*', default=None,
+                             help='Only reload these databases (default: every database in the tables file)')
+    args_parser.add_argument('--method', type=str, choices=['copy', 'values'], default='copy')
+    args = args_parser.parse_args()
+
+    # Load train_tables.json
+    with open(args.tables_file, "r") as f:
+        train_tables = json.load(f)
+
     conn = connect_to_postgres()
     if conn:
-        insert_metadata_to_postgres(train_tables, db_params)
+        insert_metadata_to_postgres(train_tables, conn, db_ids=args.db_ids, method=args.method)
         conn.close()
-        print("PostgreSQL connection closed.")
\ No newline at end of file
+        print("PostgreSQL connection closed.")
@@ -1,12 +1,22 @@
 import json
-import requests
+import argparse
 import re
 import time
 import chromadb
-from sentence_transformers import SentenceTransformer
 from transformers import AutoTokenizer
 import math
 import fasttext
+import os
+import sys
+
+# เพิ่ม root ของ repo ใน sys.path เพื่อ import โมดูลที่ใช้ร่วมกัน
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from embed_and_vector_store.embedding_cache import CachedEncoder
+from embed_and_vector_store.retrieval import batch_similarity_search
+from embed_and_vector_store.numpy_index import load_search_index
+from embed_and_vector_store.retrieval_cache import RetrievalCache
+from embed_and_vector_store.reranker import CrossEncoderReranker, rerank_candidates
+from gensql_common.llm_client import create_client, query_llm
 
 # โหลดโมเดล fastText language detection
 lang_model = fasttext.load_model("../lang_detect_model/lid.176.bin")
@@ -20,6 +30,9 @@ token_exceed_log = []
 # สร้าง list สำหรับเก็บ log ข้อมูลโทเค็นทั้งหมด
 token_log = []
 
+# สร้าง list สำหรับเก็บ error จากการเรียก LLM (เช่น tie-break ตอน rerank)
+error_log = []
+
 id_match_log_top_n = {"correct": 0, "incorrect": 0}
 
 # สร้าง dict สำหรับเก็บผลการเช็ค id
@@ -69,33 +82,14 @@ def format_time(seconds):
     remaining_seconds = remaining_seconds % 60
     return f"{hours} ชั่วโมง {minutes} นาที {remaining_seconds:.2f} วินาที ({seconds:.2f} วินาที)"
 
-# ฟังก์ชันเรียก Ollama API
-def query_ollama(prompt, error_log, question_id, query, num_ctx):
-    url = "http://localhost:11434/api/generate"
-    payload = {
-        "model": "gemma3:12b",
-        "prompt": prompt,
-        "stream": False,
-        "options": {"num_ctx": num_ctx}
-    }
-    start_time = time.time()
-    try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        if 'response' not in data:
-            print(f"Ollama returned: {json.dumps(data, indent=2)}")
-            raise ValueError("Invalid response format: 'response' key missing")
-        end_time = time.time()
-        generation_time = end_time - start_time
-        return data['response'].strip(), generation_time
-    except (requests.RequestException, ValueError) as e:
-        print(f"Error for Question ID {question_id}: {e}")
-        error_log.append({"question_id": question_id, "query": query, "error": str(e)})
-        return "", -1
+# LLM client กลาง (connection pool, timeout และ retry)
+llm_client = create_client("ollama", model="gemma3:12b")
+
+# cross-encoder สำหรับ rerank (โหลดโมเดลเมื่อใช้งานครั้งแรก)
+reranker = CrossEncoderReranker()
 
 # โหลดโมเดล embedding
-embedding_model = SentenceTransformer('BAAI/bge-m3')
+embedding_model = CachedEncoder('BAAI/bge-m3')
 
 # กำหนด path สำหรับ Vector Store
 persist_directory = "../embed_and_vector_store/vector_store/"
@@ -105,19 +99,12 @@ client = chromadb.PersistentClient(path=persist_directory)
 train_collection_name = "bird_train_set_evidence_bge_m3"
 train_collection = client.get_collection(train_collection_name)
 
-# ฟังก์ชัน Similarity Search (Top N) พร้อม filter ภาษา
-def perform_similarity_search(query_text, lang="en", top_n=10):
-    query_embedding = embedding_model.encode([query_text]).tolist()[0]
-    results = train_collection.query(
-        query_embeddings=[query_embedding],
-        n_results=top_n,
-        where={"language": lang}
-    )
-    ids = results["ids"][0]
-    documents = results["documents"][0]
-    metadatas = results["metadatas"][0]
-    distances = results["distances"][0]
-    return ids, documents, metadatas, distances
+# path ของ NumPy exact kNN index (ใช้เมื่อเลือก --search_backend numpy)
+numpy_index_dir = os.path.join("../embed_and_vector_store/numpy_index/", train_collection_name)
+
+# ฟังก์ชัน Similarity Search (Top N) แบบ batch ทั้ง test set พร้อม filter ภาษา (จัดกลุ่ม query ตามภาษา)
+def perform_batch_similarity_search(search_index, query_texts, langs, top_n=15, cache=None):
+    return batch_similarity_search(search_index, embedding_model, query_texts, langs=langs, top_n=top_n, cache=cache)
 
 # ฟังก์ชันคัดกรองด้วย LLM เพื่อเลือก Top K
 def rerank_with_llm(original_query, question_id, ids, documents, metadatas, distances, top_k=3):
@@ -163,7 +150,7 @@ Candidate Evidence (with similarity scores):
     print(f"Dynamic num_ctx for reranking: {num_ctx}")
 
     error_log = []
-    response, rerank_time = query_ollama(prompt, error_log, f"rerank_q{question_id}", original_query, num_ctx)
+    response, rerank_time = query_llm(llm_client, prompt, error_log, {"question_id": f"rerank_q{question_id}", "query": original_query}, num_ctx)
     print(f"\n\nCheck response: {response}\n\n")
     
     # บันทึกข้อมูลโทเค็นของ rerank
@@ -194,8 +181,24 @@ Candidate Evidence (with similarity scores):
     return top_indices, rerank_time
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--search_backend', choices=['chroma', 'numpy'], default='chroma')
+    parser.add_argument('--quantization', choices=['float32', 'float16', 'int8'], default='float32')
+    parser.add_argument('--rebuild_index', action='store_true', help='re-export the NumPy index from the collection (e.g. after records were updated in place)')
+    parser.add_argument('--reranker', choices=['cross_encoder', 'llm'], default='cross_encoder')
+    parser.add_argument('--llm_tie_break', action='store_true', help='ask the LLM only for near-ties at the top-k cut (cross_encoder)')
+    parser.add_argument('--no_retrieval_cache', action='store_true', help='always re-run the similarity search')
+    args = parser.parse_args()
+
+    # เลือก backend สำหรับ Similarity Search (chroma หรือ NumPy exact kNN, ใช้ float16/int8 ได้เมื่อเป็น numpy)
+    search_index = load_search_index(args.search_backend, train_collection, numpy_index_dir, quantization=args.quantization, rebuild=args.rebuild_index)
+    print(f"Search backend: {args.search_backend} ({args.quantization})")
+
+    # cache ผลลัพธ์ Similarity Search (ใช้ซ้ำได้เมื่อ collection, คำถาม, ภาษา และ top_n เหมือนเดิม)
+    retrieval_cache = None if args.no_retrieval_cache else RetrievalCache(search_index, embedding_model.model_name)
+
     # ทดสอบการเชื่อมต่อกับ Ollama API
-    response, generation_time = query_ollama("Test prompt", [], "test_question_id", "Test query", num_ctx=2048)
+    response, generation_time = query_llm(llm_client, "Test prompt", [], {"question_id": "test_question_id", "query": "Test query"}, num_ctx=2048)
     print("Ollama Response:", response)
     print(f"Generation Time: {format_time(generation_time)}\n\n")
 
@@ -211,19 +214,15 @@ def main():
     
     overall_start_time = time.time()
 
-    for i, item in enumerate(data):
-
-        print(f"Processed Test question {i+1}/{total_data}")
-        question_id = item['question_id']
-        question = item['question']
-        question_th = item.get('question_th')
-
+    # ตรวจจับภาษาของทุกคำถามก่อน เพื่อทำ Similarity Search แบบ batch ครั้งเดียว
+    query_texts = []
+    query_langs = []
+    for item in data:
         # เลือกคำถามที่ใช้
-        query_text = question_th
+        query_text = item.get('question_th')
 
         # ตรวจจับภาษา
         lang = detect_language(query_text)
-        #print(f"Detected Language: {lang} | Query: {query_text}")
 
         if lang in ["en", "th"]:
             lang_count_log[lang] += 1
@@ -234,12 +233,25 @@ def main():
         if lang not in ['en', 'th']:
             lang = 'en'
 
-        # Similarity Search (Top N)
+        query_texts.append(query_text)
+        query_langs.append(lang)
+
+    # Similarity Search (Top N) ของทุกคำถาม
+    search_start_time = time.time()
+    search_results = perform_batch_similarity_search(search_index, query_texts, query_langs, top_n=top_n, cache=retrieval_cache)
+    print(f"Batch Similarity Search Time: {format_time(time.time() - search_start_time)} for {total_data} questions")
+
+    for i, item in enumerate(data):
+
+        print(f"Processed Test question {i+1}/{total_data}")
+        question_id = item['question_id']
+        query_text = query_texts[i]
+
         print(f"\n=== Processing Question ID: {question_id} ===")
         print(f"Original Query: {query_text}")
-        ids, documents, metadatas, distances = perform_similarity_search(query_text, lang=lang, top_n=top_n)
+        ids, documents, metadatas, distances = search_results[i]
 
-        print(f"\nInitial Top {top_n} Results (Before LLM Reranking):")
+        print(f"\nInitial Top {top_n} Results (Before Reranking):")
         has_matching_id_top_n = False
         for j, (doc_id, doc, meta, dist) in enumerate(zip(ids, documents, metadatas, distances)):
             evidence_number_top_n = int(re.search(r'q(\d+)_', doc_id).group(1)) if re.search(r'q(\d+)_', doc_id) else None
@@ -260,10 +272,17 @@ def main():
         else:
             id_match_log_top_n["incorrect"] += 1
         
-        # คัดกรองด้วย LLM เพื่อเลือก Top K
-        top_indices, rerank_time = rerank_with_llm(query_text, question_id, ids, documents, metadatas, distances, top_k=top_k)
+        # คัดกรองด้วย cross-encoder (ค่าเริ่มต้น) หรือ LLM เพื่อเลือก Top K
+        if args.reranker == 'llm':
+            top_indices, rerank_time = rerank_with_llm(query_text, question_id, ids, documents, metadatas, distances, top_k=top_k)
+        else:
+            candidates = [meta['evidence'] for meta in metadatas]
+            top_indices, rerank_time = rerank_candidates(reranker, query_text, candidates, top_k, question_id=question_id,
+                                                         client=llm_client if args.llm_tie_break else None, error_log=error_log,
+                                                         token_log=token_log, token_counter=lambda prompt: count_tokens(prompt, question_id, query_text))
+            print(f"\nCross-encoder reranking time: {format_time(rerank_time)}")
         
-        print(f"\nTop {top_k} Results (After LLM Reranking):")
+        print(f"\nTop {top_k} Results (After {'LLM' if args.reranker == 'llm' else 'Cross-Encoder'} Reranking):")
         has_matching_id_top_k = False
         for j, idx in enumerate(top_indices):
             meta = metadatas[idx]
@@ -304,6 +323,18 @@ def main():
     else:
         print("No queries exceeded the token limit.")
 
+    # แสดง Error Summary (error จาก LLM tie-break ตอน rerank)
+    print("\n=== Error Summary ===")
+    if error_log:
+        print(f"Total errors: {len(error_log)}")
+        for error in error_log:
+            print(f"Question ID: {error['question_id']}")
+            print(f"Question: {error['question']}")
+            print(f"Error Message: {error['error']}")
+            print("--------------------")
+    else:
+        print("No errors occurred during reranking.")
+
     # แสดง ID Match Summary
     print(f"\n=== ID Match Summary for Top-N = {top_n} ===")
     print(f"Number of questions with matching ID in Top N: {id_match_log_top_n['correct']}")
@@ -1,8 +1,16 @@
 import json
-import requests
 import time
 import chromadb
-from sentence_transformers import SentenceTransformer
+import os
+import sys
+
+# เพิ่ม root ของ repo ใน sys.path เพื่อ import โมดูลที่ใช้ร่วมกัน
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from embed_and_vector_store.embedding_cache import CachedEncoder
+from embed_and_vector_store.retrieval import batch_similarity_search
+from embed_and_vector_store.retrieval_cache import RetrievalCache
+from embed_and_vector_store.reranker import CrossEncoderReranker, rerank_candidates
+from gensql_common.llm_client import create_client, query_llm
 
 # ฟังก์ชันแปลงเวลาจากวินาทีเป็นนาที+วินาที
 def format_time(seconds):
@@ -14,35 +22,27 @@ def format_time(seconds):
     remaining_seconds = seconds % 60
     return f"{minutes} นาที {remaining_seconds:.2f} วินาที ({seconds:.2f} วินาที)"
 
-# ฟังก์ชันเรียก Ollama API
-def query_ollama(prompt, error_log, question_id, question):
-    url = "http://localhost:11434/api/generate"
-    payload = {
-        "model": "gemma3:12b",
-        "prompt": prompt,
-        "stream": False
-    }
-    start_time = time.time()
-    try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        end_time = time.time()
-        generation_time = end_time - start_time
-        return response.json()['response'].strip(), generation_time
-    except Exception as e:
-        print(f"Error for Question ID {question_id}: {e}")
-        error_log.append({"question_id": question_id, "question": question, "error": str(e)})
-        return "", -1
+# สร้าง list สำหรับเก็บ error จากการเรียก LLM (เช่น tie-break ตอน rerank)
+error_log = []
+
+# LLM client กลาง (connection pool, timeout และ retry)
+llm_client = create_client("ollama", model="gemma3:12b")
+
+# cross-encoder สำหรับ rerank (โหลดโมเดลเมื่อใช้งานครั้งแรก)
+# ตั้ง RERANKER = "llm" เพื่อใช้ rerank_with_llm แบบเดิม, LLM_TIE_BREAK = True เพื่อให้ LLM ตัดสินเฉพาะ candidate ที่คะแนนใกล้กัน
+RERANKER = "cross_encoder"
+LLM_TIE_BREAK = False
+reranker = CrossEncoderReranker()
 
 # โหลดโมเดล embedding
-embedding_model = SentenceTransformer('BAAI/bge-m3')
+embedding_model = CachedEncoder('BAAI/bge-m3')
 
 # กำหนด path สำหรับ Vector Store
 persist_directory = "../embed_and_vector_store/vector_store/"
 client = chromadb.PersistentClient(path=persist_directory)
 
 # ทดสอบการเชื่อมต่อกับ Ollama API
-response, generation_time = query_ollama("Test prompt", [], "test_question_id", "Test question")
+response, generation_time = query_llm(llm_client, "Test prompt", [], {"question_id": "test_question_id", "question": "Test question"})
 print("Ollama Response:", response)
 print("Generation Time:", format_time(generation_time))
 
@@ -50,15 +50,16 @@ print("Generation Time:", format_time(generation_time))
 train_collection_name = "bird_train_rag_bge_m3_cosine"
 train_collection = client.get_collection(train_collection_name)
 
-# ฟังก์ชัน Similarity Search (Top N)
-def perform_similarity_search(query_text, top_n=10):
-    query_embedding = embedding_model.encode([query_text]).tolist()[0]
-    results = train_collection.query(
-        query_embeddings=[query_embedding],
-        n_results=top_n
-    )
-    languages = [meta["language"] for meta in results["metadatas"][0]]  # ดึง language จาก metadata
-    return results["documents"][0], results["metadatas"][0], results["distances"][0], languages
+# cache ผลลัพธ์ Similarity Search (ใช้ซ้ำได้เมื่อ collection, คำถาม และ top_n เหมือนเดิม)
+retrieval_cache = RetrievalCache(train_collection, embedding_model.model_name)
+
+# ฟังก์ชัน Similarity Search (Top N) แบบ batch ทุกคำถามในครั้งเดียว
+def perform_batch_similarity_search(query_texts, top_n=10):
+    results = []
+    for ids, documents, metadatas, distances in batch_similarity_search(train_collection, embedding_model, query_texts, top_n=top_n, cache=retrieval_cache):
+        languages = [meta["language"] for meta in metadatas]  # ดึง language จาก metadata
+        results.append((documents, metadatas, distances, languages))
+    return results
 
 # ฟังก์ชันคัดกรองด้วย LLM เพื่อเลือก Top K
 def rerank_with_llm(original_query, documents, metadatas, top_k=3):
@@ -84,7 +85,7 @@ Candidate Questions:
 - Do not include explanations or additional text."""
 
     error_log = []
-    response, _ = query_ollama(prompt, error_log, "rerank", original_query)
+    response, _ = query_llm(llm_client, prompt, error_log, {"question_id": "rerank", "question": original_query})
     print(f"\n\nCheck response: {response}\n\n")
     
     if not response or error_log:
@@ -117,22 +118,22 @@ with open(dev_file, 'r', encoding='utf-8') as f:
 # ประมวลผล Dev set
 overall_start_time = time.time()
 results = []
+dev_subset = dev_data[:3]  # ทดสอบ 3 คำถามแรก
+
+# เลือกคำถามที่ใช้ (ถ้ามี question_th ใช้ก่อน ถ้าไม่มีใช้ question) แล้วทำ Similarity Search (Top N) ทุกคำถามในครั้งเดียว
+query_texts = [item.get('question_th') or item['question'] for item in dev_subset]
+search_results = perform_batch_similarity_search(query_texts, top_n=10)
 
-for i, item in enumerate(dev_data[:3]):  # ทดสอบ 3 คำถามแรก
+for i, item in enumerate(dev_subset):
     question_id = item['question_id']
-    question = item['question']
-    question_th = item.get('question_th')
     # difficulty = item.get('difficulty')
+    query_text = query_texts[i]
 
-    # เลือกคำถามที่ใช้ (ถ้ามี question_th ใช้ก่อน ถ้าไม่มีใช้ question)
-    query_text = question_th if question_th else question
-
-    # Similarity Search (Top N)
     print(f"\n=== Processing Question ID: {question_id} ===")
     print(f"Original Query: {query_text}")
-    documents, metadatas, distances, languages = perform_similarity_search(query_text, top_n=10)
+    documents, metadatas, distances, languages = search_results[i]
 
-    print("\nInitial Top 10 Results (Before LLM Reranking):")
+    print("\nInitial Top 10 Results (Before Reranking):")
     for j, (doc, meta, dist, lang) in enumerate(zip(documents, metadatas, distances, languages)):
         print(f"Result {j+1}:")
         print(f"Similarity Score: {1 - dist:.4f}")
@@ -143,12 +144,19 @@ for i, item in enumerate(dev_data[:3]):  # ทดสอบ 3 คำถามแ
         print(f"Table: {meta['table']}")
         print("---")
 
-    # คัดกรองด้วย LLM เพื่อเลือก Top K
+    # คัดกรองด้วย cross-encoder (ค่าเริ่มต้น) หรือ LLM เพื่อเลือก Top K
     top_k = 3
-    top_indices = rerank_with_llm(query_text, documents, metadatas, top_k=top_k)
+    if RERANKER == "llm":
+        top_indices = rerank_with_llm(query_text, documents, metadatas, top_k=top_k)
+    else:
+        # เปรียบเทียบคำถามกับคำถามของ candidate ทั้งภาษาอังกฤษและภาษาไทย
+        candidates = [f"{meta['question_eng']}\n{meta['question_th']}" for meta in metadatas]
+        top_indices, rerank_time = rerank_candidates(reranker, query_text, candidates, top_k, question_id=question_id,
+                                                     client=llm_client if LLM_TIE_BREAK else None, error_log=error_log)
+        print(f"\nCross-encoder reranking time: {format_time(rerank_time)}")
     
     # print(f"\n\nCheck Top K: {top_indices}\n\n")
-    print(f"\nTop {top_k} Results (After LLM Reranking):")
+    print(f"\nTop {top_k} Results (After {'LLM' if RERANKER == 'llm' else 'Cross-Encoder'} Reranking):")
     for j, idx in enumerate(top_indices):
         meta = metadatas[idx]
         lang = languages[idx]
@@ -182,4 +190,16 @@ with open('bird/exp_result/reranked_test.json', 'w', encoding='utf-8') as f:
 
 overall_end_time = time.time()
 overall_time = overall_end_time - overall_start_time
-print(f"\n=== Overall Processing Time: {format_time(overall_time)} ===")
\ No newline at end of file
+print(f"\n=== Overall Processing Time: {format_time(overall_time)} ===")
+
+# แสดง Error Summary (error จาก LLM tie-break ตอน rerank)
+print("\n=== Error Summary ===")
+if error_log:
+    print(f"Total errors: {len(error_log)}")
+    for error in error_log:
+        print(f"Question ID: {error['question_id']}")
+        print(f"Question: {error['question']}")
+        print(f"Error Message: {error['error']}")
+        print("--------------------")
+else:
+    print("No errors occurred during reranking.")